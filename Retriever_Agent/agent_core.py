@@ -1,102 +1,40 @@
-import os
+import asyncio
+import contextvars
+import json
 from dotenv import load_dotenv
-from langchain_text_splitters import CharacterTextSplitter
-from glob import glob
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.tools import tool
-from sqlalchemy import create_engine, text
-from langchain_groq import ChatGroq
-from langchain.agents import create_agent
-from langchain_core.prompts import ChatPromptTemplate
+from concurrency import Busy
 from output_formatter import format_output
+from resources import Resources, get_resources, lazy_property, warm_up
+from tracing import get_tracer
 
-class SQLAgent:
-    def __init__(self):
-        load_dotenv()
-        self.db_uname = os.environ.get("DB_UNAME")
-        self.db_pass = os.environ.get("DB_PASS")
-        self.groq_api_key = os.environ.get("GROQ_API_KEY")
-        self.db_ip = "localhost"
-        self.db_port = "5432"
-        self.database = "postgres"
-        self.engine = self._create_db_engine()
-        self.llm = self._initialize_llm()
-        self.schema_retriever = self._setup_vector_store()
-        self.agent = self._create_agent()
-
-    def _create_db_engine(self):
-        return create_engine(
-            f"postgresql+psycopg2://{self.db_uname}:{self.db_pass}@{self.db_ip}:{self.db_port}/{self.database}"
-        )
-
-    def _initialize_llm(self):
-        return ChatGroq(model="llama3-8b-8192", temperature=0, api_key=self.groq_api_key)
+# langchain, the embedding model, Chroma and the database driver are imported
+# where they are first used, so importing this module (and starting a Gradio
+# worker) stays cheap; see import_budget.py
 
-    def _setup_vector_store(self):
-        text_splitter = CharacterTextSplitter(
-            separator="###",
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            is_separator_regex=False,
-        )
-        texts = []
-        for file_path in glob("docs/*.txt"):
-            with open(file_path, "r") as f:
-                doc = f.read()
-            file_chunks = text_splitter.create_documents(
-                [doc], metadatas=[{"source": file_path}]
-            )
-            texts.extend(file_chunks)
+# the session the current question is asked in; query_vecdb reads it to reuse
+# the schema context a follow-up's earlier turns already retrieved
+_session = contextvars.ContextVar("session", default=None)
 
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        schema_store = Chroma.from_documents(
-            texts, embedding=embeddings, collection_name="schema_rag"
-        )
-        return schema_store.as_retriever(k=4)
-
-    def _create_agent(self):
-        @tool
-        def query_vecdb(question: str) -> str:
-            """
-            Retrieve relevant database schema and business rules based on the user question.
-            Always call this before generating SQL.
-            """
-            docs = self.schema_retriever.invoke(question)
-            return "\n\n".join(d.page_content for d in docs)
+# earlier turns replayed to the agent on a follow-up, and how much of each answer
+SESSION_HISTORY_TURNS = 3
+SESSION_ANSWER_CHARS = 600
 
-        @tool
-        def run_sql_query(query: str) -> str:
-            """Execute a validated read-only SQL query and return the raw result."""
-            print("\n--- SQL GENERATED ---")
-            print(query)
-            try:
-                with self.engine.connect() as conn:
-                    result = conn.execute(text(query))
-                    rows = result.mappings().all()
-                    return rows
-            except Exception as e:
-                return f"Error executing query: {e}"
+def _statement_attributes(query: str, params: dict = None) -> dict:
+    # bind values go with the statement, so the workload in the trace file
+    # can be re-run (index_advisor.py)
+    return {"db.statement": query, "db.params": json.dumps(params, default=str) if params else None}
 
-        @tool
-        def request_clarification(reason: str) -> str:
-            """Ask the user for clarification before generating SQL."""
-            return f"CLARIFICATION_NEEDED: {reason}"
 
-        tools = [query_vecdb, run_sql_query, request_clarification]
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """
+SYSTEM_PROMPT = """
 You are an expert PostgreSQL query assistant for a banking database. Your primary goal is to help users by understanding their natural language questions, generating accurate SQL queries, and providing answers in a clear, human-readable format.
 
 **Your Operating Procedure:**
 
 1.  **Understand the User's Goal:** Analyze the user's question to determine their intent.
 
-2.  **Consult the Knowledge Base:** ALWAYS start by using the `query_vecdb` tool with the user's question. This tool provides you with critical information about the database schema, business rules, and JOIN relationships. This is your primary source of truth for how to query the database.
+2.  **Consult the Knowledge Base:** ALWAYS start from the output of the `query_vecdb` tool for the user's question. This tool provides you with critical information about the database schema, business rules, and JOIN relationships. This is your primary source of truth for how to query the database.
+    *   Its output, and the `get_table_schema` and `get_join_path` outputs for the tables the question names, are usually already in the conversation. Do not call these tools again for the same input.
+    *   When you need several more lookups, request them all in the same turn; they run in parallel.
 
 3.  **Ask for Clarification (If Necessary):**
     *   If the user's question is ambiguous (e.g., "show me John's data"), or a term is vague ("top customers", "recent activity"), you MUST use the `request_clarification` tool to ask for more specific information.
@@ -106,6 +44,7 @@ You are an expert PostgreSQL query assistant for a banking database. Your primar
     *   Based on the user's intent and the information from the knowledge base, construct a single, syntactically correct PostgreSQL SELECT query.
     *   **CRITICAL RULE**: You MUST apply the `deleted_at IS NULL` filter for every table involved in the query unless the user explicitly asks for historical or deleted data.
     *   Do not invent table or column names. Only use what is described in the knowledge base.
+    *   Use `get_table_schema` to confirm columns and allowed values, and `get_join_path` for the JOIN conditions between tables.
 
 5.  **Execute the Query:**
     *   Use the `run_sql_query` tool to execute the query.
@@ -120,33 +59,541 @@ You are an expert PostgreSQL query assistant for a banking database. Your primar
 *   You are a read-only assistant. You MUST NOT generate any SQL that modifies the database (no INSERT, UPDATE, DELETE, etc.).
 *   Never expose sensitive information like user passwords.
 *   Do not respond with the SQL query itself, only the final, formatted answer.
-"""),
-            ("human", "{input}"),
-            ("placeholder", "{agent_scratchpad}")
-        ])
+"""
+
+
+class SQLAgent:
+    """
+    Answers questions through the plan cache, the intent router or the agent.
+
+    Construction is cheap: the LLM client, the embedding model, the vector
+    store, the caches and the agent graph are built on first use, or ahead
+    of time by `warm_up`.
+    """
+
+    def __init__(self, resources: Resources = None, llm=None):
+        load_dotenv()
+        self.resources = resources or get_resources()
+        self.tracer = get_tracer()
+        if llm is not None:
+            self.llm = llm
+
+    @property
+    def engine(self):
+        return self.resources.engine
+
+    @lazy_property
+    def callbacks(self):
+        # one handler for every run: it turns LLM and tool calls into spans
+        return [self.tracer.callback_handler()]
+
+    @lazy_property(depends=("llm:llama3-8b-8192",))
+    def llm(self):
+        return self.resources.llm("llama3-8b-8192")
+
+    # rebuilt when refresh_if_changed() or invalidate() drops what they were
+    # built from, so a long-lived agent follows docs/ and configuration
+    @lazy_property(depends=("retriever",))
+    def schema_retriever(self):
+        return self.resources.retriever
+
+    @lazy_property(depends=("embeddings",))
+    def plan_cache(self):
+        from plan_cache import PlanCache
+        return PlanCache(self.resources.embeddings)
+
+    @lazy_property(depends=("embeddings",))
+    def router(self):
+        from intent_router import IntentRouter
+        return IntentRouter(self.resources.embeddings)
+
+    @lazy_property(depends=("catalog",))
+    def tools(self) -> dict:
+        return {t.name: t for t in self._create_tools()}
+
+    @lazy_property(depends=("catalog",))
+    def prefetcher(self):
+        from prefetch import Prefetcher
+        return Prefetcher(self.tools)
+
+    @lazy_property(depends=("catalog", "llm:llama3-8b-8192"))
+    def agent(self):
+        return self._create_agent()
+
+    def warm_up(self, background: bool = True):
+        """
+        Build everything a first question needs: the shared resources, the
+        router's example embeddings and the agent graph.
+
+        Args:
+            background: Build on a daemon thread and return it instead of blocking.
+        """
+        def build():
+            self.resources.warm_up(background=False)
+            # the first encode pays for lazy torch initialisation
+            self.resources.embeddings.embed_query("warm up")
+            self.router.warm_up()
+            self.plan_cache
+            self.prefetcher
+            self.agent
+        return warm_up(build, "agent-warm-up", background)
+
+    def _run_query(self, query: str, params: dict = None, keep_open: bool = False):
+        return self.resources.pager.open(query, params, keep_open=keep_open)
+
+    def _guarded(self, query: str, trusted: bool) -> str:
+        # templates from the intent router are known good; everything else
+        # is parsed, filtered on deleted_at and LIMIT-clamped
+        return query if trusted else self.resources.guard.rewrite(query)
+
+    def _from_rollup(self, query: str, span) -> str:
+        # aggregates a materialized rollup answers exactly are read from it;
+        # the result is still cached under (and reported as) the query asked
+        matched = self.resources.rollups.match(query)
+        span.set(**{"db.statement": matched[1] if matched else query, "db.rollup": matched and matched[0]})
+        return matched[1] if matched else query
+
+    def _execute(self, query: str, params: dict = None, trusted: bool = False, keep_open: bool = False):
+        """Run `query` through the SQL guard, the rollups and the result cache;
+        the returned dict carries the SQL asked for, the first page of rows,
+        the total row count and, with `keep_open`, a cursor id for `page`."""
+        opened = {}
+
+        def run():
+            result = self._run_query(executed, params, keep_open=keep_open)
+            # the cursor belongs to this caller only, never to the cache
+            opened["cursor_id"] = result.pop("cursor_id")
+            return result
+
+        with self.tracer.span("sql.execute", **_statement_attributes(query, params)) as span:
+            query = self._guarded(query, trusted)
+            executed = self._from_rollup(query, span)
+            result = dict(self.resources.result_cache.fetch(query, run, params=params))
+            span.set(**{"db.rows": result["total_rows"], "cache.hit": "cursor_id" not in opened})
+        result["cursor_id"] = opened.get("cursor_id")
+        result["sql"] = query
+        return result
+
+    async def _aexecute(self, query: str, params: dict = None, trusted: bool = False):
+        """Async `_execute` on the async engine; results carry no cursor id."""
+        ran = []
+
+        from result_stream import stream_first_page
+
+        async def run():
+            result = await stream_first_page(
+                self.resources.async_engine, executed, params, guard=self.resources.guard
+            )
+            result.pop("cursor_id")
+            ran.append(True)
+            return result
+
+        with self.tracer.span("sql.execute", **_statement_attributes(query, params)) as span:
+            query = self._guarded(query, trusted)
+            executed = await asyncio.to_thread(self._from_rollup, query, span)
+            result = dict(await self.resources.result_cache.afetch(query, run, params=params))
+            span.set(**{"db.rows": result["total_rows"], "cache.hit": not ran})
+        result["cursor_id"] = None
+        result["sql"] = query
+        return result
+
+    def execute(self, query: str, params: dict = None, keep_open: bool = False) -> dict:
+        """
+        Run a query the way the agent's SQL tool does, for UIs with a tool of
+        their own.
+
+        Args:
+            query: SQL to run; it goes through the SQL guard, the rollups and
+                the result cache.
+            params: Bind parameters of the query.
+            keep_open: Keep a cursor for `page` when the first page does not
+                hold the whole result.
+
+        Returns:
+            A dict with `sql` (the guarded query), `columns`, `rows` (first
+            page), `total_rows`, `total_is_exact`, `truncated` and `cursor_id`.
+        """
+        return self._execute(query, params, keep_open=keep_open)
+
+    def page(self, cursor_id: str, page: int) -> dict:
+        """Fetch a later page of a result run with `keep_open`."""
+        return self.resources.pager.fetch(cursor_id, page)
+
+    def _create_tools(self) -> list:
+        from langchain_core.tools import StructuredTool, tool
+        from context_budget import summarize_result
+        from schema_catalog import catalog_tools
+
+        def query_vecdb(question: str) -> str:
+            """
+            Retrieve relevant database schema and business rules based on the user question.
+            Always call this before generating SQL.
+            """
+            session = _session.get()
+            with self.tracer.span("retrieval") as span:
+                # a "refine" may ask about tables the earlier context lacks
+                if session is not None and session.follow_up not in (None, "refine") and session.schema_context:
+                    span.set(**{"cache.hit": True, "retrieval.chars": len(session.schema_context)})
+                    return session.schema_context
+                docs = self.schema_retriever.invoke(question)
+                context = "\n\n".join(d.page_content for d in docs)
+                chunks = [
+                    {"id": d.metadata.get("content_hash"), "title": d.metadata.get("title") or d.metadata.get("section")}
+                    for d in docs
+                ]
+                span.set(**{
+                    "retrieval.documents": len(docs), "retrieval.chars": len(context),
+                    "retrieval.chunks": json.dumps(chunks),
+                })
+            if session is not None:
+                session.remember_schema(context)
+            return context
+
+        async def aquery_vecdb(question: str) -> str:
+            # embedding the question is CPU bound; keep it off the event loop
+            return await asyncio.to_thread(query_vecdb, question)
+
+        def run_sql_query(query: str):
+            """Execute a validated read-only SQL query and return the total row count, columns and first rows."""
+            try:
+                result = self._execute(query)
+            except Exception as e:
+                return f"Error executing query: {e}", None
+            return summarize_result(result), result
+
+        async def arun_sql_query(query: str):
+            try:
+                result = await self._aexecute(query)
+            except Exception as e:
+                return f"Error executing query: {e}", None
+            return summarize_result(result), result
+
+        @tool
+        def request_clarification(reason: str) -> str:
+            """Ask the user for clarification before generating SQL."""
+            return f"CLARIFICATION_NEEDED: {reason}"
+
+        tools = [
+            StructuredTool.from_function(func=query_vecdb, coroutine=aquery_vecdb),
+            StructuredTool.from_function(
+                func=run_sql_query, coroutine=arun_sql_query, response_format="content_and_artifact"
+            ),
+            request_clarification,
+        ]
+        tools += catalog_tools(self.resources.catalog)
+        return tools
+
+    def _create_agent(self):
+        from langchain.agents import create_agent
+        from context_budget import middleware
+
+        # tool outputs are compacted and capped before every model call, so
+        # retries late in a run do not resend every earlier schema dump
+        agent = create_agent(
+            model=self.llm, tools=list(self.tools.values()), system_prompt=SYSTEM_PROMPT,
+            middleware=[middleware()],
+        )
 
-        agent = create_agent(model=self.llm, tools=tools, system_prompt=prompt)
-        
         return agent
 
-    def invoke(self, question: str):
+    def _format_answer(self, question: str, result: dict):
+        with self.tracer.span("format_output", **{"db.rows": len(result["rows"])}):
+            return format_output(
+                question, result["rows"], columns=result["columns"],
+                total_rows=result["total_rows"], sql=result["sql"],
+            )
+
+    def _answer_with(self, question: str, sql: str, params: dict = None, trusted: bool = False):
+        result = self._execute(sql, params, trusted=trusted)
+        return {
+            "answer": self._format_answer(question, result),
+            "sql": result["sql"],
+            "params": params,
+            "result": result,
+        }
+
+    async def _aanswer_with(self, question: str, sql: str, params: dict = None, trusted: bool = False):
+        result = await self._aexecute(sql, params, trusted=trusted)
+        answer = await asyncio.to_thread(self._format_answer, question, result)
+        return {"answer": answer, "sql": result["sql"], "params": params, "result": result}
+
+    def _from_plan_cache(self, question: str):
+        with self.tracer.span("plan_cache.lookup") as span:
+            sql = self.plan_cache.lookup(question)
+            span.set(**{"cache.hit": sql is not None})
+        if sql is None:
+            return None
+        try:
+            return self._answer_with(question, sql)
+        except Exception:
+            # schema drifted under the cached plan; let the agent redo it
+            self.plan_cache.evict(sql)
+            return None
+
+    async def _afrom_plan_cache(self, question: str):
+        with self.tracer.span("plan_cache.lookup") as span:
+            sql = await asyncio.to_thread(self.plan_cache.lookup, question)
+            span.set(**{"cache.hit": sql is not None})
+        if sql is None:
+            return None
+        try:
+            return await self._aanswer_with(question, sql)
+        except Exception:
+            self.plan_cache.evict(sql)
+            return None
+
+    def _from_router(self, question: str):
+        with self.tracer.span("router.route") as span:
+            routed = self.router.route(question)
+            span.set(**{"router.intent": routed and routed["intent"]})
+        if routed is None:
+            return None
+        return self._answer_with(question, routed["sql"], routed["params"], trusted=True)
+
+    async def _afrom_router(self, question: str):
+        with self.tracer.span("router.route") as span:
+            routed = await asyncio.to_thread(self.router.route, question)
+            span.set(**{"router.intent": routed and routed["intent"]})
+        if routed is None:
+            return None
+        return await self._aanswer_with(question, routed["sql"], routed["params"], trusted=True)
+
+    def _read_agent_result(self, question: str, result: dict, cache_plan: bool = True) -> dict:
+        messages = result.get("messages", [])
+        for message in messages:
+            if str(message.content).startswith("CLARIFICATION_NEEDED"):
+                return {"answer": message.content, "sql": None, "result": None}
+
+        # the last query that ran successfully is the one the answer rests on
+        executed = [
+            m.artifact for m in messages
+            if getattr(m, "name", None) == "run_sql_query" and getattr(m, "artifact", None)
+        ]
+        # a follow-up only means something next to the turns before it
+        if executed and cache_plan:
+            self.plan_cache.store(question, executed[-1]["sql"])
+        return {
+            "answer": messages[-1].content if messages else "",
+            "sql": executed[-1]["sql"] if executed else None,
+            "result": executed[-1] if executed else None,
+        }
+
+    def _agent_messages(self, question: str, session=None, kind: str = None) -> list:
+        """The question, preceded on a follow-up by the session's last turns and
+        followed by the query it refines."""
+        if kind is None:
+            return [{"role": "user", "content": question}]
+        from context_budget import summarize_result
+
+        messages = []
+        for turn in session.turns[-SESSION_HISTORY_TURNS:]:
+            answer = str(turn["answer"])
+            if len(answer) > SESSION_ANSWER_CHARS:
+                answer = answer[:SESSION_ANSWER_CHARS] + " ..."
+            messages += [{"role": "user", "content": turn["question"]},
+                         {"role": "assistant", "content": answer}]
+        content = question
+        if kind == "refine" and session.last:
+            last = session.last
+            content += (
+                f"\n\n(This refines the earlier question \"{last['question']}\".\n"
+                f"SQL it ran: {last['sql']}\n"
+                f"Its result: {summarize_result(last, rows=5)})"
+            )
+        return messages + [{"role": "user", "content": content}]
+
+    def _from_agent(self, question: str, session=None, kind: str = None):
+        # the lookups the first turn would ask for run up front, concurrently
+        config = {"callbacks": self.callbacks}
+        messages = self._agent_messages(question, session, kind)
+        messages += self.prefetcher.messages(question, config)
+        result = self.agent.invoke({"messages": messages}, config=config)
+        return self._read_agent_result(question, result, cache_plan=kind is None)
+
+    async def _afrom_agent(self, question: str, session=None, kind: str = None):
+        config = {"callbacks": self.callbacks}
+        messages = self._agent_messages(question, session, kind)
+        messages += await self.prefetcher.amessages(question, config)
+        result = await self.agent.ainvoke({"messages": messages}, config=config)
+        return await asyncio.to_thread(self._read_agent_result, question, result, kind is None)
+
+    @staticmethod
+    def _follow_up(question: str, session) -> str:
+        """How `question` builds on the session: 'clarified' when it answers a
+        clarification request, a `follow_up_kind` when it refines the last
+        query, None for a question of its own."""
+        from sessions import follow_up_kind
+
+        if session is None:
+            return None
+        if session.pending:
+            return "clarified"
+        return follow_up_kind(question) if session.last else None
+
+    def _refinement(self, question: str, session, kind: str):
+        """
+        A follow-up answered from the session without the agent.
+
+        Returns:
+            An answer dict, a (question, sql, params) triple to run, or None
+            when the agent has to do it.
+        """
+        from intent_router import BRANCH_RE
+        from output_formatter import markdown_table
+        from sessions import narrow_to_branch
+
+        last = session.last
+        if kind == "sql":
+            return {"answer": f"```sql\n{last['sql']}\n```", "sql": last["sql"], "result": None}
+        if kind == "table":
+            if last["total_rows"] > len(last["rows"]):
+                # only the first rows are kept; the result cache has the rest
+                return last["question"], last["sql"], last["params"]
+            table = markdown_table(last["rows"], last["columns"], last["total_rows"])
+            return {"answer": table, "sql": last["sql"], "result": None}
+        if kind == "branch":
+            return narrow_to_branch(last, f"Branch_{BRANCH_RE.search(question.lower()).group(1)}")
+        return None
+
+    def _from_session(self, question: str, session, kind: str):
+        refined = self._refinement(question, session, kind) if kind != "clarified" else None
+        if isinstance(refined, tuple):
+            asked, sql, params = refined
+            try:
+                refined = self._answer_with(asked, sql, params)
+            except Exception:
+                # the rewritten query did not pass the guard or failed; the
+                # agent gets the follow-up with the earlier query as context
+                return None
+            session.restated = asked
+        return refined
+
+    async def _afrom_session(self, question: str, session, kind: str):
+        refined = self._refinement(question, session, kind) if kind != "clarified" else None
+        if isinstance(refined, tuple):
+            asked, sql, params = refined
+            try:
+                refined = await self._aanswer_with(asked, sql, params)
+            except Exception:
+                return None
+            session.restated = asked
+        return refined
+
+    def _answer(self, question: str, session=None) -> dict:
+        kind = self._follow_up(question, session)
+        if kind is None:
+            return (
+                self._from_plan_cache(question)
+                or self._from_router(question)
+                or self._from_agent(question)
+            )
+        session.follow_up = kind
+        with self.tracer.span("session.follow_up", **{"session.follow_up": kind}):
+            return self._from_session(question, session, kind) or self._from_agent(question, session, kind)
+
+    async def _aanswer(self, question: str, session=None) -> dict:
+        kind = self._follow_up(question, session)
+        if kind is None:
+            return (
+                await self._afrom_plan_cache(question)
+                or await self._afrom_router(question)
+                or await self._afrom_agent(question)
+            )
+        session.follow_up = kind
+        with self.tracer.span("session.follow_up", **{"session.follow_up": kind}):
+            return (
+                await self._afrom_session(question, session, kind)
+                or await self._afrom_agent(question, session, kind)
+            )
+
+    def ask(self, question: str, session_id: str = None) -> dict:
+        """
+        Answer `question` and return the answer with the SQL and result behind it.
+
+        Args:
+            question: The user's question.
+            session_id: Conversation the question belongs to. Its earlier
+                turns, retrieved schema context and last query are loaded
+                from the session store (sessions.py), so a follow-up such as
+                "show it in a table format" or "only branch_1" refines the
+                last query instead of starting over; None asks without memory.
+
+        Returns:
+            A dict with `answer` (text), `sql` and `result` (columns, first
+            page of rows and total row count; its `cursor_id` is None, as
+            no cursor is kept for a caller that does not page);
+            `sql` and `result` are None when no query ran. Every step is
+            recorded as a span of one trace (see tracing.py), and the
+            question as a row of the query log (see query_log.py).
+        """
+        with self.resources.limiter.slot():
+            root = answer = None
+            try:
+                with self.tracer.trace("agent.ask", question=question, **{"session.id": session_id}) as root:
+                    session = self.resources.sessions.load(session_id) if session_id is not None else None
+                    token = _session.set(session)
+                    try:
+                        answer = self._answer(question, session)
+                    finally:
+                        _session.reset(token)
+                    if session is not None:
+                        self.resources.sessions.record(session, question, answer)
+                    root.set(**{"db.statement": answer["sql"]})
+                return answer
+            finally:
+                # once the trace has ended, so the row has every span
+                self.resources.query_log.record(root, answer)
+
+    async def aask(self, question: str, session_id: str = None) -> dict:
+        """Async `ask`: LLM calls use the client's async API, SQL runs on the
+        async engine and embedding work runs on worker threads."""
+        async with self.resources.limiter.aslot():
+            root = answer = None
+            try:
+                with self.tracer.trace("agent.ask", question=question, **{"session.id": session_id}) as root:
+                    session = None
+                    if session_id is not None:
+                        session = await asyncio.to_thread(self.resources.sessions.load, session_id)
+                    token = _session.set(session)
+                    try:
+                        answer = await self._aanswer(question, session)
+                    finally:
+                        _session.reset(token)
+                    if session is not None:
+                        await asyncio.to_thread(self.resources.sessions.record, session, question, answer)
+                    root.set(**{"db.statement": answer["sql"]})
+                return answer
+            finally:
+                # queued for the log's writer thread; nothing blocks here
+                self.resources.query_log.record(root, answer)
+
+    def invoke(self, question: str, session_id: str = None):
         try:
-            result = self.agent.invoke({
-                "input": question,
-            })
-            
-            output = result.get("output", "")
-            if "CLARIFICATION_NEEDED" in output:
-                return output
-            
-            if isinstance(output, list) and all(isinstance(i, dict) for i in output):
-                 return format_output(question, output)
-
-            return output
+            return self.ask(question, session_id)["answer"]
+        except Busy:
+            raise
+        except Exception as e:
+            return f"An error occurred: {e}"
 
+    async def ainvoke(self, question: str, session_id: str = None):
+        try:
+            return (await self.aask(question, session_id))["answer"]
+        except Busy:
+            raise
         except Exception as e:
             return f"An error occurred: {e}"
 
+    def cache_stats(self) -> dict:
+        stats = {
+            "plan_cache": self.plan_cache.stats(),
+            "result_cache": self.resources.result_cache.stats(),
+            "rollup_rewrites": self.resources.rollups.rewrites,
+            "db_pools": self.resources.db.metrics(),
+        }
+        if hasattr(self.resources.embeddings, "stats"):
+            stats["query_embeddings"] = self.resources.embeddings.stats()
+        return stats
+
 if __name__ == '__main__':
     sql_agent = SQLAgent()
     # Example usage:
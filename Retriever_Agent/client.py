@@ -0,0 +1,101 @@
+"""
+Thin client of the SQLAgent HTTP server (server.py).
+
+`AgentClient` has the question-answering surface of SQLAgent (`ask`, `aask`,
+`invoke`, `ainvoke`), so a front end can switch to the server without other
+changes. It loads no model, index or database pool of its own. `agent_client`
+returns one when AGENT_SERVER_URL is set.
+"""
+import asyncio
+import json
+import os
+import urllib.error
+import urllib.request
+
+from dotenv import load_dotenv
+
+from concurrency import Busy
+
+
+class AgentClient:
+    """
+    Asks questions of a running server.py.
+
+    Args:
+        url: Server address; AGENT_SERVER_URL when omitted.
+        timeout: Deadline per question in seconds; AGENT_SERVER_TIMEOUT (60).
+            The server caps it at its own SERVER_REQUEST_TIMEOUT.
+    """
+
+    def __init__(self, url: str = None, timeout: float = None):
+        self.url = (url or os.environ["AGENT_SERVER_URL"]).rstrip("/")
+        self.timeout = timeout or float(os.environ.get("AGENT_SERVER_TIMEOUT", 60))
+
+    def _post(self, path: str, payload: dict) -> dict:
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        try:
+            # a little longer than the deadline, so the server's 504 arrives first
+            with urllib.request.urlopen(request, timeout=self.timeout + 5) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            if e.code == 503:
+                raise Busy(message) from None
+            if e.code == 504:
+                raise TimeoutError(message) from None
+            raise RuntimeError(f"agent server answered {e.code}: {message}") from None
+
+    def ask(self, question: str, session_id: str = None) -> dict:
+        """
+        Answer `question` on the server.
+
+        Returns:
+            A dict with `answer`, `sql`, `params` and `result` (columns, first
+            page of rows, total row count). Results carry no cursor id, so
+            they cannot be paged.
+
+        Raises:
+            Busy: The server's queue is full.
+            TimeoutError: The question ran past its deadline.
+        """
+        answer = self._post("/ask", {"question": question, "session_id": session_id, "timeout": self.timeout})
+        if answer["result"] is not None:
+            answer["result"]["cursor_id"] = None
+            answer["result"]["sql"] = answer["sql"]
+        return answer
+
+    async def aask(self, question: str, session_id: str = None) -> dict:
+        return await asyncio.to_thread(self.ask, question, session_id)
+
+    def invoke(self, question: str, session_id: str = None):
+        try:
+            return self.ask(question, session_id)["answer"]
+        except Busy:
+            raise
+        except Exception as e:
+            return f"An error occurred: {e}"
+
+    async def ainvoke(self, question: str, session_id: str = None):
+        try:
+            return (await self.aask(question, session_id))["answer"]
+        except Busy:
+            raise
+        except Exception as e:
+            return f"An error occurred: {e}"
+
+    def health(self) -> dict:
+        with urllib.request.urlopen(self.url + "/health", timeout=5) as response:
+            return json.load(response)
+
+
+def agent_client():
+    """An `AgentClient` for AGENT_SERVER_URL, or None when it is not set."""
+    load_dotenv()
+    url = os.environ.get("AGENT_SERVER_URL")
+    return AgentClient(url) if url else None
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Busy(Exception):
+    """Raised when no request slot frees up within the wait timeout."""
+
+
+class RequestLimiter:
+    """
+    Bound on the number of questions a process works on at the same time.
+
+    Threaded front ends (Streamlit sessions, sync Gradio workers) take a slot
+    with `slot()`, async ones with `aslot()`; both draw on the same `limit`
+    slots. Callers beyond it queue for up to `timeout` seconds and then get
+    `Busy`.
+    """
+
+    def __init__(self, limit: int = None, timeout: float = None):
+        self.limit = limit or int(os.environ.get("MAX_IN_FLIGHT", 8))
+        self.timeout = timeout or float(os.environ.get("REQUEST_QUEUE_TIMEOUT", 60))
+        self._slots = threading.BoundedSemaphore(self.limit)
+        # event loops with coroutines waiting for a slot: the event a release
+        # sets to wake them and how many wait
+        self._loops = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _count(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+
+    def _release(self):
+        self._count(-1)
+        self._slots.release()
+        with self._lock:
+            waiting = list(self._loops.items())
+        for loop, (wakeup, _) in waiting:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # closed since it was listed
+                pass
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise Busy(f"more than {self.limit} requests in flight")
+        self._count(1)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _waiting(self, delta: int) -> asyncio.Event:
+        """Join (1) or leave (-1) the waiters of the running loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            wakeup, waiters = self._loops.get(loop, (None, 0))
+            if wakeup is None:
+                wakeup = asyncio.Event()
+            waiters += delta
+            if waiters:
+                self._loops[loop] = (wakeup, waiters)
+            else:
+                # the event holds its loop once waited on; keep no entry
+                # past the last waiter
+                self._loops.pop(loop, None)
+            return wakeup
+
+    async def _acquire(self):
+        if self._slots.acquire(blocking=False):
+            return
+        wakeup = self._waiting(1)
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        try:
+            while True:
+                # cleared before trying, so a release in between is not missed
+                wakeup.clear()
+                if self._slots.acquire(blocking=False):
+                    return
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    raise Busy(f"more than {self.limit} requests in flight")
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiting(-1)
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self._acquire()
+        self._count(1)
+        try:
+            yield
+        finally:
+            self._release()
@@ -0,0 +1,227 @@
+"""
+Token budget between the agent's tools and the model.
+
+Every model call of an agent run resends the whole conversation: each
+`query_vecdb` context, each schema lookup, each failed attempt at the SQL.
+`ContextBudget` compacts that list just before the call (the graph state
+keeps the full messages):
+
+1. schema paragraphs a schema tool already returned earlier in the run are
+   replaced by a short reference,
+2. every tool output is capped at `tool_tokens`,
+3. while the whole prompt is over `max_tokens`, the oldest tool outputs are
+   cut down to their first line, superseded query results and failed
+   attempts first.
+
+`summarize_result` is the compact form `run_sql_query` hands to the model in
+the first place: row count, per-column stats and the first few rows.
+"""
+import os
+from decimal import Decimal
+
+from hybrid_retriever import estimate_tokens
+from tracing import get_tracer
+
+# tools whose output is schema text that repeats across calls
+SCHEMA_TOOLS = ("query_vecdb", "get_table_schema", "get_join_path", "list_table")
+
+SQL_TOOL = "run_sql_query"
+
+_REPEATED = "(schema already provided above: {titles})"
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _short(value, width: int = 40) -> str:
+    text = str(value)
+    return text if len(text) <= width else text[: width - 1] + "…"
+
+
+def column_stats(rows: list, column: str) -> str:
+    """One line describing the values of `column` in `rows`."""
+    values = [row.get(column) for row in rows]
+    present = [v for v in values if v is not None]
+    nulls = len(values) - len(present)
+    if not present:
+        return f"{column}: all null"
+    if all(_is_number(v) for v in present):
+        total = sum(Decimal(str(v)) for v in present)
+        text = (f"{column}: min {min(present)}, max {max(present)}, "
+                f"avg {total / len(present):.2f}, sum {total}")
+    else:
+        distinct = {str(v) for v in present}
+        text = f"{column}: {len(distinct)} distinct"
+        if len(distinct) <= 5:
+            text += " (" + ", ".join(sorted(_short(v) for v in distinct)) + ")"
+        else:
+            ordered = sorted(present, key=str)
+            text += f", from {_short(ordered[0])} to {_short(ordered[-1])}"
+    if nulls:
+        text += f", {nulls} null"
+    return text
+
+
+def summarize_result(result: dict, rows: int = None) -> str:
+    """
+    Compact description of a query result for the LLM.
+
+    Args:
+        result: A result from `ResultPager.open` (columns, rows, total_rows, ...).
+        rows: How many rows to show; TOOL_RESULT_ROWS (10) when omitted.
+
+    Returns:
+        The total row count and columns, per-column stats over the fetched
+        page when it has more rows than are shown, then the first rows.
+    """
+    limit = rows or int(os.environ.get("TOOL_RESULT_ROWS", 10))
+    total = result["total_rows"]
+    size = f"{total}" if result["total_is_exact"] else f"more than {total - 1}"
+    lines = [f"total_rows: {size}", f"columns: {', '.join(result['columns'])}"]
+    page = result["rows"]
+    if len(page) > limit:
+        lines.append(f"stats over the first {len(page)} rows:")
+        lines.extend("  " + column_stats(page, column) for column in result["columns"])
+    shown = page[:limit]
+    if shown:
+        lines.append(f"first {len(shown)} rows:")
+        lines.extend(str(tuple(_short(v, 60) if isinstance(v, str) else v for v in row.values()))
+                     for row in shown)
+    if result.get("truncated"):
+        lines.append("(page truncated by the byte cap)")
+    return "\n".join(lines)
+
+
+def _text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    # content blocks
+    return "\n".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def _is_tool(message) -> bool:
+    return getattr(message, "type", None) == "tool"
+
+
+def _replace(message, content: str):
+    return message.model_copy(update={"content": content})
+
+
+def _truncate(text: str, tokens: int) -> str:
+    chars = max(tokens, 1) * 4
+    if len(text) <= chars:
+        return text
+    cut = text.rfind("\n", 0, chars)
+    cut = cut if cut > chars // 2 else chars
+    return text[:cut] + f"\n(... {len(text) - cut} more characters cut to fit the context budget)"
+
+
+class ContextBudget:
+    """
+    Compacts an agent's message list to fit a token budget.
+
+    Args:
+        max_tokens: Budget for the system prompt plus messages of one model
+            call; AGENT_CONTEXT_TOKENS (6000) when omitted, leaving room in
+            an 8k-context model for the tool schemas and the answer.
+        tool_tokens: Cap for a single tool output; TOOL_OUTPUT_TOKENS (1200).
+    """
+
+    def __init__(self, max_tokens: int = None, tool_tokens: int = None):
+        self.max_tokens = max_tokens or int(os.environ.get("AGENT_CONTEXT_TOKENS", 6000))
+        self.tool_tokens = tool_tokens or int(os.environ.get("TOOL_OUTPUT_TOKENS", 1200))
+
+    def _dedupe_schema(self, messages: list) -> list:
+        seen = set()
+        out = []
+        for message in messages:
+            if not _is_tool(message) or message.name not in SCHEMA_TOOLS:
+                out.append(message)
+                continue
+            kept, repeated = [], []
+            for paragraph in _text(message).split("\n\n"):
+                key = " ".join(paragraph.split())
+                if not key:
+                    continue
+                if key in seen:
+                    repeated.append(_short(paragraph.strip().splitlines()[0], 30))
+                else:
+                    seen.add(key)
+                    kept.append(paragraph)
+            if repeated:
+                kept.append(_REPEATED.format(titles="; ".join(repeated)))
+                message = _replace(message, "\n\n".join(kept))
+            out.append(message)
+        return out
+
+    def _cap_tools(self, messages: list) -> list:
+        return [
+            _replace(m, _truncate(_text(m), self.tool_tokens))
+            if _is_tool(m) and estimate_tokens(_text(m)) > self.tool_tokens else m
+            for m in messages
+        ]
+
+    def _shrink_order(self, messages: list) -> list:
+        """Indexes of tool outputs to cut, cheapest to lose first."""
+        tools = [i for i, m in enumerate(messages) if _is_tool(m)]
+        sql = [i for i in tools if messages[i].name == SQL_TOOL]
+        latest_sql = sql[-1] if sql else None
+        failed = [i for i in sql if i != latest_sql and _text(messages[i]).startswith("Error")]
+        superseded = [i for i in sql if i != latest_sql and i not in failed]
+        rest = [i for i in tools if i not in failed and i not in superseded and i != latest_sql]
+        # the newest output is what the model is about to act on
+        order = failed + superseded + rest
+        if tools and tools[-1] in order:
+            order.remove(tools[-1])
+        return order
+
+    def tokens(self, messages: list, system: str = "") -> int:
+        return estimate_tokens(system) + sum(estimate_tokens(_text(m)) for m in messages)
+
+    def compact(self, messages: list, system: str = "") -> list:
+        """
+        The messages to send in place of `messages`.
+
+        Only tool outputs are rewritten; every message keeps its place, so
+        tool calls stay paired with their results.
+        """
+        messages = self._cap_tools(self._dedupe_schema(messages))
+        total = self.tokens(messages, system)
+        for i in self._shrink_order(messages):
+            if total <= self.max_tokens:
+                break
+            text = _text(messages[i])
+            first = text.splitlines()[0] if text else ""
+            stub = f"{_short(first, 120)}\n(earlier {messages[i].name} output elided to fit the context budget)"
+            if len(stub) < len(text):
+                total -= estimate_tokens(text) - estimate_tokens(stub)
+                messages[i] = _replace(messages[i], stub)
+        return messages
+
+    def apply(self, request):
+        """A copy of the ModelRequest `request` with compacted messages."""
+        system = _text(request.system_message) if request.system_message is not None else ""
+        with get_tracer().span("context.compact") as span:
+            before = self.tokens(request.messages, system)
+            messages = self.compact(list(request.messages), system)
+            after = self.tokens(messages, system)
+            span.set(**{"context.tokens_before": before, "context.tokens_after": after})
+        return request.override(messages=messages)
+
+
+def middleware(budget: ContextBudget = None):
+    """Agent middleware that runs `budget.apply` before every model call."""
+    from langchain.agents.middleware import AgentMiddleware
+
+    budget = budget or ContextBudget()
+
+    class ContextBudgetMiddleware(AgentMiddleware):
+        def wrap_model_call(self, request, handler):
+            return handler(budget.apply(request))
+
+        async def awrap_model_call(self, request, handler):
+            return await handler(budget.apply(request))
+
+    return ContextBudgetMiddleware()
@@ -0,0 +1,319 @@
+"""
+Data access: pooled engines for the primary and the read replicas.
+
+The agent only reads. Its queries, schema introspection and cache probes go
+to `DataAccess.reader` (and `async_reader`), whose connections are spread
+round-robin over the read replicas in DB_REPLICAS and fall back to the
+primary when none is healthy. The primary engine is kept for the few writes
+(rollup refresh, benchmark seeding).
+
+Configuration, all optional:
+
+    DATABASE_URL               full primary URL; else built from the keys below
+    DB_UNAME, DB_PASS          credentials
+    DB_HOST, DB_PORT, DB_NAME  primary location (localhost, 5432, postgres)
+    DB_REPLICAS                comma-separated host[:port] list of read replicas
+    DB_REPLICA_MAX_LAG         seconds of replay lag before a replica is skipped (30)
+    DB_REPLICA_RETRY           seconds before a failed replica is tried again (30)
+    DB_POOL_SIZE               connections kept open per engine (5)
+    DB_MAX_OVERFLOW            extra connections allowed under load (10)
+    DB_POOL_TIMEOUT            seconds a request waits for a connection (30)
+    DB_POOL_RECYCLE            seconds before a connection is replaced (1800)
+    DB_POOL_PRE_PING           test connections on checkout (on)
+    DB_WORK_MEM                work_mem of reader sessions (16MB)
+
+Reader sessions are read-only by default and carry the SQL guard's
+statement_timeout, so nothing that skips the guard (catalog, cache probes)
+can write or run away. At most pool size + overflow connections are open per
+engine; a burst of questions beyond that queues for a connection instead of
+opening more. Cursors kept open for paging (result_stream.py) hold their
+connection, so size the pool above RESULT_MAX_OPEN_CURSORS.
+"""
+import itertools
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+APPLICATION_NAME = "retriever_agent"
+
+# replay lag of a standby; 0 when it has replayed everything it received, so
+# an idle primary does not make its replicas look stale
+_LAG_QUERY = """
+SELECT CASE WHEN NOT pg_is_in_recovery()
+                 OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END
+"""
+
+
+class _Timed:
+    """Pool mixin recording how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def metrics(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkouts,
+            "wait_ms_avg": 1000 * self.wait_seconds / self.checkouts if self.checkouts else 0.0,
+            "wait_ms_max": 1000 * self.max_wait_seconds,
+            "timeouts": self.timeouts,
+        }
+
+
+class TimedQueuePool(_Timed, QueuePool):
+    pass
+
+
+class TimedAsyncPool(_Timed, AsyncAdaptedQueuePool):
+    pass
+
+
+class ReplicaSet:
+    """
+    Read replicas handed out round-robin, skipping unhealthy ones.
+
+    A replica that refuses a connection or lags more than `max_lag` seconds
+    is left out for `retry` seconds. When every replica is out, the primary
+    serves reads (if `fallback`).
+    """
+
+    def __init__(self, hosts, primary: tuple, max_lag: float = None, retry: float = None,
+                 fallback: bool = True):
+        self.hosts = list(hosts)
+        self.primary = primary
+        self.max_lag = max_lag or float(os.environ.get("DB_REPLICA_MAX_LAG", 30))
+        self.retry = retry or float(os.environ.get("DB_REPLICA_RETRY", 30))
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        self._down_until = {}
+        self.connects = {host: 0 for host in self.hosts + [primary]}
+        self.failures = {host: 0 for host in self.hosts + [primary]}
+
+    def candidates(self) -> list:
+        """Hosts to try for the next connection, in order."""
+        now = time.monotonic()
+        start = next(self._next)
+        ordered = [self.hosts[(start + i) % len(self.hosts)] for i in range(len(self.hosts))]
+        with self._lock:
+            healthy = [h for h in ordered if self._down_until.get(h, 0) <= now]
+        # when all replicas are marked down, still try them after the primary
+        rest = [h for h in ordered if h not in healthy]
+        return healthy + ([self.primary] if self.fallback else []) + rest
+
+    def mark_down(self, host):
+        with self._lock:
+            self._down_until[host] = time.monotonic() + self.retry
+            self.failures[host] += 1
+
+    def mark_up(self, host):
+        with self._lock:
+            self._down_until.pop(host, None)
+            self.connects[host] += 1
+
+    def health(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{host}:{port}": {
+                    "healthy": self._down_until.get((host, port), 0) <= now,
+                    "connects": self.connects[(host, port)],
+                    "failures": self.failures[(host, port)],
+                }
+                for host, port in self.hosts
+            }
+
+
+def _lag(dbapi_connection) -> float:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(_LAG_QUERY)
+        return float(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+        dbapi_connection.rollback()
+
+
+def _route(engine, replicas: ReplicaSet):
+    """Open every new connection of `engine` on the next healthy replica."""
+
+    @event.listens_for(engine, "do_connect")
+    def connect(dialect, conn_rec, cargs, cparams):
+        error = None
+        for host in replicas.candidates():
+            params = dict(cparams, host=host[0], port=host[1])
+            try:
+                connection = dialect.connect(*cargs, **params)
+            except Exception as e:
+                replicas.mark_down(host)
+                error = e
+                continue
+            if host != replicas.primary:
+                try:
+                    lagging = _lag(connection) > replicas.max_lag
+                except Exception as e:
+                    lagging, error = True, e
+                if lagging:
+                    connection.close()
+                    replicas.mark_down(host)
+                    continue
+            replicas.mark_up(host)
+            return connection
+        raise error or exc.DisconnectionError("no database host available")
+
+
+def _parse_hosts(spec: str, default_port: int) -> list:
+    hosts = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port or default_port)))
+    return hosts
+
+
+class DataAccess:
+    """
+    The engines of one process: `primary`, `reader` and `async_reader`.
+
+    Args:
+        url: Primary database URL (psycopg2); from the environment when omitted.
+        replicas: host[:port] list of read replicas; DB_REPLICAS when omitted.
+    """
+
+    def __init__(self, url: str = None, replicas: str = None):
+        self.url = make_url(url or os.environ.get("DATABASE_URL") or self._url_from_env())
+        default_port = self.url.port or 5432
+        self.replica_hosts = _parse_hosts(
+            replicas if replicas is not None else os.environ.get("DB_REPLICAS", ""), default_port
+        )
+        self.replicas = ReplicaSet(self.replica_hosts, (self.url.host, default_port)) \
+            if self.replica_hosts else None
+        self._lock = threading.Lock()
+        self._engines = {}
+
+    @staticmethod
+    def _url_from_env() -> str:
+        username = os.environ.get("DB_UNAME")
+        password = os.environ.get("DB_PASS")
+        host = os.environ.get("DB_HOST", "localhost")
+        port = os.environ.get("DB_PORT", "5432")
+        name = os.environ.get("DB_NAME", "postgres")
+        return f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{name}"
+
+    @staticmethod
+    def pool_options() -> dict:
+        return {
+            "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+            "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+            "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "on") != "off",
+        }
+
+    @staticmethod
+    def session_settings() -> dict:
+        """Server settings of every reader session."""
+        # an open paging cursor sits idle in its transaction between pages
+        idle_ms = int((float(os.environ.get("RESULT_CURSOR_IDLE_TIMEOUT", 120)) + 60) * 1000)
+        return {
+            "application_name": APPLICATION_NAME,
+            "default_transaction_read_only": "on",
+            "statement_timeout": os.environ.get("SQL_STATEMENT_TIMEOUT_MS", "15000"),
+            "work_mem": os.environ.get("DB_WORK_MEM", "16MB"),
+            "idle_in_transaction_session_timeout": str(idle_ms),
+        }
+
+    def _engine(self, name: str, build):
+        with self._lock:
+            if name not in self._engines:
+                self._engines[name] = build()
+            return self._engines[name]
+
+    @property
+    def primary(self):
+        def build():
+            return create_engine(
+                self.url, poolclass=TimedQueuePool,
+                connect_args={"application_name": f"{APPLICATION_NAME}_writer"},
+                **self.pool_options(),
+            )
+        return self._engine("primary", build)
+
+    @property
+    def reader(self):
+        def build():
+            # libpq applies -c options when the session starts
+            options = " ".join(f"-c {key}={value}" for key, value in self.session_settings().items()
+                               if key != "application_name")
+            engine = create_engine(
+                self.url, poolclass=TimedQueuePool,
+                connect_args={"application_name": APPLICATION_NAME, "options": options},
+                **self.pool_options(),
+            )
+            if self.replicas:
+                _route(engine, self.replicas)
+            return engine
+        return self._engine("reader", build)
+
+    @property
+    def async_reader(self):
+        def build():
+            from sqlalchemy.ext.asyncio import create_async_engine
+            engine = create_async_engine(
+                self.url.set(drivername="postgresql+asyncpg"), poolclass=TimedAsyncPool,
+                connect_args={"server_settings": self.session_settings()},
+                **self.pool_options(),
+            )
+            if self.replicas:
+                _route(engine.sync_engine, self.replicas)
+            return engine
+        return self._engine("async_reader", build)
+
+    def metrics(self) -> dict:
+        """Pool state and checkout wait times of every engine built so far,
+        and the health of the replicas."""
+        with self._lock:
+            engines = dict(self._engines)
+        metrics = {}
+        for name, engine in engines.items():
+            pool = getattr(engine, "sync_engine", engine).pool
+            if hasattr(pool, "metrics"):
+                metrics[name] = pool.metrics()
+        if self.replicas:
+            metrics["replicas"] = self.replicas.health()
+        return metrics
+
+    def dispose(self):
+        with self._lock:
+            engines, self._engines = self._engines, {}
+        for engine in engines.values():
+            getattr(engine, "sync_engine", engine).dispose()
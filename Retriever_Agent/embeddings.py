@@ -0,0 +1,194 @@
+"""
+Embedding backends for the schema index, the plan cache and the intent router.
+
+    EMBEDDING_BACKEND=torch      full-precision PyTorch on CPU (default)
+    EMBEDDING_BACKEND=onnx       ONNX Runtime export of the same model
+    EMBEDDING_BACKEND=onnx-int8  ONNX Runtime, int8-quantized weights
+
+The ONNX backends need `sentence-transformers[onnx]` (optimum + onnxruntime);
+without them the torch backend is used and a warning is emitted. Check that a
+backend retrieves the same chunks as torch before switching:
+
+    python embeddings.py --compare onnx-int8
+"""
+import argparse
+import json
+import os
+import threading
+import warnings
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_BACKEND = "torch"
+
+# sentence-transformers model_kwargs per backend; the quantized file ships in
+# the model repository (onnx/model_qint8_avx2.onnx)
+BACKENDS = {
+    "torch": {"device": "cpu"},
+    "onnx": {"device": "cpu", "backend": "onnx"},
+    "onnx-int8": {
+        "device": "cpu",
+        "backend": "onnx",
+        "model_kwargs": {"file_name": "onnx/model_qint8_avx2.onnx"},
+    },
+}
+
+
+def configured_backend() -> str:
+    return os.environ.get("EMBEDDING_BACKEND", DEFAULT_BACKEND)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that batches document encoding and remembers queries.
+
+    Documents are encoded `batch_size` at a time, which bounds peak memory
+    while indexing. Query vectors are kept in an LRU of `cache_size` entries
+    keyed by the whitespace-normalized text: the plan cache, the intent
+    router and every retrieval retry of the same question embed it once.
+    """
+
+    def __init__(self, inner, identity: str, backend: str = DEFAULT_BACKEND, requested: str = None,
+                 batch_size: int = None, cache_size: int = None):
+        self.inner = inner
+        self.identity = identity
+        self.backend = backend
+        self.requested = requested or backend
+        self.batch_size = batch_size or int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+        self.cache_size = cache_size or int(os.environ.get("EMBEDDING_CACHE_SIZE", 1024))
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.inner.embed_documents(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text):
+        key = " ".join(text.split())
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+        vector = self.inner.embed_query(text)
+        with self._lock:
+            self._queries[key] = tuple(vector)
+            while len(self._queries) > self.cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def clear(self):
+        """Forget the remembered query vectors and reset the hit counters."""
+        with self._lock:
+            self._queries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "identity": self.identity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._queries),
+            }
+
+
+def build_embeddings(backend: str = None, model_name: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """
+    Load `model_name` on the requested CPU backend.
+
+    Args:
+        backend: One of BACKENDS; EMBEDDING_BACKEND when omitted.
+        model_name: Sentence-transformers model id.
+
+    Returns:
+        A `CachedEmbeddings` whose `identity` names the model and the backend
+        actually loaded, and whose `requested` is the backend asked for.
+    """
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+    requested = backend or configured_backend()
+    if requested not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {requested!r}; expected one of {', '.join(BACKENDS)}")
+    batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+    loaded = requested
+    try:
+        inner = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs=BACKENDS[requested],
+            encode_kwargs={"batch_size": batch_size},
+        )
+    except ImportError as e:
+        if requested == DEFAULT_BACKEND:
+            raise
+        warnings.warn(f"Embedding backend {requested!r} unavailable ({e}); using {DEFAULT_BACKEND}")
+        loaded = DEFAULT_BACKEND
+        inner = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs=BACKENDS[DEFAULT_BACKEND],
+            encode_kwargs={"batch_size": batch_size},
+        )
+    return CachedEmbeddings(
+        inner,
+        identity=f"{model_name.rsplit('/', 1)[-1]}@{loaded}",
+        backend=loaded,
+        requested=requested,
+        batch_size=batch_size,
+    )
+
+
+def compare(backend: str, docs_glob: str = "docs/*.txt", k: int = 4, questions=None) -> dict:
+    """Top-k chunk agreement between the torch backend and `backend`."""
+    import numpy as np
+    from vector_index import load_schema_chunks
+
+    if questions is None:
+        with open("bench_data/recorded_sessions.json") as f:
+            questions = [s["question"] for s in json.load(f)["sessions"]]
+    chunks = [doc.page_content for doc in load_schema_chunks(docs_glob)]
+    rankings = {}
+    for name in (DEFAULT_BACKEND, backend):
+        model = build_embeddings(name)
+        docs = np.asarray(model.embed_documents(chunks), dtype=np.float32)
+        docs /= np.linalg.norm(docs, axis=1, keepdims=True)
+        ranks = []
+        for question in questions:
+            query = np.asarray(model.embed_query(question), dtype=np.float32)
+            ranks.append(list(np.argsort(-(docs @ (query / np.linalg.norm(query))))[:k]))
+        rankings[name] = ranks
+    overlaps = [
+        len(set(a) & set(b)) / min(k, len(chunks))
+        for a, b in zip(rankings[DEFAULT_BACKEND], rankings[backend])
+    ]
+    top1 = [a[0] == b[0] for a, b in zip(rankings[DEFAULT_BACKEND], rankings[backend])]
+    return {
+        "backend": backend,
+        "questions": len(questions),
+        "mean_top_k_overlap": sum(overlaps) / len(overlaps),
+        "top1_agreement": sum(top1) / len(top1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on the schema docs")
+    parser.add_argument("--compare", default="onnx-int8", choices=[b for b in BACKENDS if b != DEFAULT_BACKEND])
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+    report = compare(args.compare, k=args.k)
+    print(f"{report['backend']}: top-{args.k} overlap {report['mean_top_k_overlap']:.2%}, "
+          f"top-1 agreement {report['top1_agreement']:.2%} over {report['questions']} questions")
+
+
+if __name__ == "__main__":
+    main()
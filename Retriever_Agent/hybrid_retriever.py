@@ -0,0 +1,156 @@
+import math
+import os
+import re
+from collections import Counter
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+
+# words in a question that point at a table without naming it
+TABLE_TERMS = {
+    "branches": ("branch", "city", "location"),
+    "customers": ("customer", "client", "kyc", "name", "email", "phone", "inactive"),
+    "accounts": ("account", "balance", "deposit", "saving", "current", "fd"),
+    "loans": ("loan", "principal", "npa", "disburs", "tenure", "interest", "borrow"),
+    "repayments": ("repayment", "overdue", "due", "paid", "delinquen", "instal", "emi", "default"),
+}
+
+# rules every SQL-writing turn needs, whatever the question
+ALWAYS_KINDS = ("rule",)
+
+# agent behaviour already spelled out in the system prompt
+DEMOTED_KINDS = ("guide",)
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count: about four characters per token for English and SQL."""
+    return len(text) // 4 + 1
+
+
+def tables_in_question(question: str) -> set:
+    q = question.lower()
+    return {
+        table for table, terms in TABLE_TERMS.items()
+        if table.rstrip("s") in q or any(term in q for term in terms)
+    }
+
+
+class BM25:
+    """Okapi BM25 over a small fixed corpus, held in memory."""
+
+    def __init__(self, texts, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.docs = [Counter(tokenize(text)) for text in texts]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        frequency = Counter(term for doc in self.docs for term in doc)
+        n = len(self.docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in frequency.items()}
+
+    def scores(self, query: str) -> list:
+        terms = [t for t in tokenize(query) if t in self.idf]
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if tf:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+class HybridRetriever:
+    """
+    Schema retriever fusing BM25 keyword search with the vector index.
+
+    Both rankings are merged with reciprocal rank fusion, then reranked:
+    chunks about a table the question mentions (by name or a term such as
+    "overdue" for repayments) move up, chunks about other tables move down
+    or are dropped, and the JOIN relationships are only kept when the
+    question spans two or more tables. Chunks are added best first until `token_budget` is spent,
+    so the prompt carries the tables, columns and rules the question needs
+    instead of a fixed number of overlapping blobs.
+    """
+
+    def __init__(self, index, k: int = None, token_budget: int = None, rrf_k: int = 60):
+        self.index = index
+        self.k = k or int(os.environ.get("RETRIEVAL_CANDIDATES", 8))
+        self.token_budget = token_budget or int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", 700))
+        self.rrf_k = rrf_k
+        self._documents = None
+        self._bm25 = None
+
+    def _corpus(self):
+        documents = self.index.documents
+        if documents is not self._documents:
+            self._documents = documents
+            self._bm25 = BM25([d.page_content for d in documents])
+        return self._documents, self._bm25
+
+    def _fused(self, question: str) -> dict:
+        documents, bm25 = self._corpus()
+        by_id = {d.metadata["content_hash"]: d for d in documents}
+        fused = {}
+
+        scores = bm25.scores(question)
+        keyword = [i for i in sorted(range(len(documents)), key=lambda i: -scores[i]) if scores[i] > 0]
+        for rank, i in enumerate(keyword[: self.k]):
+            key = documents[i].metadata["content_hash"]
+            fused[key] = fused.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+
+        for rank, doc in enumerate(self.index.store.similarity_search(question, k=self.k)):
+            key = doc.metadata.get("content_hash")
+            if key in by_id:
+                fused[key] = fused.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+
+        # tables the question names, how they join and the standing rules are
+        # needed even if neither search ranked them
+        wanted = tables_in_question(question)
+        for key, doc in by_id.items():
+            meta = doc.metadata
+            if meta.get("table") in wanted or meta.get("kind") in ALWAYS_KINDS or (
+                meta.get("kind") == "joins" and len(wanted) > 1
+            ):
+                fused.setdefault(key, 0.0)
+        return {key: (by_id[key], score) for key, score in fused.items()}
+
+    def _rerank(self, question: str, fused: dict) -> list:
+        wanted = tables_in_question(question)
+        unit = 1 / (self.rrf_k + 1)
+        ranked = []
+        for doc, score in fused.values():
+            meta = doc.metadata
+            tables = set(filter(None, meta.get("tables", "").split(",")))
+            if meta.get("kind") == "table":
+                score += unit if meta.get("table") in wanted else -unit
+            elif meta.get("kind") == "joins":
+                if len(wanted) < 2:
+                    continue
+                score += unit
+            elif meta.get("kind") in ALWAYS_KINDS:
+                score += unit
+            elif meta.get("kind") in DEMOTED_KINDS:
+                score -= unit
+            elif tables and wanted and not tables & wanted:
+                # an intent or note about tables the question never touches
+                continue
+            ranked.append((score, doc))
+        ranked.sort(key=lambda item: -item[0])
+        return [doc for _, doc in ranked]
+
+    def invoke(self, question: str) -> list:
+        """The chunks for `question`, best first, within the token budget."""
+        ranked = self._rerank(question, self._fused(question))
+        chosen, spent = [], 0
+        for doc in ranked:
+            cost = estimate_tokens(doc.page_content)
+            if chosen and spent + cost > self.token_budget:
+                continue
+            chosen.append(doc)
+            spent += cost
+        return chosen
@@ -0,0 +1,105 @@
+"""
+Import-time budget report for the agent's entry modules.
+
+Each module is imported in a fresh interpreter under `python -X importtime`.
+The report gives its cumulative import time, the slowest packages it pulls in,
+and any heavy dependency loaded at import time instead of on first use.
+
+    python import_budget.py --budget-ms 300 --out import_budget.json
+
+Exits 1 when a module is over budget or imports a heavy package eagerly, so it
+can gate CI against startup regressions.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# modules a front end imports before it can accept a connection
+MODULES = ("agent_core", "resources", "output_formatter", "tracing", "concurrency")
+
+# packages that must only load on first use
+HEAVY = (
+    "torch", "transformers", "sentence_transformers", "langchain_huggingface",
+    "langchain_community", "chromadb", "langchain", "langchain_core", "langchain_groq",
+    "langgraph", "sqlglot",
+)
+
+
+def parse_importtime(stderr: str) -> list:
+    """(package, self_us, cumulative_us, depth) for every line of -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        # "import time:       123 |        456 |     package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        head, cumulative_us, name = line.split("|", 2)
+        self_us = head.split(":", 1)[1]
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def measure(module: str, top: int = 10) -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    done = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=here, capture_output=True, text=True,
+    )
+    entries = parse_importtime(done.stderr)
+    # -X importtime prints children before their parent: the module's subtree
+    # is the run of deeper lines just above its own line
+    own = max((i for i, e in enumerate(entries) if e[0] == module), default=None)
+    subtree = []
+    if own is not None:
+        start = own
+        while start > 0 and entries[start - 1][3] > entries[own][3]:
+            start -= 1
+        subtree = entries[start:own]
+    children = [e for e in subtree if e[3] == entries[own][3] + 1] if own is not None else []
+    return {
+        "module": module,
+        "ok": done.returncode == 0,
+        "error": done.stderr.strip().splitlines()[-1] if done.returncode else None,
+        "cumulative_ms": entries[own][2] / 1000 if own is not None else None,
+        "slowest": [
+            {"package": name, "cumulative_ms": cumulative / 1000}
+            for name, _, cumulative, _ in sorted(children, key=lambda e: -e[2])
+        ][:top],
+        "eager_heavy": sorted({name.split(".")[0] for name, *_ in subtree} & set(HEAVY)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget report")
+    parser.add_argument("modules", nargs="*", default=list(MODULES))
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", 500)))
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--out", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = [measure(module, args.top) for module in args.modules]
+    failed = False
+    for entry in report:
+        if not entry["ok"]:
+            print(f"{entry['module']:18} FAILED  {entry['error']}")
+            failed = True
+            continue
+        over = entry["cumulative_ms"] > args.budget_ms
+        failed = failed or over or bool(entry["eager_heavy"])
+        status = "OVER" if over else "ok"
+        print(f"{entry['module']:18} {entry['cumulative_ms']:8.1f}ms  {status}")
+        for item in entry["slowest"]:
+            print(f"    {item['package']:40} {item['cumulative_ms']:8.1f}ms")
+        if entry["eager_heavy"]:
+            print(f"    eagerly imports: {', '.join(entry['eager_heavy'])}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"budget_ms": args.budget_ms, "modules": report}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
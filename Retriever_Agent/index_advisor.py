@@ -0,0 +1,486 @@
+"""
+Index recommendations from the SQL the agent actually runs.
+
+Table_Creation.sql indexes only the primary keys and updated_at, while nearly every
+generated query joins on a foreign key and filters `deleted_at IS NULL`.
+This tool reads the workload from the trace file (every `sql.execute` span
+carries its statement, bind values and duration), runs
+`EXPLAIN (ANALYZE, BUFFERS)` on the statements that spent the most database
+time, and proposes indexes for the sequential scans it finds:
+
+* filter indexes on the columns compared with a value (equalities first,
+  then one range column),
+* join indexes on the columns a table is joined on,
+* partial (`WHERE deleted_at IS NULL`) when the query skips soft-deleted
+  rows, and covering (`INCLUDE`) when the few other columns the query reads
+  from the table fit, so the scan can be index-only.
+
+Each candidate is priced per statement: with the HypoPG extension installed,
+by the planner's cost with the index created hypothetically; otherwise from
+the measured scan time and the share of scanned rows the query kept. The
+saving times the statement's executions is summed over the workload, and
+the candidates are ranked by it, with ready-to-apply DDL and an estimated
+size.
+
+    python index_advisor.py                          # traces/spans.jsonl
+    python index_advisor.py --sample 100 --out index_advice.sql
+
+EXPLAIN ANALYZE executes the statements; they run on the reader engine, in
+read-only sessions under the guard's statement_timeout.
+"""
+import argparse
+import json
+import math
+import os
+import re
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+
+from tracing import DEFAULT_TRACE_FILE
+
+SOFT_DELETE_COLUMN = "deleted_at"
+
+# most columns an INCLUDE list gets before a covering index stops paying
+MAX_INCLUDE = 4
+
+# an index-fetched row costs several sequentially scanned ones (random heap
+# access); an index-only scan does not visit the heap
+INDEX_ROW_COST = 4.0
+INDEX_ONLY_ROW_COST = 1.0
+
+PAGE_SIZE = 8192
+PAGE_HEADER = 24
+FILLFACTOR = 0.9
+# IndexTupleData header plus its line pointer
+INDEX_TUPLE_OVERHEAD = 8 + 4
+
+EXISTING_INDEXES_QUERY = """
+SELECT c.relname AS table_name,
+       array_agg(a.attname ORDER BY k.ord) AS columns
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+WHERE n.nspname = :schema AND k.ord <= i.indnkeyatts
+GROUP BY i.indexrelid, c.relname
+"""
+
+TABLE_ROWS_QUERY = """
+SELECT c.relname, GREATEST(c.reltuples, 0)
+FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'p')
+"""
+
+COLUMN_STATS_QUERY = """
+SELECT tablename, attname, avg_width, null_frac FROM pg_stats WHERE schemaname = :schema
+"""
+
+_BIND_RE = re.compile(r"(?<!:):([A-Za-z_]\w*)")
+
+
+def _otlp_value(value: dict):
+    for key, cast in (("stringValue", str), ("intValue", int), ("doubleValue", float), ("boolValue", bool)):
+        if key in value:
+            return cast(value[key])
+    return None
+
+
+def load_workload(path: str) -> list:
+    """
+    The statements in the trace file at `path`, most database time first.
+
+    Returns:
+        One dict per distinct statement: `sql`, `params` (the bind values of
+        its latest run), `executions` and `db_ms` of the runs that reached
+        the database, and `cache_hits`. Failed statements and those answered
+        from a rollup are left out.
+    """
+    statements = {}
+    with open(path) as f:
+        for line in f:
+            span = json.loads(line)
+            if span.get("name") != "sql.execute" or span.get("status", {}).get("code") == 2:
+                continue
+            attributes = {a["key"]: _otlp_value(a["value"]) for a in span.get("attributes", [])}
+            sql = attributes.get("db.statement")
+            if not sql or attributes.get("db.rollup"):
+                continue
+            sql = " ".join(sql.split())
+            entry = statements.setdefault(sql, {"sql": sql, "params": {}, "executions": 0,
+                                                "cache_hits": 0, "db_ms": 0.0})
+            if attributes.get("db.params"):
+                entry["params"] = json.loads(attributes["db.params"])
+            if attributes.get("cache.hit"):
+                entry["cache_hits"] += 1
+                continue
+            entry["executions"] += 1
+            entry["db_ms"] += (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+    return sorted((s for s in statements.values() if s["executions"]), key=lambda s: -s["db_ms"])
+
+
+def _conjuncts(node) -> list:
+    if node is None:
+        return []
+    if isinstance(node, exp.And):
+        return _conjuncts(node.left) + _conjuncts(node.right)
+    if isinstance(node, exp.Paren):
+        return _conjuncts(node.this)
+    return [node]
+
+
+def _sources(select) -> dict:
+    """alias -> table name of the tables in a SELECT's FROM and JOINs."""
+    from_ = select.args.get("from_") or select.args.get("from")
+    tables = ([from_.this] if from_ else []) + [join.this for join in select.args.get("joins") or []]
+    return {t.alias_or_name: t.name for t in tables if isinstance(t, exp.Table)}
+
+
+def _owner(column, sources: dict, columns_of: dict) -> str:
+    if column.table:
+        return sources.get(column.table)
+    owners = {t for t in sources.values() if column.name in columns_of.get(t, ())}
+    return owners.pop() if len(owners) == 1 else None
+
+
+def access_patterns(sql: str, columns_of: dict) -> list:
+    """
+    How each SELECT of `sql` reaches each of its tables.
+
+    Args:
+        sql: A statement.
+        columns_of: table -> column names, to place unqualified columns.
+
+    Returns:
+        One dict per (SELECT, table): `table`, `eq` and `range` (columns
+        compared with a value), `join` (columns compared with another
+        table's), `live` (filters deleted_at IS NULL) and `used` (every
+        column of the table the SELECT mentions).
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except sqlglot.errors.ParseError:
+        return []
+    patterns = []
+    for select in tree.find_all(exp.Select):
+        sources = _sources(select)
+        if not sources:
+            continue
+        found = {table: {"table": table, "eq": [], "range": [], "join": [], "live": False, "used": set()}
+                 for table in set(sources.values())}
+
+        def add(role, column):
+            table = _owner(column, sources, columns_of)
+            if table in found and column.name not in found[table][role]:
+                found[table][role].append(column.name)
+
+        where = select.args.get("where")
+        conditions = _conjuncts(where.this if where else None)
+        for join in select.args.get("joins") or []:
+            conditions += _conjuncts(join.args.get("on"))
+        for condition in conditions:
+            if isinstance(condition, exp.Is) and isinstance(condition.this, exp.Column) \
+                    and isinstance(condition.expression, exp.Null):
+                table = _owner(condition.this, sources, columns_of)
+                if condition.this.name != SOFT_DELETE_COLUMN:
+                    # btree indexes find NULLs like any other value
+                    add("eq", condition.this)
+                elif table in found:
+                    found[table]["live"] = True
+            elif isinstance(condition, (exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+                sides = [condition.left, condition.right]
+                columns = [side for side in sides if isinstance(side, exp.Column)]
+                if len(columns) == 2:
+                    add("join", columns[0])
+                    add("join", columns[1])
+                elif len(columns) == 1 and not any(s.find(exp.Column) for s in sides if s is not columns[0]):
+                    add("eq" if isinstance(condition, exp.EQ) else "range", columns[0])
+            elif isinstance(condition, (exp.In, exp.Between)) and isinstance(condition.this, exp.Column):
+                add("eq" if isinstance(condition, exp.In) else "range", condition.this)
+        for column in select.find_all(exp.Column):
+            if column.find_ancestor(exp.Select) is not select:
+                continue
+            table = _owner(column, sources, columns_of)
+            if table in found:
+                found[table]["used"].add(column.name)
+        patterns.extend(found.values())
+    return patterns
+
+
+def index_name(candidate: dict) -> str:
+    name = f"ix_{candidate['table']}_{'_'.join(candidate['keys'])}" + ("_live" if candidate["partial"] else "")
+    return name[:63]
+
+
+def ddl(candidate: dict, hypothetical: bool = False) -> str:
+    """CREATE INDEX statement for `candidate`; HypoPG takes it without a name."""
+    head = "CREATE INDEX ON" if hypothetical else \
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(candidate)} ON"
+    statement = f"{head} {candidate['table']} ({', '.join(candidate['keys'])})"
+    if candidate["include"]:
+        statement += f" INCLUDE ({', '.join(candidate['include'])})"
+    if candidate["partial"]:
+        statement += f" WHERE {SOFT_DELETE_COLUMN} IS NULL"
+    return statement
+
+
+def candidates(pattern: dict) -> list:
+    """Filter and join index candidates for one access pattern."""
+    found = []
+    keys_options = []
+    if pattern["eq"] or pattern["range"]:
+        keys_options.append(("filter", pattern["eq"] + pattern["range"][:1]))
+    keys_options += [("join", [column]) for column in pattern["join"]]
+    for kind, keys in keys_options:
+        rest = sorted(pattern["used"] - set(keys) - {SOFT_DELETE_COLUMN})
+        # a partial index answers deleted_at IS NULL without the column
+        covering = len(rest) <= MAX_INCLUDE and (pattern["live"] or SOFT_DELETE_COLUMN not in pattern["used"])
+        found.append({
+            "table": pattern["table"],
+            "kind": kind,
+            "keys": keys,
+            "include": rest if covering else [],
+            "covering": covering,
+            "partial": pattern["live"],
+        })
+    return found
+
+
+def _walk(node: dict, ancestors: tuple = ()):
+    yield node, ancestors
+    for child in node.get("Plans", []):
+        yield from _walk(child, ancestors + (node,))
+
+
+def seq_scans(plan: dict, table: str) -> list:
+    """
+    The sequential scans of `table` in an EXPLAIN (ANALYZE, BUFFERS) plan.
+
+    Returns:
+        Per scan: `ms` spent in it, rows `scanned` and `kept` by its filter,
+        rows out of the join above it (`joined`, None without one), the
+        `filter` and join `condition` texts and the shared `blocks` it read.
+    """
+    scans = []
+    for node, ancestors in _walk(plan):
+        if node.get("Node Type") != "Seq Scan" or node.get("Relation Name") != table:
+            continue
+        loops = node.get("Actual Loops", 1) or 1
+        kept = node.get("Actual Rows", 0) * loops
+        join = next((a for a in reversed(ancestors) if a.get("Node Type", "").endswith(("Join", "Loop"))), None)
+        scans.append({
+            "ms": node.get("Actual Total Time", 0.0) * loops,
+            "scanned": kept + node.get("Rows Removed by Filter", 0) * loops,
+            "kept": kept,
+            "joined": join.get("Actual Rows", 0) * (join.get("Actual Loops", 1) or 1) if join else None,
+            "filter": node.get("Filter", ""),
+            "condition": " ".join(join.get(k, "") for k in ("Hash Cond", "Merge Cond", "Join Filter")) if join else "",
+            "blocks": node.get("Shared Hit Blocks", 0) + node.get("Shared Read Blocks", 0),
+        })
+    return scans
+
+
+def _mentions(condition: str, column: str) -> bool:
+    return re.search(rf"\b{re.escape(column)}\b", condition) is not None
+
+
+def measured_saving(candidate: dict, scans: list) -> float:
+    """
+    Milliseconds per execution the index would save on the measured scans.
+
+    A scan it serves keeps its time for the rows still fetched, each at
+    INDEX_ROW_COST (INDEX_ONLY_ROW_COST when covering) times a sequentially
+    scanned row, and saves the rest.
+    """
+    cost = INDEX_ONLY_ROW_COST if candidate["covering"] else INDEX_ROW_COST
+    saved = 0.0
+    for scan in scans:
+        if not scan["scanned"]:
+            continue
+        if candidate["kind"] == "filter":
+            if not any(_mentions(scan["filter"], key) for key in candidate["keys"]):
+                continue
+            needed = scan["kept"]
+        else:
+            if scan["joined"] is None or not _mentions(scan["condition"], candidate["keys"][0]):
+                continue
+            needed = min(scan["joined"], scan["scanned"])
+        saved += scan["ms"] * max(0.0, 1 - cost * needed / scan["scanned"])
+    return saved
+
+
+class IndexAdvisor:
+    """
+    Prices index candidates against a workload on one database.
+
+    Args:
+        engine: Engine to explain on; the reader engine, so the statements
+            run read-only.
+        columns_of: table -> column names; read from the catalog when omitted.
+        schema: Schema of the tables.
+    """
+
+    def __init__(self, engine, columns_of: dict = None, schema: str = "public"):
+        self.engine = engine
+        self.schema = schema
+        if columns_of is None:
+            from schema_catalog import SchemaCatalog
+            tables = SchemaCatalog(engine, schema=schema).tables
+            columns_of = {name: [c["name"] for c in table["columns"]] for name, table in tables.items()}
+        self.columns_of = columns_of
+        with engine.connect() as conn:
+            self.hypopg = conn.execute(
+                text("SELECT count(*) FROM pg_extension WHERE extname = 'hypopg'")
+            ).scalar() > 0
+            self.existing = {}
+            for table, columns in conn.execute(text(EXISTING_INDEXES_QUERY), {"schema": schema}):
+                self.existing.setdefault(table, []).append(list(columns))
+            self.table_rows = dict(conn.execute(text(TABLE_ROWS_QUERY), {"schema": schema}).fetchall())
+            self.column_stats = {
+                (table, column): (width or 0, null_frac or 0.0)
+                for table, column, width, null_frac in conn.execute(text(COLUMN_STATS_QUERY), {"schema": schema})
+            }
+
+    def is_indexed(self, candidate: dict) -> bool:
+        """True when an existing index already leads with the candidate's keys."""
+        keys = candidate["keys"]
+        return any(columns[: len(keys)] == keys for columns in self.existing.get(candidate["table"], []))
+
+    def estimate_size(self, candidate: dict) -> int:
+        """Bytes of the index, from the table's row count and column widths."""
+        rows = self.table_rows.get(candidate["table"], 0)
+        if candidate["partial"]:
+            rows *= self.column_stats.get((candidate["table"], SOFT_DELETE_COLUMN), (0, 1.0))[1]
+        width = sum(self.column_stats.get((candidate["table"], c), (8, 0.0))[0]
+                    for c in candidate["keys"] + candidate["include"])
+        tuple_size = INDEX_TUPLE_OVERHEAD + 8 * math.ceil(width / 8)
+        per_page = max(int((PAGE_SIZE - PAGE_HEADER) * FILLFACTOR // tuple_size), 1)
+        leaf_pages = math.ceil(rows / per_page)
+        # meta page plus roughly one inner page per hundred leaves
+        return (leaf_pages + math.ceil(leaf_pages / 100) + 1) * PAGE_SIZE
+
+    def explain(self, conn, sql: str, params: dict, analyze: bool = False) -> dict:
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        result = conn.execute(text(f"EXPLAIN ({options}) {sql}"), params).scalar()
+        return (json.loads(result) if isinstance(result, str) else result)[0]
+
+    def _hypothetical_saving(self, conn, statement: dict, candidate: dict, before: float, ms: float):
+        """(ms saved per execution, index bytes) from a HypoPG index, or None if HypoPG refused it."""
+        try:
+            with conn.begin_nested():
+                indexrelid = conn.execute(
+                    text("SELECT indexrelid FROM hypopg_create_index(:ddl)"), {"ddl": ddl(candidate, True)}
+                ).scalar()
+                after = self.explain(conn, statement["sql"], statement["params"])["Plan"]["Total Cost"]
+                size = conn.execute(text("SELECT hypopg_relation_size(:oid)"), {"oid": indexrelid}).scalar()
+        except Exception:
+            return None
+        finally:
+            conn.execute(text("SELECT hypopg_reset()"))
+        return ms * max(0.0, 1 - after / before) if before else 0.0, size
+
+    def analyze_statement(self, statement: dict) -> dict:
+        """EXPLAIN ANALYZE one workload statement and price its candidates."""
+        missing = set(_BIND_RE.findall(statement["sql"])) - set(statement["params"])
+        report = {"sql": statement["sql"], "executions": statement["executions"],
+                  "mean_ms": statement["db_ms"] / statement["executions"], "candidates": []}
+        if missing:
+            report["error"] = f"no bind values for {', '.join(sorted(missing))}"
+            return report
+        found = {}
+        for pattern in access_patterns(statement["sql"], self.columns_of):
+            for candidate in candidates(pattern):
+                if not self.is_indexed(candidate):
+                    found.setdefault(ddl(candidate), candidate)
+        try:
+            with self.engine.connect() as conn:
+                analyzed = self.explain(conn, statement["sql"], statement["params"], analyze=True)
+                plan = analyzed["Plan"]
+                report.update(
+                    plan_ms=analyzed.get("Execution Time", 0.0),
+                    blocks=plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+                )
+                before = self.explain(conn, statement["sql"], statement["params"])["Plan"]["Total Cost"] \
+                    if self.hypopg and found else None
+                for statement_ddl, candidate in found.items():
+                    priced = None
+                    if self.hypopg:
+                        priced = self._hypothetical_saving(conn, statement, candidate, before, report["plan_ms"])
+                    if priced is None:
+                        saving = measured_saving(candidate, seq_scans(plan, candidate["table"]))
+                        priced = saving, self.estimate_size(candidate)
+                    if priced[0] > 0:
+                        report["candidates"].append({"ddl": statement_ddl, "candidate": candidate,
+                                                     "saved_ms": priced[0], "size": priced[1]})
+                conn.rollback()
+        except Exception as e:
+            report["error"] = str(e).splitlines()[0]
+        return report
+
+    def advise(self, workload: list, sample: int = 50) -> dict:
+        """
+        Explain the `sample` statements with the most database time and rank
+        the candidate indexes by the time they would save across the workload.
+        """
+        statements = [self.analyze_statement(s) for s in workload[:sample]]
+        ranked = {}
+        for report in statements:
+            for priced in report["candidates"]:
+                entry = ranked.setdefault(priced["ddl"], {
+                    "ddl": priced["ddl"] + ";", "table": priced["candidate"]["table"],
+                    "saved_ms": 0.0, "executions": 0, "statements": 0, "size": priced["size"],
+                })
+                entry["saved_ms"] += priced["saved_ms"] * report["executions"]
+                entry["executions"] += report["executions"]
+                entry["statements"] += 1
+        recommendations = sorted(ranked.values(), key=lambda r: -r["saved_ms"])
+        return {"hypopg": self.hypopg, "statements": statements, "recommendations": recommendations}
+
+
+def _size(size: int) -> str:
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main():
+    from db import DataAccess
+
+    parser = argparse.ArgumentParser(description="Recommend indexes for the agent's SQL workload")
+    parser.add_argument("--traces", default=os.environ.get("TRACE_FILE", DEFAULT_TRACE_FILE))
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--sample", type=int, default=50, help="statements to explain, by database time")
+    parser.add_argument("--top", type=int, default=20, help="recommendations to print")
+    parser.add_argument("--out", help="write the recommended DDL to this file")
+    args = parser.parse_args()
+
+    workload = load_workload(args.traces)
+    print(f"{len(workload)} statements, {sum(s['executions'] for s in workload)} executions "
+          f"in {args.traces}")
+    advisor = IndexAdvisor(DataAccess(args.database_url).reader)
+    advice = advisor.advise(workload, sample=args.sample)
+    print("pricing: " + ("HypoPG hypothetical indexes" if advice["hypopg"] else "measured scan times"))
+    for report in advice["statements"]:
+        if "error" in report:
+            print(f"  skipped ({report['error']}): {report['sql'][:100]}")
+
+    recommendations = advice["recommendations"][: args.top]
+    for rank, rec in enumerate(recommendations, 1):
+        print(f"\n{rank:2}. saves ~{rec['saved_ms']:,.0f} ms over {rec['executions']} executions "
+              f"of {rec['statements']} statements, ~{_size(rec['size'])}")
+        print(f"    {rec['ddl']}")
+    if not recommendations:
+        print("no index would help the sampled statements")
+    if args.out:
+        with open(args.out, "w") as f:
+            for rec in recommendations:
+                f.write(f"-- saves ~{rec['saved_ms']:,.0f} ms over {rec['executions']} executions, "
+                        f"~{_size(rec['size'])}\n{rec['ddl']}\n\n")
+        print(f"\nDDL written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+import os
+import re
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+# words that can appear around any intent without changing its meaning
+COMMON_WORDS = {
+    "a", "all", "amount", "an", "and", "are", "at", "bank", "by", "can", "count", "current",
+    "currently", "display", "do", "does", "each", "every", "find", "for", "from", "get",
+    "give", "has", "have", "how", "i", "in", "inr", "is", "it", "its", "list", "many", "me",
+    "much", "number", "of", "on", "our", "overall", "per", "please", "rs", "rupees", "see",
+    "show", "sum", "tell", "the", "their", "there", "to", "total", "value", "we", "what",
+    "whats", "which", "wise", "with", "wrt", "you", "want",
+    # parameter phrasing: ranks and date ranges
+    "top", "most", "highest", "largest", "biggest", "maximum", "max", "rank", "ranked",
+    "ranking", "order", "ordered", "sorted", "last", "past", "this", "since", "between",
+    "day", "days", "week", "weeks", "month", "months", "year", "years",
+}
+
+COUNT_RE = re.compile(r"^\s*(?:how many|count|number of|total number of|what is the number of)\b")
+AGGREGATE_RE = re.compile(r"\b(?:total|sum|how much|amount|performance|top|most|highest|by branch|per branch|each branch|branchwise)\b")
+GROUP_BY_BRANCH_RE = re.compile(r"\b(?:branches|branchwise|branch wise|by branch|per branch|each branch|every branch|branch performance)\b")
+
+# what a count question counts: the first of these nouns after the count phrase
+COUNTED_RE = re.compile(
+    r"^\s*(?:how many|count|number of|total number of|what is the (?:total )?number of)\b.*?"
+    r"\b(customers?|clients?|loans?|repayments?|payments?|installments?|emis?|accounts?|branch(?:es)?|deposits?)\b"
+)
+# a ranking over branches ("branch with the highest", "top 3 branches"), as
+# opposed to "the highest balance", which asks for one row
+RANKS_BRANCHES_RE = re.compile(r"\bbranch(?:es|wise)?\b(?![\s_-]*\d)")
+
+BRANCH_RE = re.compile(r"\bbranch[\s_-]*(\d+)\b")
+TOP_RE = re.compile(r"\btop\s+(\d+)\b")
+SINGLE_RE = re.compile(r"\b(?:most|highest|largest|biggest|maximum|max)\b")
+LAST_RE = re.compile(r"\b(?:last|past)\s+(\d+)?\s*(day|week|month|year)s?\b")
+YEAR_RE = re.compile(r"\b(?:in|during|for)\s+((?:19|20)\d{2})\b")
+BETWEEN_RE = re.compile(r"\bbetween\s+(\d{4}-\d{2}-\d{2})\s+and\s+(\d{4}-\d{2}-\d{2})\b")
+THIS_RE = re.compile(r"\bthis\s+(month|year)\b")
+
+
+def extract_params(question: str) -> dict:
+    """Pull branch name, top-N limit and date range out of a lower-cased question."""
+    params = {}
+    match = BRANCH_RE.search(question)
+    if match:
+        params["branch"] = f"Branch_{match.group(1)}"
+    match = TOP_RE.search(question)
+    if match:
+        params["limit"] = int(match.group(1))
+    elif SINGLE_RE.search(question):
+        params["limit"] = 1
+
+    today = date.today()
+    if BETWEEN_RE.search(question):
+        start, end = BETWEEN_RE.search(question).groups()
+        params["start"] = date.fromisoformat(start)
+        params["end"] = date.fromisoformat(end) + timedelta(days=1)
+    elif LAST_RE.search(question):
+        count, unit = LAST_RE.search(question).groups()
+        count = int(count or 1)
+        days = {"day": 1, "week": 7, "month": 30, "year": 365}[unit] * count
+        params["start"] = today - timedelta(days=days)
+        params["end"] = today + timedelta(days=1)
+    elif YEAR_RE.search(question):
+        year = int(YEAR_RE.search(question).group(1))
+        params["start"] = date(year, 1, 1)
+        params["end"] = date(year + 1, 1, 1)
+    elif THIS_RE.search(question):
+        unit = THIS_RE.search(question).group(1)
+        params["start"] = today.replace(day=1) if unit == "month" else today.replace(month=1, day=1)
+        params["end"] = today + timedelta(days=1)
+    return params
+
+
+def _strip_params(question: str) -> str:
+    for pattern in (BRANCH_RE, TOP_RE, BETWEEN_RE, YEAR_RE):
+        question = pattern.sub(" ", question)
+    return re.sub(r"\d+", " ", question)
+
+
+def _count_of(sql: str, alias: str) -> str:
+    return f"SELECT COUNT(*) AS {alias} FROM ({sql}) AS matched"
+
+
+def _limit(sql: str, params: dict, bind: dict) -> str:
+    if "limit" in params:
+        bind["limit"] = params["limit"]
+        return sql + "\nLIMIT :limit"
+    return sql
+
+
+# --- SQL templates; every table read carries its deleted_at IS NULL predicate
+
+
+def customer_count_sql(question, params):
+    return "SELECT COUNT(*) AS customer_count FROM customers WHERE deleted_at IS NULL", {}
+
+
+def _branch_totals_sql(question, params, table, short, measure, alias, date_column=None):
+    bind = {}
+    where = [f"{short}.deleted_at IS NULL"]
+    if date_column and "start" in params:
+        where.append(f"{short}.{date_column} >= :start AND {short}.{date_column} < :end")
+        bind.update(start=params["start"], end=params["end"])
+    if "branch" not in params and "limit" not in params and not GROUP_BY_BRANCH_RE.search(question):
+        # one figure for the whole bank
+        sql = f"SELECT SUM({short}.{measure}) AS {alias}\nFROM {table} {short}\nWHERE {' AND '.join(where)}"
+        return sql, bind
+
+    where.insert(0, "b.deleted_at IS NULL")
+    join = f"FROM branches b\nJOIN {table} {short} ON {short}.branch_id = b.branch_id\n"
+    if "branch" in params:
+        where.append("lower(b.branch_name) = lower(:branch)")
+        bind["branch"] = params["branch"]
+        sql = f"SELECT SUM({short}.{measure}) AS {alias}\n{join}WHERE {' AND '.join(where)}"
+        return sql, bind
+    sql = (
+        f"SELECT b.branch_name, SUM({short}.{measure}) AS {alias}\n{join}"
+        f"WHERE {' AND '.join(where)}\nGROUP BY b.branch_name\nORDER BY {alias} DESC"
+    )
+    return _limit(sql, params, bind), bind
+
+
+def branch_deposits_sql(question, params):
+    return _branch_totals_sql(question, params, "accounts", "a", "balance", "total_deposits")
+
+
+def branch_loans_sql(question, params):
+    return _branch_totals_sql(
+        question, params, "loans", "l", "principal", "total_loan_amount", date_column="disbursed_at"
+    )
+
+
+def loan_delinquency_sql(question, params):
+    bind = {}
+    where = [
+        "r.paid_date IS NULL",
+        "r.due_date < CURRENT_DATE",
+        "r.deleted_at IS NULL",
+        "l.deleted_at IS NULL",
+        "c.deleted_at IS NULL",
+        "b.deleted_at IS NULL",
+    ]
+    if "branch" in params:
+        where.append("lower(b.branch_name) = lower(:branch)")
+        bind["branch"] = params["branch"]
+    if "start" in params:
+        where.append("r.due_date >= :start AND r.due_date < :end")
+        bind.update(start=params["start"], end=params["end"])
+    sql = (
+        "SELECT l.loan_id, c.full_name, b.branch_name, r.due_date, r.amount_due\n"
+        "FROM repayments r\n"
+        "JOIN loans l ON l.loan_id = r.loan_id\n"
+        "JOIN customers c ON c.customer_id = l.customer_id\n"
+        "JOIN branches b ON b.branch_id = l.branch_id\n"
+        f"WHERE {' AND '.join(where)}\n"
+        "ORDER BY r.due_date"
+    )
+    if COUNT_RE.search(question):
+        return _count_of(sql, "overdue_repayments"), bind
+    return sql, bind
+
+
+def kyc_pending_sql(question, params):
+    sql = (
+        "SELECT customer_id, full_name, created_at\n"
+        "FROM customers\n"
+        "WHERE kyc_status = 'PENDING' AND deleted_at IS NULL\n"
+        "ORDER BY full_name"
+    )
+    if COUNT_RE.search(question):
+        return _count_of(sql, "kyc_pending_customers"), {}
+    return sql, {}
+
+
+def inactive_customers_sql(question, params):
+    sql = (
+        "SELECT c.customer_id, c.full_name\n"
+        "FROM customers c\n"
+        "WHERE c.deleted_at IS NULL\n"
+        "  AND NOT EXISTS (SELECT 1 FROM accounts a WHERE a.customer_id = c.customer_id AND a.deleted_at IS NULL)\n"
+        "  AND NOT EXISTS (SELECT 1 FROM loans l WHERE l.customer_id = c.customer_id AND l.deleted_at IS NULL)\n"
+        "ORDER BY c.full_name"
+    )
+    if COUNT_RE.search(question):
+        return _count_of(sql, "inactive_customers"), {}
+    return sql, {}
+
+
+def branch_customers_sql(question, params):
+    bind = {}
+    sql = (
+        "SELECT b.branch_name, COUNT(DISTINCT cb.customer_id) AS customer_count\n"
+        "FROM branches b\n"
+        "JOIN (SELECT customer_id, branch_id FROM accounts WHERE deleted_at IS NULL\n"
+        "      UNION\n"
+        "      SELECT customer_id, branch_id FROM loans WHERE deleted_at IS NULL) cb\n"
+        "  ON cb.branch_id = b.branch_id\n"
+        "JOIN customers c ON c.customer_id = cb.customer_id AND c.deleted_at IS NULL\n"
+        "WHERE b.deleted_at IS NULL\n"
+        "GROUP BY b.branch_name\n"
+        "ORDER BY customer_count DESC"
+    )
+    return _limit(sql, params, bind), bind
+
+
+# Common Analytical Intent Mapping of docs/Info.txt. `pattern` must match,
+# every remaining word must be in COMMON_WORDS or `vocabulary`, the question
+# must be close enough to one of the `examples`, and every parameter found in
+# it must be one the template applies (`params`; "start" brings "end"). A
+# top-N or "highest" only ranks branches when the question is about branches
+# (`ranks`), and a count question must count what the template counts
+# (`counts`; none for the SUM templates).
+INTENTS = [
+    {
+        "name": "customer_count",
+        "pattern": re.compile(r"^\s*(?:how many|count|number of|total number of|what is the (?:total )?number of)\b.*\b(?:customers?|clients?)\b"),
+        "vocabulary": {"customers", "customer", "clients", "client", "are"},
+        "examples": ["how many customers are there", "total number of customers", "count customers"],
+        "params": set(),
+        "counts": {"customers", "customer", "clients", "client"},
+        "build": customer_count_sql,
+    },
+    {
+        "name": "branch_deposits",
+        "pattern": re.compile(r"\b(?:deposits?|balances?)\b"),
+        "requires": AGGREGATE_RE,
+        "vocabulary": {"deposits", "deposit", "balance", "balances", "accounts", "account", "branch",
+                       "branches", "branchwise", "performance", "held", "money"},
+        "examples": ["sum of all deposits in branch_1", "top 5 branches by total deposits",
+                     "branch performance by total deposits", "total balance of all accounts"],
+        # balances are a snapshot; a date range has nothing to filter
+        "params": {"branch", "limit"},
+        "ranks": RANKS_BRANCHES_RE,
+        "counts": set(),
+        "build": branch_deposits_sql,
+    },
+    {
+        "name": "branch_loans",
+        "pattern": re.compile(r"\bloans?\b"),
+        "requires": AGGREGATE_RE,
+        "vocabulary": {"loans", "loan", "principal", "disbursed", "lent", "lending", "issued", "book",
+                       "branch", "branches", "branchwise", "performance"},
+        "examples": ["total loan amount in branch_3", "branch performance by loan amount",
+                     "top 3 branches by loans disbursed"],
+        "params": {"branch", "limit", "start", "end"},
+        "ranks": RANKS_BRANCHES_RE,
+        "counts": set(),
+        "build": branch_loans_sql,
+    },
+    {
+        "name": "loan_delinquency",
+        "pattern": re.compile(r"\b(?:overdue|delinquen\w*|unpaid|missed)\b"),
+        "vocabulary": {"repayments", "repayment", "payments", "payment", "installments", "installment",
+                       "emi", "emis", "loans", "loan", "overdue", "delinquent", "delinquency",
+                       "unpaid", "missed", "due", "details", "customers", "customer", "branch"},
+        "examples": ["show loans with overdue repayments", "loan delinquency",
+                     "how many repayments are overdue in branch_2"],
+        "params": {"branch", "start", "end"},
+        # one row per overdue repayment, so only repayments can be counted
+        "counts": {"repayments", "repayment", "payments", "payment", "installments", "installment",
+                   "emi", "emis"},
+        "build": loan_delinquency_sql,
+    },
+    {
+        "name": "kyc_pending",
+        "pattern": re.compile(r"^(?!.*\bnot\s+pending\b).*\bkyc\b.*\b(?:pending|need\w*|incomplete|not verified|unverified|awaiting)\b|\b(?:pending|need\w*|incomplete|unverified|awaiting)\b.*\bkyc\b"),
+        "vocabulary": {"customers", "customer", "kyc", "pending", "need", "needs", "needing",
+                       "require", "requires", "requiring", "incomplete", "unverified", "not",
+                       "verified", "verification", "status", "still", "yet", "awaiting"},
+        "examples": ["customers needing kyc", "which customers have pending kyc",
+                     "how many customers still need kyc verification"],
+        "params": set(),
+        "counts": {"customers", "customer"},
+        "build": kyc_pending_sql,
+    },
+    {
+        "name": "inactive_customers",
+        "pattern": re.compile(r"\b(?:inactive|dormant)\b.*\bcustomers?\b|\bcustomers?\b.*\b(?:no|without)\s+(?:any\s+)?(?:accounts?\s+(?:or|and|nor)\s+loans?|loans?\s+(?:or|and|nor)\s+accounts?)\b"),
+        "vocabulary": {"customers", "customer", "inactive", "dormant", "no", "without", "any",
+                       "accounts", "account", "or", "nor", "loans", "loan"},
+        "examples": ["inactive customers", "customers with no accounts or loans",
+                     "how many dormant customers"],
+        "params": set(),
+        "counts": {"customers", "customer"},
+        "build": inactive_customers_sql,
+    },
+    {
+        "name": "branch_customers",
+        "pattern": re.compile(r"\bbranch\w*\b.*\bcustomers?\b|\bcustomers?\b.*\b(?:per|by|each|every)\s+branch\b"),
+        "requires": re.compile(r"\b(?:most|highest|largest|biggest|maximum|top|per|each|every|by)\b"),
+        "vocabulary": {"branch", "branches", "customers", "customer", "branchwise", "has", "having",
+                       "served", "serves"},
+        "examples": ["branch with most customers", "number of customers per branch",
+                     "top 3 branches by customers"],
+        "params": {"limit"},
+        "ranks": RANKS_BRANCHES_RE,
+        "counts": {"customers", "customer"},
+        "build": branch_customers_sql,
+    },
+]
+
+
+class IntentRouter:
+    """
+    Cheap router that answers the common analytical intents without the LLM.
+
+    A question is routed when an intent's keyword pattern matches, none of
+    its words fall outside the intent's vocabulary (so "how many customers
+    have loans above 5 lakh" is not mistaken for a plain customer count), the
+    template can apply every branch, limit and date range the question names
+    (so "how many customers in branch_1" is not answered bank-wide, and a
+    question naming two branches goes to the agent), a count question counts
+    what the template counts and a "highest" ranks branches only when it asks
+    about branches, and its embedding is within `threshold` cosine similarity
+    of the intent's example phrasings. The matching template is filled with the extracted
+    branch name, top-N limit and date range and returned as bound SQL;
+    anything else returns None and goes to the agent.
+    """
+
+    def __init__(self, embeddings, intents=INTENTS, threshold: float = None):
+        self.embeddings = embeddings
+        self.intents = intents
+        self.threshold = threshold or float(os.environ.get("INTENT_ROUTER_THRESHOLD", 0.55))
+        self._lock = threading.Lock()
+        self._examples = None
+
+    def _example_vectors(self):
+        with self._lock:
+            if self._examples is None:
+                texts = [ex for intent in self.intents for ex in intent["examples"]]
+                owners = [intent["name"] for intent in self.intents for _ in intent["examples"]]
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                self._examples = (owners, vectors)
+            return self._examples
+
+    def warm_up(self):
+        """Embed the intent examples ahead of the first question."""
+        self._example_vectors()
+
+    def _candidates(self, question: str, params: dict):
+        words = set(re.findall(r"[a-z]+", _strip_params(question)))
+        for intent in self.intents:
+            if not intent["pattern"].search(question):
+                continue
+            if "requires" in intent and not intent["requires"].search(question):
+                continue
+            if words - COMMON_WORDS - intent["vocabulary"]:
+                continue
+            if set(params) - intent["params"]:
+                continue
+            if "limit" in params and not ("ranks" in intent and intent["ranks"].search(question)):
+                continue
+            if COUNT_RE.search(question):
+                counted = COUNTED_RE.search(question)
+                if counted is None or counted.group(1) not in intent["counts"]:
+                    continue
+            yield intent
+
+    def route(self, question: str):
+        """
+        Match `question` to a template.
+
+        Returns:
+            A dict with the intent name, SQL text and bind parameters, or None.
+        """
+        q = " ".join(question.lower().split()).rstrip("?.! ")
+        if len(BRANCH_RE.findall(q)) > 1:
+            # the templates filter on one branch
+            return None
+        params = extract_params(q)
+        candidates = list(self._candidates(q, params))
+        if not candidates:
+            return None
+
+        owners, vectors = self._example_vectors()
+        vector = np.asarray(self.embeddings.embed_query(q), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        scores = vectors @ vector
+        best, best_score = None, self.threshold
+        for intent in candidates:
+            score = max(float(s) for s, owner in zip(scores, owners) if owner == intent["name"])
+            if score >= best_score:
+                best, best_score = intent, score
+        if best is None:
+            return None
+
+        sql, bind = best["build"](q, params)
+        return {"intent": best["name"], "sql": sql, "params": bind, "score": best_score}
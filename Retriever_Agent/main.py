@@ -1,14 +1,26 @@
 import gradio as gr
-from agent_core import SQLAgent
+from client import AgentClient, agent_client
+from concurrency import Busy
 
-# Initialize the agent
-sql_agent = SQLAgent()
+# With AGENT_SERVER_URL set, questions go to server.py and this process loads
+# nothing heavy. Otherwise the agent runs here; building it is cheap, the
+# models and stores load on first use or during the warm-up started at launch
+sql_agent = agent_client()
+if sql_agent is None:
+    from agent_core import SQLAgent
+    sql_agent = SQLAgent()
 
-def chat_interface(message, history):
+async def chat_interface(message, history, request: gr.Request):
     history = history or []
     
-    # Get the agent's response
-    response = sql_agent.invoke(message)
+    # Get the agent's response; awaiting keeps the event loop free for the
+    # other users while the LLM and database work. Each browser session is
+    # one agent session, so a follow-up or an answer to a clarification
+    # builds on the earlier turns
+    try:
+        response = await sql_agent.ainvoke(message, session_id=request.session_hash)
+    except Busy:
+        response = "The assistant is busy right now, please try again in a moment."
     
     # Check for clarification requests
     if response.startswith("CLARIFICATION_NEEDED:"):
@@ -43,4 +55,14 @@ iface = gr.ChatInterface(
 )
 
 if __name__ == "__main__":
+    if not isinstance(sql_agent, AgentClient):
+        # let Gradio run as many chats at once as the agent admits in flight;
+        # the rest wait in Gradio's queue
+        iface.queue(default_concurrency_limit=sql_agent.resources.limiter.limit)
+        # accept connections right away; requests arriving before the warm-up
+        # is done wait for the piece they need instead of failing
+        sql_agent.warm_up()
+    else:
+        # the server bounds the work and answers "busy" past its queue
+        iface.queue(default_concurrency_limit=None)
     iface.launch()
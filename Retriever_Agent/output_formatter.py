@@ -1,19 +1,267 @@
-from typing import List, Any, Dict
-from langchain_groq import ChatGroq
 import os
-from dotenv import load_dotenv
+import re
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, List
 
-load_dotenv()
-groq_api_key = os.environ.get("GROQ_API_KEY")
-llm = ChatGroq(model="llama3-8b-8192", temperature=0, api_key=groq_api_key)
+# column names (or parts of them) that hold INR amounts in trad_db
+MONEY_WORDS = ("balance", "principal", "amount", "deposit", "loan", "emi", "repayment", "rupee", "inr")
 
-def format_output(question: str, result: List[Dict[str, Any]]) -> str:
+_AGGREGATES = {"count": "COUNT", "sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX"}
+_AGGREGATE_SQL_RE = re.compile(
+    r"^\s*select\s+(?:distinct\s+)?(count|sum|avg|min|max)\s*\(\s*(?:distinct\s+)?(?:\w+\.)?(\w+|\*)?",
+    re.IGNORECASE,
+)
+_COUNT_QUESTION_RE = re.compile(
+    r"^\s*(?:how many|what is the (?:total )?number of|(?:the )?(?:total )?number of|count(?: the| of)?)\s+"
+    r"(?P<subject>[\w\s-]+?)"
+    r"(?:\s+(?P<rest>(?:are|is|were|was|have|has|had|do|does|did|with|in|at|from|that|who|which|whose|under|on|by)\b.*?))?"
+    r"\s*\??\s*$",
+    re.IGNORECASE,
+)
+_WHAT_QUESTION_RE = re.compile(
+    r"^\s*(?:what(?: is|'s| was| are)|show(?: me)?|tell me|give me|find|get)\s+(?:the\s+)?(?P<label>.+?)\s*\??\s*$",
+    re.IGNORECASE,
+)
+# "does branch_3 have": the auxiliary and the verb have to move round the
+# count, which only works for "have"
+_AUXILIARY_RE = re.compile(r"^(?P<aux>do|does|did)\s+(?P<owner>.+?)\s+have\b(?P<tail>.*)$", re.IGNORECASE)
+_AUXILIARY_WORD_RE = re.compile(r"\b(?:do|does|did)\b", re.IGNORECASE)
+_AGGREGATE_PHRASE_RE = re.compile(
+    r"^\s*(?:the\s+)?(?:sum|total|average|avg|mean|max|maximum|min|minimum|highest|lowest)\b", re.IGNORECASE
+)
+
+_llm = None
+
+
+def _fallback_llm():
+    """The LLM used for sentences no template covers, built on first use."""
+    global _llm
+    if _llm is None:
+        from resources import get_resources
+        _llm = get_resources().llm("llama3-8b-8192")
+    return _llm
+
+
+def group_indian(digits: str) -> str:
+    """Group an unsigned integer string the Indian way: 12,34,56,789."""
+    if len(digits) <= 3:
+        return digits
+    head, tail = digits[:-3], digits[-3:]
+    groups = []
+    while len(head) > 2:
+        groups.insert(0, head[-2:])
+        head = head[:-2]
+    if head:
+        groups.insert(0, head)
+    return ",".join(groups + [tail])
+
+
+def format_number(value, decimals: int = 0) -> str:
+    """Format a number with lakh/crore digit grouping."""
+    amount = Decimal(str(value)).quantize(Decimal(1).scaleb(-decimals), rounding=ROUND_HALF_UP)
+    sign = "-" if amount < 0 else ""
+    whole, _, fraction = f"{abs(amount):f}".partition(".")
+    return sign + group_indian(whole) + (f".{fraction}" if fraction else "")
+
+
+def format_inr(value) -> str:
+    """
+    Format an amount in rupees, e.g. 'Rs. 12,34,567.89 (12.35 lakh)'.
+
+    Amounts of a lakh or more also get their size in lakh or crore.
+    """
+    text = f"Rs. {format_number(value, 2)}"
+    amount = abs(Decimal(str(value)))
+    if amount >= 10 ** 7:
+        text += f" ({format_number(amount / 10 ** 7, 2)} crore)"
+    elif amount >= 10 ** 5:
+        text += f" ({format_number(amount / 10 ** 5, 2)} lakh)"
+    return text
+
+
+def is_money(name: str) -> bool:
+    name = name.lower()
+    return any(word in name for word in MONEY_WORDS) and "count" not in name and not name.endswith("_id")
+
+
+def aggregate_of(sql: str = None, column: str = "") -> str:
+    """COUNT/SUM/AVG/MIN/MAX computed by the first output column, if any."""
+    if sql:
+        match = _AGGREGATE_SQL_RE.search(sql)
+        if match:
+            return _AGGREGATES[match.group(1).lower()]
+    for word, aggregate in _AGGREGATES.items():
+        if re.search(rf"(^|_){word}(_|$)", column.lower()):
+            return aggregate
+    if re.search(r"(^|_)total(_|$)", column.lower()):
+        return "SUM"
+    return None
+
+
+def _measure_of(sql: str, column: str) -> str:
+    """Readable name of what the first output column aggregates."""
+    match = _AGGREGATE_SQL_RE.search(sql or "")
+    if column.lower() in _AGGREGATES and match and match.group(2) and match.group(2) != "*":
+        return match.group(2).replace("_", " ")
+    measure = re.sub(r"^(total|sum|avg|average|min|max)_|_(total|sum|avg|average|min|max)$", "", column.lower())
+    return measure.replace("_", " ")
+
+
+def _format_value(value, money: bool) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float, Decimal)):
+        if money:
+            return format_number(value, 2)
+        if isinstance(value, int):
+            return str(value)
+        return format_number(value, 2)
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _singular(phrase: str) -> str:
+    words = phrase.split()
+    if words and words[-1].endswith("s") and not words[-1].endswith("ss"):
+        words[-1] = words[-1][:-1]
+    return " ".join(words)
+
+
+def scalar_sentence(question: str, column: str, value, sql: str = None) -> str:
+    """
+    Sentence for a single aggregate value built from templates.
+
+    Args:
+        question: The user's original question.
+        column: Name of the result column.
+        value: The value itself.
+        sql: The query that produced it, used to tell the aggregate apart.
+
+    Returns:
+        The sentence, or None when no template fits.
+    """
+    aggregate = aggregate_of(sql, column)
+    if value is None:
+        return "I found no records matching your query."
+
+    count_match = _COUNT_QUESTION_RE.match(question)
+    if aggregate == "COUNT" or (count_match and isinstance(value, int)):
+        count = int(value)
+        if count_match:
+            subject = count_match.group("subject").strip()
+            rest = (count_match.group("rest") or "").strip()
+            if count == 1:
+                subject = _singular(subject)
+            if not rest or re.match(r"(are|is) there\b", rest, re.IGNORECASE):
+                verb = "is" if count == 1 else "are"
+                return f"There {verb} {format_number(count)} {subject}."
+            auxiliary = _AUXILIARY_RE.match(rest)
+            if auxiliary:
+                # "how many loans does branch_3 have" -> "Branch_3 has 4 loans."
+                owner = auxiliary.group("owner")
+                verb = {"do": "have", "does": "has", "did": "had"}[auxiliary.group("aux").lower()]
+                tail = auxiliary.group("tail").strip()
+                sentence = f"{owner} {verb} {format_number(count)} {subject}" + (f" {tail}" if tail else "")
+                return sentence[0].upper() + sentence[1:] + "."
+            if _AUXILIARY_WORD_RE.search(rest):
+                return None
+            if count == 1:
+                rest = re.sub(r"^are\b", "is", re.sub(r"^have\b", "has", rest))
+            return f"{format_number(count)} {subject} {rest}."
+        label = column.replace("_", " ") if column and column != "count" else "number of matching records"
+        return f"The {label} is {format_number(count)}."
+
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        select_list = re.split(r"\bfrom\b", sql, maxsplit=1, flags=re.IGNORECASE)[0] if sql else ""
+        money = is_money(column) or (
+            aggregate in ("SUM", "AVG", "MIN", "MAX")
+            and any(is_money(word) for word in re.findall(r"\w+", select_list)[1:])
+        )
+        rendered = format_inr(value) if money else format_number(value, 0 if isinstance(value, int) else 2)
+    elif isinstance(value, date) and aggregate in ("MIN", "MAX"):
+        # "earliest", "latest", "most recent": the templates cannot tell
+        # which a date extreme answers
+        return None
+    elif isinstance(value, (date, str)):
+        rendered = _format_value(value, False)
+    else:
+        return None
+    what_match = _WHAT_QUESTION_RE.match(question)
+    if what_match:
+        return f"The {what_match.group('label')} is {rendered}."
+    if _AGGREGATE_PHRASE_RE.match(question):
+        # "sum of all deposits in branch_1" reads as its own subject
+        label = re.sub(r"^\s*the\s+", "", question.strip().rstrip("?. "), flags=re.IGNORECASE)
+        return f"The {label} is {rendered}."
+    if aggregate:
+        names = {"SUM": "total", "AVG": "average", "MIN": "lowest", "MAX": "highest"}
+        return f"The {names[aggregate]} {_measure_of(sql, column)} is {rendered}."
+    return None
+
+
+def markdown_table(result: List[Dict[str, Any]], columns: List[str] = None, total_rows: int = None,
+                   max_rows: int = None, max_cell_chars: int = None) -> str:
+    """
+    Render rows as a Markdown table, one column at a time.
+
+    Each column is formatted once for its type (amounts get lakh/crore
+    grouping and are right-aligned), cells longer than `max_cell_chars` are
+    cut, and only the first `max_rows` rows are shown with a note of how
+    many there are in total.
+    """
+    max_rows = max_rows or int(os.environ.get("OUTPUT_MAX_ROWS", 50))
+    max_cell_chars = max_cell_chars or int(os.environ.get("OUTPUT_MAX_CELL_CHARS", 60))
+    columns = list(columns or result[0].keys())
+    shown = result[:max_rows]
+
+    rendered, aligns = [], []
+    for name in columns:
+        values = [row.get(name) for row in shown]
+        numeric = all(v is None or isinstance(v, (int, float, Decimal)) and not isinstance(v, bool)
+                      for v in values)
+        money = numeric and is_money(name)
+        cells = []
+        for value in values:
+            cell = _format_value(value, money).replace("|", "\\|").replace("\n", " ")
+            if len(cell) > max_cell_chars:
+                cell = cell[: max_cell_chars - 1] + "…"
+            cells.append(cell)
+        rendered.append(cells)
+        aligns.append("---:" if numeric and values else "---")
+
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "| " + " | ".join(aligns) + " |",
+    ]
+    lines.extend("| " + " | ".join(cells) + " |" for cells in zip(*rendered))
+    total = total_rows if total_rows is not None else len(result)
+    if total > len(shown):
+        lines.append("")
+        lines.append(f"Showing {len(shown)} of {format_number(total)} rows.")
+    return "\n".join(lines)
+
+
+def format_output(question: str, result: List[Dict[str, Any]], columns: List[str] = None,
+                  total_rows: int = None, sql: str = None) -> str:
     """
     Formats the SQL query result into a user-friendly format.
 
+    Single aggregate values are turned into a sentence from templates; the
+    LLM is only asked when none fits. Everything else becomes a Markdown
+    table.
+
     Args:
         question: The user's original question.
         result: The result of the SQL query, as a list of dictionaries.
+        columns: Column names in result order.
+        total_rows: Size of the full result when `result` is only its first page.
+        sql: The query that produced the result.
 
     Returns:
         A formatted string (either a sentence or a Markdown table).
@@ -23,23 +271,20 @@ def format_output(question: str, result: List[Dict[str, Any]]) -> str:
 
     if len(result) == 1 and len(result[0]) == 1:
         # Single value result, generate a sentence
-        value = list(result[0].values())[0]
+        column, value = next(iter(result[0].items()))
+        sentence = scalar_sentence(question, column, value, sql)
+        if sentence is not None:
+            return sentence
         prompt = f"""
         The user asked: '{question}'
         The SQL query returned this value: {value}
-        
+
         Please formulate a concise, natural language sentence that answers the user's question based on this value.
-        If the value is a monetary amount, please format it as 'Rs. <amount>'.
+        If the value is a monetary amount, please format it as 'Rs. <amount>' with Indian digit grouping (e.g. Rs. 12,34,567.00).
         Example: If the user asked 'How many customers are there?' and the value is 100, you should return 'There are 100 customers.'
         """
-        sentence_response = llm.invoke(prompt)
+        sentence_response = _fallback_llm().invoke(prompt)
         return sentence_response.content
     else:
         # Table result
-        headers = result[0].keys()
-        header_line = "| " + " | ".join(headers) + " |"
-        separator = "| " + " | ".join(["---"] * len(headers)) + " |"
-        body_lines = [
-            "| " + " | ".join(map(str, row.values())) + " |" for row in result
-        ]
-        return "\n".join([header_line, separator] + body_lines)
+        return markdown_table(result, columns, total_rows)
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from glob import glob
+
+import numpy as np
+
+# files whose content defines what a generated SQL query may rely on
+SCHEMA_SOURCES = ("docs/*.txt", "trad_db/Table_Creation.sql")
+
+# tokens that change the meaning of a question even when the wording is
+# almost identical: numbers, quoted strings and names such as branch_1
+_LITERAL_RE = re.compile(r"'[^']*'|\"[^\"]*\"|\b\w*\d\w*\b")
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def schema_version(patterns=SCHEMA_SOURCES) -> str:
+    """Digest of the docs and DDL files; changes whenever either is edited.
+    Files are only read and hashed again when their mtime or size moved."""
+    stats = []
+    for pattern in patterns:
+        for path in sorted(glob(pattern)):
+            stat = os.stat(path)
+            stats.append((path, stat.st_mtime_ns, stat.st_size))
+    key = tuple(stats)
+    with _versions_lock:
+        if key in _versions:
+            return _versions[key]
+    digest = hashlib.sha256()
+    for path, _, _ in stats:
+        with open(path, "rb") as f:
+            digest.update(path.encode() + b"\0" + f.read())
+    version = digest.hexdigest()
+    with _versions_lock:
+        # one entry per pattern set is all a process needs
+        for stale in [k for k in _versions if [p for p, _, _ in k] == [p for p, _, _ in stats]]:
+            del _versions[stale]
+        _versions[key] = version
+    return version
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?. ")
+
+
+def question_literals(question: str) -> frozenset:
+    return frozenset(_LITERAL_RE.findall(question.lower()))
+
+
+class PlanCache:
+    """
+    Bounded LRU cache of question -> validated SQL, matched by embedding similarity.
+
+    A cached plan is reused for a new question when the cosine similarity of
+    the two question embeddings is at least `threshold` and both questions
+    carry the same literals (numbers, quoted strings, names like branch_1),
+    so "deposits in branch_1" never answers "deposits in branch_2". All
+    entries are dropped when the schema version changes.
+    """
+
+    def __init__(self, embeddings, max_entries: int = None, threshold: float = None,
+                 version_fn=schema_version):
+        self.embeddings = embeddings
+        self.max_entries = max_entries or int(os.environ.get("PLAN_CACHE_SIZE", 256))
+        self.threshold = threshold or float(os.environ.get("PLAN_CACHE_THRESHOLD", 0.9))
+        self.version_fn = version_fn
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, question: str):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        version = self.version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def lookup(self, question: str):
+        """
+        Return the SQL of a matching cached question, or None.
+
+        Args:
+            question: The user's question.
+
+        Returns:
+            The cached SQL string on a hit, None on a miss.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["sql"]
+            if not self._entries:
+                self.misses += 1
+                return None
+
+        vector = self._embed(question)
+        literals = question_literals(question)
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for other_key, entry in self._entries.items():
+                if entry["literals"] != literals:
+                    continue
+                score = float(np.dot(vector, entry["vector"]))
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key]["sql"]
+
+    def store(self, question: str, sql: str):
+        """Remember `sql` as the validated answer to `question`."""
+        vector = self._embed(question)
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            self._entries[key] = {
+                "vector": vector,
+                "literals": question_literals(question),
+                "sql": sql,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def evict(self, sql: str):
+        """Drop every entry that resolves to `sql`, e.g. after it failed to run."""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry["sql"] == sql]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every entry and reset the hit counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,94 @@
+"""
+Speculative schema lookups for the agent's first turn.
+
+Left alone, the model spends one round trip per lookup: `query_vecdb`, then
+`get_table_schema` for each table, then `get_join_path`, and only then
+writes SQL. `Prefetcher` makes those calls itself as soon as the question
+arrives, all at once, for the tables the question names (see
+`hybrid_retriever.tables_in_question`). Their results are handed to the
+agent as tool calls it already made, so the first model turn can go straight
+to `run_sql_query`.
+
+The calls go through the agent's own tools, so they are traced, served from
+the session's schema context on a follow-up, and compacted by the context
+budget like any other tool output. A lookup that fails is left out; the
+model can still make it. AGENT_PREFETCH=off turns prefetching off.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from hybrid_retriever import tables_in_question
+from tracing import get_tracer
+
+
+def planned_calls(question: str) -> list:
+    """(tool name, arguments) of the lookups the agent would make first."""
+    tables = sorted(tables_in_question(question))
+    calls = [("query_vecdb", {"question": question})]
+    calls += [("get_table_schema", {"table_name": table}) for table in tables]
+    if len(tables) > 1:
+        calls.append(("get_join_path", {"tables": tables}))
+    return calls
+
+
+def as_messages(calls: list, outputs: list) -> list:
+    """One assistant message requesting `calls` and a tool message per output."""
+    from langchain_core.messages import AIMessage, ToolMessage
+
+    done = [
+        ({"name": name, "args": args, "id": f"prefetch-{i}", "type": "tool_call"}, output)
+        for i, ((name, args), output) in enumerate(zip(calls, outputs))
+        if not isinstance(output, BaseException)
+    ]
+    if not done:
+        return []
+    return [AIMessage(content="", tool_calls=[call for call, _ in done])] + [
+        ToolMessage(content=str(output), tool_call_id=call["id"], name=call["name"])
+        for call, output in done
+    ]
+
+
+class Prefetcher:
+    """
+    Runs the planned lookups concurrently through `tools`.
+
+    Args:
+        tools: The agent's tools by name.
+        enabled: AGENT_PREFETCH (on) when omitted.
+    """
+
+    def __init__(self, tools: dict, enabled: bool = None):
+        self.tools = tools
+        self.enabled = enabled if enabled is not None else os.environ.get("AGENT_PREFETCH", "on") != "off"
+
+    def _plan(self, question: str) -> list:
+        if not self.enabled:
+            return []
+        return [(name, args) for name, args in planned_calls(question) if name in self.tools]
+
+    def messages(self, question: str, config: dict = None) -> list:
+        """The lookups for `question` as tool call and tool messages."""
+        calls = self._plan(question)
+        if not calls:
+            return []
+        with get_tracer().span("agent.prefetch", **{"prefetch.calls": len(calls)}):
+            with ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="prefetch") as pool:
+                # each call sees the caller's session and trace
+                futures = [
+                    pool.submit(contextvars.copy_context().run, self.tools[name].invoke, args, config)
+                    for name, args in calls
+                ]
+                outputs = [future.exception() or future.result() for future in futures]
+        return as_messages(calls, outputs)
+
+    async def amessages(self, question: str, config: dict = None) -> list:
+        calls = self._plan(question)
+        if not calls:
+            return []
+        with get_tracer().span("agent.prefetch", **{"prefetch.calls": len(calls)}):
+            outputs = await asyncio.gather(
+                *(self.tools[name].ainvoke(args, config) for name, args in calls), return_exceptions=True
+            )
+        return as_messages(calls, outputs)
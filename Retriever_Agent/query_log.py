@@ -0,0 +1,460 @@
+"""
+Append-only log of the questions SQLAgent answered, and a tool to replay them.
+
+Every `SQLAgent.ask` adds one row to a SQLite file (QUERY_LOG_DB,
+query_log.sqlite3). A row records:
+- when the question was asked, and in which session
+- how it was answered: plan cache, router, session follow-up or agent
+- the schema chunks retrieved
+- the SQL and bind values that ran
+- LLM turns and tokens
+- the time spent in each stage
+- the rows returned and the outcome
+
+The row keeps a digest of the result rather than the rows, so the log stays
+small but two runs of a question can still be compared. Rows are written by
+a background thread, off the request path. QUERY_LOG=off turns logging off.
+
+    python query_log.py summary --day 2026-10-17
+    python query_log.py replay --day 2026-10-17 --speed 10 --set RETRIEVER_MODE=vector
+
+`replay` re-asks one day's questions against an SQLAgent built from the
+current environment plus the `--set` overrides. Questions keep their
+sessions. They are asked at their original spacing, or `--speed` times
+faster. The report compares latency, stage times, LLM usage and answers with
+the original run.
+"""
+import argparse
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from concurrency import Busy
+
+# span name -> stage reported in the log
+STAGES = {
+    "plan_cache.lookup": "plan_cache",
+    "router.route": "router",
+    "agent.prefetch": "prefetch",
+    "retrieval": "retrieval",
+    "llm.call": "llm",
+    "sql.execute": "sql",
+    "format_output": "format",
+}
+
+COLUMNS = (
+    "trace_id", "asked_at", "day", "session_id", "question", "route", "outcome", "error",
+    "sql", "params", "chunks", "llm_turns", "input_tokens", "output_tokens", "latency_ms",
+    "stages", "rows", "result_digest", "answer", "replay_of",
+)
+
+# the original row a replayed question stands in for; set by `replay`
+_replaying = contextvars.ContextVar("replaying", default=None)
+
+
+def result_digest(result: dict):
+    """Digest of a result's columns, row count and (unordered) first rows."""
+    if not result:
+        return None
+    rows = sorted(json.dumps(list(row.values()), default=str) for row in result["rows"])
+    payload = json.dumps([result["columns"], result["total_rows"], rows])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _route(spans: list):
+    found = {span.name: span for span in spans}
+    if "llm.call" in found:
+        return "agent"
+    if "session.follow_up" in found:
+        return "session"
+    # a cached plan that failed falls through to the router
+    if "router.route" in found and found["router.route"].attributes.get("router.intent"):
+        return "router"
+    if "plan_cache.lookup" in found and found["plan_cache.lookup"].attributes.get("cache.hit"):
+        return "plan_cache"
+    return None
+
+
+def _outcome(answer: dict, error) -> str:
+    if error or answer is None:
+        return "error"
+    if str(answer["answer"]).startswith("CLARIFICATION_NEEDED"):
+        return "clarification"
+    if answer["sql"] is None:
+        return "no_sql"
+    if answer.get("result") and answer["result"]["total_rows"] == 0:
+        return "empty"
+    return "answered"
+
+
+def _chunks(spans: list) -> list:
+    chunks = {}
+    for span in spans:
+        if span.name == "retrieval" and span.attributes.get("retrieval.chunks"):
+            for chunk in json.loads(span.attributes["retrieval.chunks"]):
+                chunks.setdefault(chunk["id"], chunk)
+    return list(chunks.values())
+
+
+def entry(root, answer: dict = None, answer_chars: int = 1000) -> dict:
+    """
+    The log row for one question.
+
+    Args:
+        root: The finished root span of the question (`agent.ask`, `streamlit.ask`).
+        answer: What `SQLAgent.ask` returned; None when it raised.
+        answer_chars: Characters of the answer text kept.
+    """
+    spans = root.children
+    stages = {}
+    for span in spans:
+        stage = STAGES.get(span.name)
+        if stage is not None:
+            stages[stage] = round(stages.get(stage, 0.0) + span.duration_ms, 2)
+    calls = [span for span in spans if span.name == "llm.call"]
+    result = answer.get("result") if answer else None
+    chunks = _chunks(spans)
+    params = answer.get("params") if answer else None
+    return {
+        "trace_id": root.trace_id,
+        "asked_at": root.start_ns / 1e9,
+        "day": datetime.fromtimestamp(root.start_ns / 1e9).date().isoformat(),
+        "session_id": root.attributes.get("session.id"),
+        "question": root.attributes.get("question", ""),
+        "route": _route(spans),
+        "outcome": _outcome(answer, root.error),
+        "error": root.error,
+        "sql": answer and answer["sql"],
+        "params": json.dumps(params, default=str) if params else None,
+        "chunks": json.dumps(chunks) if chunks else None,
+        "llm_turns": len(calls),
+        "input_tokens": sum(s.attributes.get("llm.input_tokens") or 0 for s in calls) or None,
+        "output_tokens": sum(s.attributes.get("llm.output_tokens") or 0 for s in calls) or None,
+        "latency_ms": round(root.duration_ms, 2),
+        "stages": json.dumps(stages),
+        "rows": result["total_rows"] if result else None,
+        "result_digest": result_digest(result),
+        "answer": str(answer["answer"])[:answer_chars] if answer else None,
+        "replay_of": _replaying.get(),
+    }
+
+
+class QueryLog:
+    """
+    Append-only SQLite log with one row per question.
+
+    Args:
+        path: Database file; QUERY_LOG_DB (query_log.sqlite3) when omitted.
+        enabled: QUERY_LOG (on) when omitted; a disabled log records nothing.
+        answer_chars: Characters of each answer kept; QUERY_LOG_ANSWER_CHARS (1000).
+    """
+
+    def __init__(self, path: str = None, enabled: bool = None, answer_chars: int = None):
+        self.path = path or os.environ.get("QUERY_LOG_DB", "query_log.sqlite3")
+        self.enabled = enabled if enabled is not None else os.environ.get("QUERY_LOG", "on") != "off"
+        self.answer_chars = answer_chars or int(os.environ.get("QUERY_LOG_ANSWER_CHARS", 1000))
+        self.dropped = 0
+        self._pending = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queries ("
+            " id INTEGER PRIMARY KEY, trace_id TEXT NOT NULL, asked_at REAL NOT NULL, day TEXT NOT NULL,"
+            " session_id TEXT, question TEXT NOT NULL, route TEXT, outcome TEXT NOT NULL, error TEXT,"
+            " sql TEXT, params TEXT, chunks TEXT, llm_turns INTEGER NOT NULL, input_tokens INTEGER,"
+            " output_tokens INTEGER, latency_ms REAL NOT NULL, stages TEXT, rows INTEGER,"
+            " result_digest TEXT, answer TEXT, replay_of INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS queries_day ON queries (day, asked_at)")
+
+    def record(self, root, answer: dict = None):
+        """Queue the row for the question traced under `root`."""
+        if not self.enabled or root is None:
+            return
+        row = entry(root, answer, self.answer_chars)
+        with self._lock:
+            if not self.enabled:
+                return
+            self._pending.put(row)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="query-log", daemon=True)
+                self._writer.start()
+
+    def _write(self):
+        insert = f"INSERT INTO queries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        while True:
+            rows = [self._pending.get()]
+            # whatever queued up meanwhile goes in the same transaction
+            while not self._pending.empty():
+                rows.append(self._pending.get())
+            # None is `close` asking the writer to stop
+            batch = [row for row in rows if row is not None]
+            try:
+                if batch:
+                    with self._lock, self._conn:
+                        self._conn.execute("BEGIN")
+                        self._conn.executemany(insert, [tuple(row[c] for c in COLUMNS) for row in batch])
+            except sqlite3.Error:
+                # losing a log row must never fail a question
+                self.dropped += len(batch)
+            finally:
+                for _ in rows:
+                    self._pending.task_done()
+            if len(batch) < len(rows):
+                return
+
+    def flush(self):
+        """Wait until every queued row is written."""
+        self._pending.join()
+
+    def close(self):
+        """Write what is queued, stop the writer thread and close the database."""
+        with self._lock:
+            self.enabled = False
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._pending.put(None)
+            writer.join()
+        with self._lock:
+            self._conn.close()
+
+    def rows(self, day: str = None, since: float = None, replays: bool = False, limit: int = None) -> list:
+        """
+        Logged rows in the order they were asked.
+
+        Args:
+            day: Only this day (YYYY-MM-DD, local time).
+            since: Only rows asked at or after this Unix time.
+            replays: Return replayed rows instead of original ones.
+            limit: At most this many rows.
+        """
+        where = ["replay_of IS NOT NULL" if replays else "replay_of IS NULL"]
+        args = []
+        if day is not None:
+            where.append("day = ?")
+            args.append(day)
+        if since is not None:
+            where.append("asked_at >= ?")
+            args.append(since)
+        sql = f"SELECT id, {', '.join(COLUMNS)} FROM queries WHERE {' AND '.join(where)} ORDER BY asked_at"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            cursor = self._conn.execute(sql, args)
+            names = [c[0] for c in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def _percentile(values: list, p: float):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(rows: list) -> dict:
+    """Latency, stage times, LLM usage and counts by route and outcome."""
+    latencies = [row["latency_ms"] for row in rows]
+    stages = {}
+    for row in rows:
+        for stage, ms in json.loads(row["stages"] or "{}").items():
+            stages.setdefault(stage, []).append(ms)
+
+    def counts(key):
+        found = {}
+        for row in rows:
+            found[row[key]] = found.get(row[key], 0) + 1
+        return found
+
+    return {
+        "questions": len(rows),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "stage_mean_ms": {stage: round(statistics.fmean(ms), 2) for stage, ms in stages.items()},
+        "llm_turns": sum(row["llm_turns"] for row in rows),
+        "tokens": sum((row["input_tokens"] or 0) + (row["output_tokens"] or 0) for row in rows),
+        "routes": counts("route"),
+        "outcomes": counts("outcome"),
+    }
+
+
+def verdict(original: dict, replayed: dict) -> str:
+    """
+    How a replayed answer compares to the original:
+    - same_result: the same result digest
+    - different_result: both returned rows, but different ones
+    - same_outcome: neither ran a query, and both ended alike (e.g. both asked for clarification)
+    - changed: the outcome changed
+    - missing: the replay was rejected or never logged
+    """
+    if replayed is None:
+        return "missing"
+    if original["result_digest"] and replayed["result_digest"]:
+        same = original["result_digest"] == replayed["result_digest"]
+        return "same_result" if same else "different_result"
+    if original["outcome"] == replayed["outcome"] and not (original["result_digest"] or replayed["result_digest"]):
+        return "same_outcome"
+    return "changed"
+
+
+def compare(originals: list, replays: list) -> dict:
+    """The replay report: both runs summarized and each question's verdict."""
+    by_original = {row["replay_of"]: row for row in replays}
+    questions = []
+    for original in originals:
+        replayed = by_original.get(original["id"])
+        questions.append({
+            "id": original["id"],
+            "question": original["question"],
+            "verdict": verdict(original, replayed),
+            "original_ms": original["latency_ms"],
+            "replay_ms": replayed and replayed["latency_ms"],
+            "route": [original["route"], replayed and replayed["route"]],
+            "outcome": [original["outcome"], replayed and replayed["outcome"]],
+            "sql": [original["sql"], replayed and replayed["sql"]],
+        })
+    verdicts = {}
+    for question in questions:
+        verdicts[question["verdict"]] = verdicts.get(question["verdict"], 0) + 1
+    return {
+        "original": summarize(originals),
+        "replay": summarize(replays),
+        "verdicts": verdicts,
+        "questions": questions,
+    }
+
+
+def replay(agent, rows: list, speed: float = 1.0, concurrency: int = 8) -> dict:
+    """
+    Ask `rows` again through `agent.ask`.
+
+    Questions start at their original offsets from the first one, divided by
+    `speed` (0 starts each as soon as a worker is free). A session's
+    questions still run one after another, under a session id of their own.
+
+    Returns:
+        Counts of questions asked and rejected (limiter full).
+    """
+    run = uuid.uuid4().hex[:8]
+    done = {row["id"]: threading.Event() for row in rows}
+    previous, last_in_session = {}, {}
+    for row in rows:
+        if row["session_id"] is not None:
+            if row["session_id"] in last_in_session:
+                previous[row["id"]] = done[last_in_session[row["session_id"]]]
+            last_in_session[row["session_id"]] = row["id"]
+    first = rows[0]["asked_at"] if rows else 0.0
+    started = time.perf_counter()
+    rejected = []
+
+    def ask(row):
+        try:
+            if speed:
+                time.sleep(max(0.0, started + (row["asked_at"] - first) / speed - time.perf_counter()))
+            if row["id"] in previous:
+                previous[row["id"]].wait()
+            session_id = row["session_id"] and f"replay-{run}-{row['session_id']}"
+            token = _replaying.set(row["id"])
+            try:
+                agent.ask(row["question"], session_id)
+            except Busy:
+                # turned away before it was traced, so it is not in the log
+                rejected.append(row["id"])
+            except Exception:
+                # logged with the question
+                pass
+            finally:
+                _replaying.reset(token)
+        finally:
+            done[row["id"]].set()
+
+    # rows are queued in the order they are due, so a session's earlier
+    # question always holds a worker before the one waiting on it
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        list(pool.map(ask, rows))
+    return {"asked": len(rows), "rejected": len(rejected), "elapsed_s": time.perf_counter() - started}
+
+
+def _apply_overrides(pairs: list):
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        os.environ[key] = value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query log summaries and replay")
+    parser.add_argument("--log", default=os.environ.get("QUERY_LOG_DB", "query_log.sqlite3"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary = commands.add_parser("summary", help="summarize the logged questions")
+    summary.add_argument("--day", help="YYYY-MM-DD; every day when omitted")
+
+    rerun = commands.add_parser("replay", help="re-ask a day's questions and compare")
+    rerun.add_argument("--day", required=True, help="YYYY-MM-DD")
+    rerun.add_argument("--speed", type=float, default=1.0,
+                       help="how many times faster than the original spacing; 0 for back to back")
+    rerun.add_argument("--concurrency", type=int, default=8)
+    rerun.add_argument("--limit", type=int)
+    rerun.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                       help="environment override for the replayed agent (repeatable)")
+    rerun.add_argument("--database-url", help="database to run the SQL on")
+    rerun.add_argument("--replay-log", default="replay_log.sqlite3",
+                       help="where the replayed questions are logged")
+    rerun.add_argument("--out", default="replay_report.json")
+    args = parser.parse_args()
+
+    log = QueryLog(args.log, enabled=True)
+    if args.command == "summary":
+        print(json.dumps(summarize(log.rows(day=args.day)), indent=2))
+        return
+
+    rows = log.rows(day=args.day, limit=args.limit)
+    if not rows:
+        sys.exit(f"no questions logged on {args.day}")
+    _apply_overrides(args.set)
+
+    from agent_core import SQLAgent
+    from resources import Resources
+
+    resources = Resources()
+    if args.database_url:
+        from db import DataAccess
+        resources.get("db", lambda: DataAccess(args.database_url))
+    replay_log = resources.get("query_log", lambda: QueryLog(args.replay_log, enabled=True))
+    agent = SQLAgent(resources=resources)
+    agent.warm_up(background=False)
+
+    since = time.time()
+    print(f"replaying {len(rows)} questions from {args.day} at "
+          + (f"{args.speed:g}x" if args.speed else "full speed"))
+    run = replay(agent, rows, args.speed, args.concurrency)
+    replay_log.flush()
+
+    report = compare(rows, replay_log.rows(since=since, replays=True))
+    report["run"] = dict(run, speed=args.speed, overrides=args.set)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    for name in ("original", "replay"):
+        part = report[name]
+        print(f"{name:9} n={part['questions']:<5} p50={part['p50_ms'] or 0:8.1f}ms "
+              f"p95={part['p95_ms'] or 0:8.1f}ms llm_turns={part['llm_turns']} tokens={part['tokens']}")
+    print("answers: " + ", ".join(f"{k} {v}" for k, v in sorted(report["verdicts"].items())))
+    if run["rejected"]:
+        print(f"{run['rejected']} questions were rejected by the request limiter")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import hashlib
+import os
+import threading
+import warnings
+from glob import glob
+
+from dotenv import load_dotenv
+
+# environment keys whose value changes what the shared objects look like
+CONFIG_KEYS = ("DB_UNAME", "DB_PASS", "DB_HOST", "DB_PORT", "DB_NAME", "DATABASE_URL", "DB_REPLICAS",
+               "GROQ_API_KEY", "SCHEMA_INDEX_DIR", "EMBEDDING_BACKEND",
+               "RETRIEVER_MODE", "RETRIEVAL_TOKEN_BUDGET")
+
+# what a background warm-up builds: the embedding model (torch), the synced
+# vector store and the catalog snapshot
+WARM_UP = ("embeddings", "schema_index", "retriever", "catalog")
+
+# objects that hold threads or connections, and the method that releases
+# them when they are dropped; the rest are left to garbage collection
+SHUTDOWN = {
+    "rollups": "close",
+    "query_log": "close",
+    "pager": "close_all",
+    "db": "dispose",
+}
+
+
+class lazy_property:
+    """
+    `functools.cached_property` built under a per-instance lock.
+
+    Concurrent first accesses (a warm-up thread and the first request) share
+    one build instead of racing; assigning the attribute replaces the value.
+    With `depends`, names of shared objects in the instance's `resources`,
+    the value is rebuilt once any of them has been invalidated since it was
+    built (an assigned value is kept).
+    """
+
+    def __init__(self, build=None, depends=()):
+        self.depends = tuple(depends)
+        if build is not None:
+            self(build)
+
+    def __call__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+        return self
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+        instance.__dict__.setdefault("_lazy_keys", {}).pop(self.name, None)
+
+    def _key(self, instance):
+        return instance.resources.generations(*self.depends) if self.depends else None
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        values = instance.__dict__
+        keys = values.setdefault("_lazy_keys", {})
+        if self.name in values and (self.name not in keys or keys[self.name] == self._key(instance)):
+            return values[self.name]
+        with values.setdefault("_lazy_lock", threading.RLock()):
+            key = self._key(instance)
+            if self.name not in values or (self.name in keys and keys[self.name] != key):
+                values[self.name] = self.build(instance)
+                keys[self.name] = key
+            return values[self.name]
+
+
+def warm_up(build, name: str = "warm-up", background: bool = True):
+    """Run `build` now, or on a daemon thread so the caller can start serving."""
+    if not background:
+        build()
+        return None
+    thread = threading.Thread(target=build, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class Resources:
+    """
+    Process-wide, lazily built set of the heavy objects every front end needs.
+
+    Each object is built on first access and then handed to every caller in
+    the process (Streamlit reruns and sessions, Gradio workers, SQLAgent
+    instances). `refresh_if_changed` drops everything that depends on docs/
+    or configuration when either changed; the embedding model is loaded once
+    and kept.
+    """
+
+    def __init__(self, docs_glob: str = "docs/*.txt", env_file: str = ".env"):
+        self.docs_glob = docs_glob
+        self.env_file = env_file
+        self._lock = threading.RLock()
+        self._built = {}
+        # one lock per object, so loading the embedding model does not hold
+        # up a request that only needs the limiter or the engine
+        self._building = {}
+        self._generation = 0
+        # what each object was built from, and how often each was invalidated
+        self._depends = {}
+        self._generations = {}
+        load_dotenv(self.env_file)
+        self._fingerprint = self.fingerprint()
+
+    def fingerprint(self) -> str:
+        """Cheap digest of the docs files, the .env file and the config keys."""
+        digest = hashlib.sha256()
+        for path in sorted(glob(self.docs_glob)) + [self.env_file]:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+        for key in CONFIG_KEYS:
+            digest.update(f"{key}={os.environ.get(key, '')}\n".encode())
+        return digest.hexdigest()
+
+    def get(self, name: str, factory, depends=()):
+        """
+        Return the object cached under `name`, building it with `factory` once.
+
+        Args:
+            depends: Names of the shared objects `factory` uses; invalidating
+                any of them drops this one too.
+        """
+        with self._lock:
+            if depends:
+                self._depends[name] = set(depends)
+            if name in self._built:
+                return self._built[name]
+            building = self._building.setdefault(name, threading.RLock())
+        with building:
+            with self._lock:
+                if name in self._built:
+                    return self._built[name]
+                generation = (self._generation, self._generations.get(name, 0))
+            value = factory()
+            with self._lock:
+                # an invalidate() while building means the value is already stale
+                if generation == (self._generation, self._generations.get(name, 0)):
+                    self._built[name] = value
+            return value
+
+    def generations(self, *names) -> tuple:
+        """How often each of `names` has been invalidated; changes whenever one
+        of them (or anything it depends on) is dropped."""
+        with self._lock:
+            return (self._generation,) + tuple(self._generations.get(name, 0) for name in names)
+
+    def _dependents(self, names) -> set:
+        """`names` and everything built from them, directly or not."""
+        dropped = set(names)
+        grew = True
+        while grew:
+            grew = False
+            for name, depends in self._depends.items():
+                if name not in dropped and depends & dropped:
+                    dropped.add(name)
+                    grew = True
+        return dropped
+
+    def invalidate(self, *names, keep_embeddings: bool = True):
+        """
+        Drop cached objects so they are rebuilt on next access. Objects built
+        from a dropped one are dropped with it (invalidating `db` drops the
+        engines, the pager, the result cache, the rollups and the catalog).
+        Threads and connections they hold (rollup refresher, query-log writer,
+        open result cursors, database pools) are shut down.
+
+        Args:
+            names: Objects to drop; everything when empty.
+            keep_embeddings: Keep the loaded embedding model when dropping everything.
+        """
+        with self._lock:
+            if names:
+                names = self._dependents(names)
+                for name in names:
+                    self._generations[name] = self._generations.get(name, 0) + 1
+                dropped = {name: self._built.pop(name) for name in names if name in self._built}
+            else:
+                self._generation += 1
+                kept = {}
+                embeddings = self._built.get("embeddings")
+                if keep_embeddings and embeddings is not None and \
+                        getattr(embeddings, "requested", None) == os.environ.get("EMBEDDING_BACKEND", "torch"):
+                    kept["embeddings"] = embeddings
+                dropped = {name: value for name, value in self._built.items() if name not in kept}
+                self._built = kept
+        # outside the lock: stopping a thread can wait on a refresh in progress
+        for name, value in dropped.items():
+            if name in SHUTDOWN:
+                try:
+                    getattr(value, SHUTDOWN[name])()
+                except Exception as e:
+                    warnings.warn(f"Could not shut down {name}: {e}")
+
+    def refresh_if_changed(self) -> bool:
+        """Invalidate dependent objects if docs/ or configuration changed."""
+        with self._lock:
+            load_dotenv(self.env_file, override=True)
+            current = self.fingerprint()
+            if current == self._fingerprint:
+                return False
+            self._fingerprint = current
+        self.invalidate()
+        return True
+
+    @property
+    def embeddings(self):
+        def build():
+            from embeddings import build_embeddings
+            return build_embeddings()
+        return self.get("embeddings", build)
+
+    @property
+    def schema_index(self):
+        def build():
+            from vector_index import SchemaIndex
+            index = SchemaIndex(self.embeddings, docs_glob=self.docs_glob)
+            index.sync()
+            return index
+        return self.get("schema_index", build, depends=("embeddings",))
+
+    @property
+    def retriever(self):
+        def build():
+            if os.environ.get("RETRIEVER_MODE", "hybrid") == "vector":
+                return self.schema_index.as_retriever(k=4)
+            from hybrid_retriever import HybridRetriever
+            return HybridRetriever(self.schema_index)
+        return self.get("retriever", build, depends=("schema_index",))
+
+    @property
+    def db(self):
+        def build():
+            from db import DataAccess
+            return DataAccess()
+        return self.get("db", build)
+
+    @property
+    def engine(self):
+        """Pooled engine for the agent's reads, on the replicas when configured."""
+        return self.get("engine", lambda: self.db.reader, depends=("db",))
+
+    @property
+    def primary_engine(self):
+        """Pooled engine on the primary, for the few writes."""
+        return self.get("primary_engine", lambda: self.db.primary, depends=("db",))
+
+    @property
+    def async_engine(self):
+        return self.get("async_engine", lambda: self.db.async_reader, depends=("db",))
+
+    @property
+    def limiter(self):
+        def build():
+            from concurrency import RequestLimiter
+            return RequestLimiter()
+        return self.get("limiter", build)
+
+    @property
+    def result_cache(self):
+        def build():
+            from result_cache import ResultCache
+            # a replica's statistics counters do not follow replayed writes;
+            # max(updated_at) does
+            probe = None if not os.environ.get("DB_REPLICAS") else os.environ.get(
+                "RESULT_CACHE_PROBE", "updated_at"
+            )
+            return ResultCache(self.engine, probe=probe)
+        return self.get("result_cache", build, depends=("engine",))
+
+    @property
+    def guard(self):
+        def build():
+            from sql_guard import SQLGuard
+            return SQLGuard()
+        return self.get("guard", build)
+
+    @property
+    def pager(self):
+        def build():
+            from result_stream import ResultPager
+            return ResultPager(self.engine, guard=self.guard)
+        return self.get("pager", build, depends=("engine", "guard"))
+
+    @property
+    def rollups(self):
+        def build():
+            from rollups import Rollups
+            rollups = Rollups(self.engine, self.result_cache.watermarks, primary=self.primary_engine)
+            rollups.start()
+            return rollups
+        return self.get("rollups", build, depends=("engine", "primary_engine", "result_cache"))
+
+    @property
+    def sessions(self):
+        def build():
+            from sessions import SessionStore
+            return SessionStore()
+        return self.get("sessions", build)
+
+    @property
+    def query_log(self):
+        def build():
+            from query_log import QueryLog
+            return QueryLog()
+        return self.get("query_log", build)
+
+    @property
+    def catalog(self):
+        def build():
+            from schema_catalog import SchemaCatalog
+            return SchemaCatalog(self.engine)
+        return self.get("catalog", build, depends=("engine",))
+
+    def warm_up(self, names=WARM_UP, background: bool = True):
+        """
+        Build the named shared objects ahead of the first request.
+
+        Args:
+            names: Properties of this object to build, in order.
+            background: Build on a daemon thread and return it instead of blocking.
+        """
+        def build():
+            for name in names:
+                value = getattr(self, name)
+                if name == "catalog":
+                    value.refresh()
+        return warm_up(build, "resources-warm-up", background)
+
+    def llm(self, model: str):
+        def build():
+            from langchain_groq import ChatGroq
+            return ChatGroq(
+                model=model, temperature=0, api_key=os.environ.get("GROQ_API_KEY")
+            )
+        return self.get(f"llm:{model}", build)
+
+
+_resources = None
+_resources_lock = threading.Lock()
+
+
+def get_resources() -> Resources:
+    """Return the shared `Resources` of this process."""
+    global _resources
+    with _resources_lock:
+        if _resources is None:
+            _resources = Resources()
+        return _resources
@@ -0,0 +1,272 @@
+import asyncio
+import functools
+import os
+import re
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+
+# tables of trad_db/Table_Creation.sql; all carry updated_at and deleted_at
+TABLES = ("branches", "customers", "accounts", "loans", "repayments")
+
+_VOLATILE_RE = re.compile(r"\b(?:random|nextval|setval|clock_timestamp|gen_random_uuid)\s*\(", re.IGNORECASE)
+_STRING_RE = re.compile(r"('(?:[^']|'')*')")
+
+# one round trip for every table an entry depends on. The stats counters live
+# in shared memory and cost nothing to read, but may lag a commit by up to a
+# second and do not follow replayed writes on a replica; max(updated_at) does
+# (inserts default it to now(), the set_updated_at trigger bumps it on every
+# update, soft deletes included) and, with the updated_at indexes of
+# Table_Creation.sql, reads one index entry per table. It is not exact:
+# now() is the writing transaction's start time, so a transaction that began
+# before a probe and commits after it can add rows below the max already
+# seen, and hard deletes do not move it. Such a change goes unnoticed until
+# the entry's ttl runs out, which bounds how stale a result can be.
+_PROBES = {
+    "stats": """
+        SELECT relname, n_tup_ins, n_tup_upd, n_tup_del
+        FROM pg_stat_user_tables
+        WHERE schemaname = ANY (current_schemas(false)) AND relname IN :tables
+    """,
+    "updated_at": "SELECT '{table}', (SELECT max(updated_at) FROM {table})",
+}
+
+# tables with an index leading on updated_at; without one max(updated_at)
+# scans the table, so their results are not cached
+_INDEXED_QUERY = """
+    SELECT DISTINCT t.relname
+    FROM pg_index i
+    JOIN pg_class t ON t.oid = i.indrelid
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+    WHERE a.attname = 'updated_at' AND t.relname IN :tables
+      AND t.relnamespace = ANY (
+          SELECT oid FROM pg_namespace WHERE nspname = ANY (current_schemas(false)))
+"""
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and case outside string literals, drop a trailing ';'."""
+    parts = _STRING_RE.split(sql.strip().rstrip(";").strip())
+    return "".join(
+        part if part.startswith("'") else " ".join(part.lower().split())
+        for part in parts
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def tables_in(sql: str, known=TABLES) -> frozenset:
+    """The `known` tables `sql` reads anywhere: FROM lists, joins, subqueries,
+    CTEs. Empty when it does not parse, so the query is not cached."""
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except sqlglot.errors.ParseError:
+        return frozenset()
+    if tree is None:
+        return frozenset()
+    return frozenset(
+        table.name.lower() for table in tree.find_all(exp.Table) if table.name.lower() in known
+    )
+
+
+class ResultCache:
+    """
+    Cache of SQL results that stays valid until a table it reads changes.
+
+    Entries are keyed by the normalized SQL text (plus bind parameters) and
+    remember the per-table watermark seen just before the query ran. A lookup
+    re-reads the watermarks of the entry's tables with a single cheap probe,
+    at most once per `probe_interval` seconds, and serves the rows only when
+    none moved. Entries also expire after `ttl` seconds (results over
+    CURRENT_DATE change at midnight, and a change the probe misses is served
+    for at most that long) and are LRU-evicted beyond `max_entries` or
+    `max_bytes`.
+    """
+
+    def __init__(self, engine, max_entries: int = None, max_bytes: int = None,
+                 ttl: float = None, probe_interval: float = None, probe: str = None):
+        self.engine = engine
+        self.max_entries = max_entries or int(os.environ.get("RESULT_CACHE_SIZE", 512))
+        self.max_bytes = max_bytes or int(os.environ.get("RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+        self.ttl = ttl or float(os.environ.get("RESULT_CACHE_TTL", 300))
+        self.probe_interval = probe_interval if probe_interval is not None else float(
+            os.environ.get("RESULT_CACHE_PROBE_INTERVAL", 1.0)
+        )
+        self.probe = probe or os.environ.get("RESULT_CACHE_PROBE", "stats")
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._marks = {}
+        self._marks_at = {}
+        self._indexed = None
+        self.hits = 0
+        self.misses = 0
+
+    def _probeable(self, tables) -> bool:
+        """Whether the watermarks of `tables` can be read without a table scan."""
+        if self.probe != "updated_at":
+            return True
+        with self._lock:
+            indexed = self._indexed
+        if indexed is None:
+            with self.engine.connect() as conn:
+                rows = conn.execute(text(_INDEXED_QUERY), {"tables": tuple(TABLES)}).fetchall()
+            indexed = frozenset(row[0] for row in rows)
+            missing = sorted(set(TABLES) - indexed)
+            if missing:
+                warnings.warn(
+                    f"No index on updated_at for {', '.join(missing)}; results reading them are "
+                    "not cached (see trad_db/Table_Creation.sql)"
+                )
+            with self._lock:
+                self._indexed = indexed
+        return tables <= indexed
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _probe(self, tables) -> dict:
+        if self.probe == "updated_at":
+            query = " UNION ALL ".join(
+                _PROBES["updated_at"].format(table=table) for table in sorted(tables)
+            )
+            params = {}
+        else:
+            query = _PROBES["stats"]
+            params = {"tables": tuple(sorted(tables))}
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(query), params).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def watermarks(self, tables) -> dict:
+        """Current watermark of each table, re-probed at most every `probe_interval`."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [t for t in tables if now - self._marks_at.get(t, float("-inf")) > self.probe_interval]
+        if stale:
+            fresh = self._probe(stale)
+            with self._lock:
+                for table in stale:
+                    self._marks[table] = fresh.get(table)
+                    self._marks_at[table] = now
+        with self._lock:
+            return {table: self._marks.get(table) for table in tables}
+
+    @staticmethod
+    def _key(sql: str, params) -> tuple:
+        return normalize_sql(sql), tuple(sorted((params or {}).items()))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+    def get(self, sql: str, params: dict = None):
+        """Return cached rows for `sql` if still valid, otherwise None."""
+        key = self._key(sql, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry["created"] > self.ttl:
+                self._drop(key)
+                entry = None
+        if entry is None:
+            return None
+        if self.watermarks(entry["tables"]) != entry["marks"]:
+            with self._lock:
+                if key in self._entries:
+                    self._drop(key)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry["rows"]
+
+    def put(self, sql: str, params: dict, rows, marks: dict):
+        size = len(repr(rows))
+        if size > self.max_bytes // 8:
+            return
+        key = self._key(sql, params)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {
+                "rows": rows,
+                "tables": frozenset(marks),
+                "marks": marks,
+                "created": time.monotonic(),
+                "size": size,
+            }
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        """Drop every entry and remembered watermark and reset the hit counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._marks.clear()
+            self._marks_at.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def fetch(self, sql: str, execute, params: dict = None):
+        """
+        Serve `sql` from the cache, or run it with `execute()` and cache the rows.
+
+        Args:
+            sql: The query text.
+            execute: Callable running the query and returning its rows.
+            params: Bind parameters of the query, part of the cache key.
+
+        Returns:
+            The query's rows.
+        """
+        tables = tables_in(sql)
+        if not tables or _VOLATILE_RE.search(sql) or not self._probeable(tables):
+            return execute()
+        rows = self.get(sql, params)
+        self._count(rows is not None)
+        if rows is not None:
+            return rows
+        # read the watermarks before running, so a write racing the query
+        # invalidates the entry instead of hiding behind it
+        marks = self.watermarks(tables)
+        rows = execute()
+        self.put(sql, params, rows, marks)
+        return rows
+
+    async def afetch(self, sql: str, execute, params: dict = None):
+        """Async `fetch`: `execute` is a coroutine function, watermark probes run
+        on a worker thread so they never block the event loop."""
+        tables = tables_in(sql)
+        if not tables or _VOLATILE_RE.search(sql) or not await asyncio.to_thread(self._probeable, tables):
+            return await execute()
+        rows = await asyncio.to_thread(self.get, sql, params)
+        self._count(rows is not None)
+        if rows is not None:
+            return rows
+        marks = await asyncio.to_thread(self.watermarks, tables)
+        rows = await execute()
+        self.put(sql, params, rows, marks)
+        return rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+# pool connections kept free of paging cursors for the queries that do not page
+RESERVED_CONNECTIONS = 2
+
+
+def pool_capacity(engine):
+    """Most connections `engine`'s pool hands out at once; None when unbounded or unknown."""
+    pool = getattr(engine, "pool", None)
+    try:
+        size, overflow = pool.size(), pool._max_overflow
+    except AttributeError:
+        return None
+    return None if overflow < 0 else size + overflow
+
+
+def preview_text(result: dict, limit: int = None) -> str:
+    """Compact description of a query result for the LLM: size, columns, first rows."""
+    limit = limit or int(os.environ.get("RESULT_PREVIEW_ROWS", 20))
+    total = result["total_rows"]
+    size = f"{total}" if result["total_is_exact"] else f"more than {total - 1}"
+    lines = [f"total_rows: {size}", f"columns: {', '.join(result['columns'])}"]
+    rows = result["rows"][:limit]
+    if rows:
+        lines.append(f"first {len(rows)} rows:")
+        lines.extend(str(tuple(row.values())) for row in rows)
+    if result.get("truncated"):
+        lines.append("(page truncated by the byte cap)")
+    return "\n".join(lines)
+
+
+async def stream_first_page(async_engine, sql: str, params: dict = None, page_size: int = None,
+                            max_rows: int = None, max_page_bytes: int = None, guard=None) -> dict:
+    """
+    Async counterpart of `ResultPager.open` on an async engine.
+
+    Rows are streamed from a server-side cursor; the first page is kept and
+    the rest are only counted, up to `max_rows`. No cursor stays open, so
+    the result has no `cursor_id`. With a `guard` (sql_guard.SQLGuard) the
+    query runs read-only under its statement timeout and cost budget.
+    """
+    page_size = page_size or int(os.environ.get("RESULT_PAGE_SIZE", 100))
+    max_rows = max_rows or int(os.environ.get("RESULT_MAX_ROWS", 100000))
+    max_page_bytes = max_page_bytes or int(os.environ.get("RESULT_MAX_PAGE_BYTES", 1024 * 1024))
+    rows, size, counted, truncated = [], 0, 0, False
+    async with async_engine.connect() as conn:
+        if guard is not None:
+            await guard.aenter(conn, sql, params)
+        result = await conn.stream(text(sql.strip().rstrip(";")), params or {})
+        columns = list(result.keys())
+        async for row in result.mappings():
+            counted += 1
+            if counted > max_rows:
+                break
+            if len(rows) < page_size and not truncated:
+                row = dict(row)
+                size += len(repr(row))
+                if rows and size > max_page_bytes:
+                    truncated = True
+                else:
+                    rows.append(row)
+    return {
+        "columns": columns,
+        "rows": rows,
+        "total_rows": counted,
+        "total_is_exact": counted <= max_rows,
+        "truncated": truncated,
+        "cursor_id": None,
+    }
+
+
+class ResultPager:
+    """
+    Runs queries through named server-side cursors and pages through them.
+
+    `open` declares a SCROLL cursor, counts the result with MOVE (no rows
+    leave the server) up to `max_rows`, and fetches only the first page.
+    When more rows exist and the caller asks for paging (`keep_open`), the
+    cursor is kept open under an id so a UI can ask for any later page with
+    `fetch` without re-running the query; otherwise it is closed with its
+    transaction as soon as the first page is read. Every page
+    is capped at `page_size` rows and `max_page_bytes`; open cursors are
+    bounded by `max_open` and closed after `idle_timeout` seconds unused.
+    Each open cursor holds a pooled connection, so `max_open` stays
+    RESERVED_CONNECTIONS below the pool's capacity, and the oldest idle
+    cursor is closed when the pool is exhausted as a query is opened.
+    With a `guard` (sql_guard.SQLGuard) every cursor lives in a read-only
+    transaction with a statement timeout, opened only if the query's plan
+    fits the guard's budget.
+    """
+
+    def __init__(self, engine, page_size: int = None, max_rows: int = None,
+                 max_page_bytes: int = None, idle_timeout: float = None, max_open: int = None,
+                 guard=None):
+        self.engine = engine
+        self.guard = guard
+        self.page_size = page_size or int(os.environ.get("RESULT_PAGE_SIZE", 100))
+        self.max_rows = max_rows or int(os.environ.get("RESULT_MAX_ROWS", 100000))
+        self.max_page_bytes = max_page_bytes or int(os.environ.get("RESULT_MAX_PAGE_BYTES", 1024 * 1024))
+        self.idle_timeout = idle_timeout or float(os.environ.get("RESULT_CURSOR_IDLE_TIMEOUT", 120))
+        capacity = pool_capacity(engine)
+        self.max_open = max_open or int(os.environ.get(
+            "RESULT_MAX_OPEN_CURSORS", capacity - RESERVED_CONNECTIONS if capacity else 16
+        ))
+        if capacity:
+            self.max_open = max(1, min(self.max_open, capacity - RESERVED_CONNECTIONS))
+        self._lock = threading.Lock()
+        self._cursors = OrderedDict()
+
+    def _read_page(self, conn, name: str):
+        result = conn.execute(text(f"FETCH FORWARD {self.page_size} FROM {name}"))
+        columns = list(result.keys())
+        rows, size, truncated = [], 0, False
+        for row in result.mappings():
+            row = dict(row)
+            size += len(repr(row))
+            if rows and size > self.max_page_bytes:
+                truncated = True
+                break
+            rows.append(row)
+        return columns, rows, truncated
+
+    def open(self, sql: str, params: dict = None, keep_open: bool = False) -> dict:
+        """
+        Run `sql` and return its first page.
+
+        Args:
+            sql: The query text.
+            params: Bind parameters of the query.
+            keep_open: Keep the cursor for `fetch` when more rows exist. An
+                open cursor pins a pooled connection, idle in transaction,
+                until it is closed or `idle_timeout` runs out.
+
+        Returns:
+            A dict with `columns`, `rows` (first page), `total_rows`,
+            `total_is_exact`, `truncated` and `cursor_id` (None unless
+            `keep_open` and the first page does not hold the whole result).
+        """
+        self.reap()
+        self._make_room()
+        name = f"agent_cursor_{uuid.uuid4().hex}"
+        conn = self.engine.connect()
+        try:
+            conn.begin()
+            if self.guard is not None:
+                self.guard.enter(conn, sql, params)
+            conn.execute(
+                text(f"DECLARE {name} SCROLL CURSOR FOR {sql.strip().rstrip(';')}"), params or {}
+            )
+            counted = conn.execute(text(f"MOVE FORWARD {self.max_rows + 1} IN {name}")).rowcount
+            conn.execute(text(f"MOVE ABSOLUTE 0 IN {name}"))
+            columns, rows, truncated = self._read_page(conn, name)
+        except Exception:
+            conn.close()
+            raise
+
+        result = {
+            "columns": columns,
+            "rows": rows,
+            "total_rows": min(counted, self.max_rows + 1),
+            "total_is_exact": counted <= self.max_rows,
+            "truncated": truncated,
+            "cursor_id": None,
+        }
+        if not keep_open or counted <= len(rows):
+            conn.close()
+            return result
+
+        cursor_id = uuid.uuid4().hex
+        with self._lock:
+            self._cursors[cursor_id] = {
+                "conn": conn,
+                "name": name,
+                "lock": threading.Lock(),
+                "used": time.monotonic(),
+                "total_rows": min(counted, self.max_rows),
+            }
+            evicted = []
+            while len(self._cursors) > self.max_open:
+                # a cursor whose lock is held is serving a page right now;
+                # when every other one is, the new cursor is the idle one
+                idle = next(cid for cid, c in self._cursors.items() if not c["lock"].locked())
+                evicted.append(self._cursors.pop(idle))
+            kept = cursor_id in self._cursors
+        for cursor in evicted:
+            cursor["conn"].close()
+        result["cursor_id"] = cursor_id if kept else None
+        return result
+
+    def fetch(self, cursor_id: str, page: int) -> dict:
+        """
+        Fetch page number `page` (0-based) of an open cursor.
+
+        Raises:
+            KeyError: The cursor is unknown, expired or was evicted.
+        """
+        self.reap()
+        with self._lock:
+            cursor = self._cursors[cursor_id]
+            self._cursors.move_to_end(cursor_id)
+            cursor["used"] = time.monotonic()
+        start = page * self.page_size
+        if page < 0 or start >= cursor["total_rows"]:
+            return {"page": page, "rows": [], "has_more": False, "truncated": False}
+        with cursor["lock"]:
+            conn, name = cursor["conn"], cursor["name"]
+            conn.execute(text(f"MOVE ABSOLUTE {start} IN {name}"))
+            _, rows, truncated = self._read_page(conn, name)
+        rows = rows[: max(cursor["total_rows"] - start, 0)]
+        return {
+            "page": page,
+            "rows": rows,
+            "has_more": start + len(rows) < cursor["total_rows"],
+            "truncated": truncated,
+        }
+
+    def close(self, cursor_id: str):
+        with self._lock:
+            cursor = self._cursors.pop(cursor_id, None)
+        if cursor is not None:
+            cursor["conn"].close()
+
+    def close_all(self):
+        """Close every open cursor and return its connection to the pool."""
+        with self._lock:
+            cursors, self._cursors = list(self._cursors.values()), OrderedDict()
+        for cursor in cursors:
+            cursor["conn"].close()
+
+    def _make_room(self):
+        """Close the least recently used idle cursor when every pooled
+        connection is checked out, rather than wait for the pool timeout."""
+        capacity = pool_capacity(self.engine)
+        if capacity is None or self.engine.pool.checkedout() < capacity:
+            return
+        with self._lock:
+            # a cursor whose lock is held is serving a page right now
+            idle = next((cid for cid, c in self._cursors.items() if not c["lock"].locked()), None)
+            cursor = self._cursors.pop(idle) if idle is not None else None
+        if cursor is not None:
+            cursor["conn"].close()
+
+    def reap(self):
+        """Close cursors idle for longer than `idle_timeout`."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [cid for cid, c in self._cursors.items() if now - c["used"] > self.idle_timeout]
+            cursors = [self._cursors.pop(cid) for cid in expired]
+        for cursor in cursors:
+            cursor["conn"].close()
@@ -7,69 +7,41 @@ GROQ_API=os.environ.get("GROQ_API_KEY")
 DB_UNAME=os.environ.get("DB_UNAME")
 DB_PASS=os.environ.get("DB_PASS")
 
-from langchain_text_splitters import CharacterTextSplitter
-from glob import glob
-
-text_splitter = CharacterTextSplitter(
-    separator="###",
-    chunk_size=1000,
-    chunk_overlap=200,
-    length_function=len,
-    is_separator_regex=False,
-)
+from embeddings import build_embeddings
+from vector_index import SchemaIndex
+from hybrid_retriever import HybridRetriever
 
-texts = []
-for file_path in glob("docs/*.txt"): # loading all text files in docs folder
-    with open(file_path, "r") as f:
-        doc = f.read()
-    
-    file_chunks = text_splitter.create_documents(
-        [doc], 
-        metadatas=[{"source": file_path}]
-    )
-    texts.extend(file_chunks)
+# CPU backend from EMBEDDING_BACKEND (torch, onnx or onnx-int8), with batched
+# indexing and a cache of recent query embeddings
+embeddings = build_embeddings()
 
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+# persistent index: only new or edited chunks of docs/*.txt get embedded
+schema_store = SchemaIndex(embeddings, docs_glob="docs/*.txt")
+schema_store.sync()
 
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
-)
-
-schema_store = Chroma.from_documents(
-    texts,
-    embedding=embeddings,
-    collection_name="schema_rag"
-)
-
-schema_retriever = schema_store.as_retriever(k=4)
+# BM25 + vector search fused and reranked, within RETRIEVAL_TOKEN_BUDGET
+schema_retriever = HybridRetriever(schema_store)
 
 schema_retriever.invoke("currency")
 
 from langchain_core.tools import tool
-from sqlalchemy import create_engine, text
-from typing import List, Tuple
+from db import DataAccess
+from schema_catalog import SchemaCatalog, catalog_tools
+from result_stream import ResultPager, preview_text
+from sql_guard import SQLGuard, GuardError
 
-username = DB_UNAME
-password = DB_PASS
-db_ip = "localhost"
-db_port = "5432"
-database = "postgres"
-engine = create_engine(f"postgresql+psycopg2://{username}:{password}@{db_ip}:{db_port}/{database}")
+# pooled, read-only sessions, on the read replicas when DB_REPLICAS is set
+engine = DataAccess().reader
 
 
-def validate_sql(query: str):
-    q = query.lower().strip()
+# parses the query instead of matching keywords: one read-only SELECT only,
+# deleted_at IS NULL added per table, LIMIT clamped, cost checked by EXPLAIN
+guard = SQLGuard()
 
-    if not q.startswith("select"):
-        raise ValueError("Only SELECT queries are allowed")
 
-    forbidden = ["insert", "update", "delete", "drop", "alter", ";"]
-    # pass_kw = ['deleted_at'] # all queries will have deleted_at 
-    
-    for kw in forbidden:
-        if kw in q:
-            raise ValueError(f"Forbidden SQL keyword detected: {kw}")
+def validate_sql(query: str) -> str:
+    """Return the guarded version of `query`; raises GuardError (a ValueError)."""
+    return guard.rewrite(query)
 
 @tool
 def query_vecdb(question: str) -> str:
@@ -81,6 +53,11 @@ def query_vecdb(question: str) -> str:
     return "\n\n".join(d.page_content for d in docs)
 
 
+# server-side cursor: counts the full result, ships only the first page,
+# inside a read-only transaction with a statement timeout
+pager = ResultPager(engine, guard=guard)
+
+
 @tool
 def run_sql_query(query: str) -> str:
     """Execute a validated read-only SQL query."""
@@ -88,28 +65,18 @@ def run_sql_query(query: str) -> str:
     print("\n--- SQL GENERATED ---")
     print(query)
 
-    # validate_sql(query) # need to solve deleted_at getting caught in forbidden words list
+    try:
+        query = validate_sql(query)
+    except GuardError as e:
+        return f"Query rejected: {e}"
 
-    with engine.connect() as conn:
-        result = conn.execute(text(query))
-        rows = result.fetchmany(5)
-        return str(rows)
+    return preview_text(pager.open(query))
 
 
-@tool
-def get_table_schema(table_name: str) -> List[Tuple]:
-    """Return column schema information for a table.
-    Argument: table_name, example - customers
-    """
-    query = """
-        SELECT column_name, data_type, is_nullable
-        FROM information_schema.columns
-        WHERE table_name = :table_name
-        ORDER BY ordinal_position
-    """
-    with engine.connect() as conn:
-        result = conn.execute(text(query), {"table_name": table_name})
-        return result.fetchall()
+# tables, columns, enum values and FK join paths come from one bulk
+# pg_catalog introspection kept in memory until the DDL changes
+catalog = SchemaCatalog(engine)
+list_table, get_table_schema, get_join_path = catalog_tools(catalog)
 
 # need more time and work to implement this
 # @tool
@@ -118,19 +85,6 @@ def get_table_schema(table_name: str) -> List[Tuple]:
 #     return f"Clarification needed: {reason}"
 
 
-@tool
-def list_table():
-    """Return names of table present in the database."""
-    query = """
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema='public';
-    """
-    with engine.connect() as conn:
-        result = conn.execute(text(query))
-        return str(result.fetchall())
-
-
 # @tool
 # def verify_column(table: str, column: str) -> bool:
 #     """Verify a column exists in a given table."""
@@ -188,6 +142,7 @@ agent = create_agent(
         query_vecdb,
         get_table_schema,
         list_table,
+        get_join_path,
         run_sql_query,
         # request_clarification,
         # verify_column
@@ -195,9 +150,15 @@ agent = create_agent(
     system_prompt=SYSTEM_PROMPT,
 )
 
+from streaming import agent_events
+
 def streamer_agent(question):
-    for step in agent.stream(
-        {"messages": [{"role": "user", "content": question}]},
-        stream_mode="values",
-    ):
-        yield step["messages"][-1].pretty_print()
\ No newline at end of file
+    """Yield the run as text while it happens: tool calls and results, then
+    the answer token by token (e.g. for st.write_stream)."""
+    for kind, payload in agent_events(agent, [{"role": "user", "content": question}]):
+        if kind == "token":
+            yield payload
+        elif kind == "tool_call":
+            yield f"\n\n[{payload['name']} {payload['args']}]\n\n"
+        elif kind == "tool_result":
+            yield f"[{payload.name} returned {len(str(payload.content))} characters]\n\n"
\ No newline at end of file
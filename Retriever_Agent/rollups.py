@@ -0,0 +1,498 @@
+"""
+Materialized rollups of the fact tables and the query rewrite onto them.
+
+Branch dashboards (total deposits per branch, active and closed loans per
+branch, the loan book over a date range) aggregate every row of accounts or
+loans. Each rollup here is a materialized view of one fact table grouped by
+a few of its columns, with the row count and the SUM/COUNT/MIN/MAX of its
+measures, a few hundred rows however large the table grows.
+
+`Rollups.rewrite` answers an aggregate query from a rollup when it can do so
+exactly: the query is a single SELECT over the fact table, every other table
+is joined to it many-to-one (on its primary key), and the fact table's
+columns are only used as rollup dimensions or inside SUM/COUNT/AVG/MIN/MAX.
+The fact table is then swapped for the rollup and the aggregates for their
+re-aggregation; joined tables, filters, grouping, ordering and LIMIT stay as
+written. A rollup is only used while the watermark of its fact table (see
+result_cache.py) is the one it was refreshed at, so it is exactly as fresh
+as a cached result; a background thread refreshes rollups whose table moved.
+
+    python rollups.py create     # create the views (needs CREATE privilege)
+    python rollups.py refresh    # refresh stale views, e.g. from cron
+    python rollups.py status
+    python rollups.py drop
+"""
+import argparse
+import json
+import os
+import threading
+import warnings
+import weakref
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+
+from sql_guard import render
+
+# primary key of every trad_db table: joins on it are many-to-one
+PRIMARY_KEYS = {
+    "branches": "branch_id",
+    "customers": "customer_id",
+    "accounts": "account_id",
+    "loans": "loan_id",
+    "repayments": "repayment_id",
+}
+
+# coarsest first: the first rollup that can answer a query is used
+ROLLUPS = [
+    {
+        "name": "rollup_accounts_by_branch",
+        "fact": "accounts",
+        "dims": ("branch_id", "account_type"),
+        "measures": ("balance",),
+    },
+    {
+        "name": "rollup_loans_by_branch",
+        "fact": "loans",
+        "dims": ("branch_id", "loan_type", "status"),
+        "measures": ("principal", "interest_rate", "tenure_months"),
+    },
+    {
+        "name": "rollup_loans_by_day",
+        "fact": "loans",
+        "dims": ("branch_id", "status", "disbursed_at"),
+        "measures": ("principal",),
+    },
+]
+
+_STATE_QUERY = """
+SELECT c.relname, obj_description(c.oid, 'pg_class')
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'm' AND n.nspname = ANY (current_schemas(false)) AND c.relname IN :names
+"""
+
+
+class _NoMatch(Exception):
+    pass
+
+
+def definition_sql(rollup: dict) -> str:
+    """The SELECT a rollup materializes."""
+    dims = ", ".join(rollup["dims"])
+    measures = ["COUNT(*) AS row_count"]
+    for m in rollup["measures"]:
+        measures += [f"SUM({m}) AS sum_{m}", f"COUNT({m}) AS count_{m}",
+                     f"MIN({m}) AS min_{m}", f"MAX({m}) AS max_{m}"]
+    return (
+        f"SELECT {dims}, {', '.join(measures)}\n"
+        f"FROM {rollup['fact']}\n"
+        f"WHERE deleted_at IS NULL\n"
+        f"GROUP BY {dims}"
+    )
+
+
+def ddl(rollup: dict) -> list:
+    return [
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup['name']} AS\n{definition_sql(rollup)}\nWITH DATA",
+        # REFRESH ... CONCURRENTLY needs a unique index over plain columns
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {rollup['name']}_key ON {rollup['name']} "
+        f"({', '.join(rollup['dims'])})",
+    ]
+
+
+def _conjuncts(condition) -> list:
+    if condition is None:
+        return []
+    if isinstance(condition, exp.And):
+        return _conjuncts(condition.left) + _conjuncts(condition.right)
+    if isinstance(condition, exp.Paren):
+        return _conjuncts(condition.this)
+    return [condition]
+
+
+def _is_not_deleted(condition, alias: str, owner) -> bool:
+    return (
+        isinstance(condition, exp.Is)
+        and isinstance(condition.expression, exp.Null)
+        and isinstance(condition.this, exp.Column)
+        and condition.this.name.lower() == "deleted_at"
+        and owner(condition.this) == alias
+    )
+
+
+def _count(total):
+    # COUNT over no rows is 0 and a bigint; SUM over no rows is NULL and numeric
+    return exp.cast(exp.func("COALESCE", total, exp.Literal.number(0)), "BIGINT")
+
+
+def _replace_aggregate(agg, replacement):
+    """Put `replacement` where `agg` is. An aggregate FILTER clause moves onto
+    each aggregate inside the replacement: COALESCE(...) FILTER is invalid."""
+    parent = agg.parent
+    if not (isinstance(parent, exp.Filter) and parent.this is agg):
+        agg.replace(replacement)
+        return
+    condition = parent.expression
+    if isinstance(replacement, exp.AggFunc):
+        replacement = exp.Filter(this=replacement, expression=condition.copy())
+    else:
+        for inner in list(replacement.find_all(exp.AggFunc)):
+            inner.replace(exp.Filter(this=inner.copy(), expression=condition.copy()))
+    parent.replace(replacement)
+
+
+def _navigate(tree, rollup: dict):
+    """Rewrite `tree` in place to read `rollup` instead of its fact table;
+    raises _NoMatch when the rollup cannot answer it exactly."""
+    if tree.args.get("distinct") or tree.find(exp.Window) or tree.args.get("with"):
+        raise _NoMatch
+    if any(select is not tree for select in tree.find_all(exp.Select)):
+        raise _NoMatch
+    from_ = tree.args.get("from_") or tree.args.get("from")
+    joins = tree.args.get("joins") or []
+    if from_ is None:
+        raise _NoMatch
+    sources = [from_.this] + [join.this for join in joins]
+    if not all(isinstance(s, exp.Table) for s in sources):
+        raise _NoMatch
+    for join in joins:
+        if join.side or join.kind not in ("", "INNER") or join.args.get("using") or not join.args.get("on"):
+            raise _NoMatch
+    aliases = {s.alias_or_name: s.name.lower() for s in sources}
+    if len(aliases) != len(sources):
+        raise _NoMatch
+    facts = [s for s in sources if s.name.lower() == rollup["fact"]]
+    if len(facts) != 1:
+        raise _NoMatch
+    fact = facts[0].alias_or_name
+
+    # ORDER BY may name output columns
+    outputs = {p.alias for p in tree.expressions if isinstance(p, exp.Alias)}
+
+    def owner(column):
+        if column.table:
+            if column.table not in aliases:
+                raise _NoMatch
+            return column.table
+        if column.name in outputs and column.find_ancestor(exp.Order) is not None:
+            return None
+        if len(sources) == 1:
+            return fact
+        raise _NoMatch
+
+    # every other table must hang off the fact table through primary keys,
+    # so each fact row still meets exactly one row of each
+    edges, filters = [], []
+    for join in joins:
+        for condition in _conjuncts(join.args["on"]):
+            if isinstance(condition, exp.EQ) and isinstance(condition.this, exp.Column) \
+                    and isinstance(condition.expression, exp.Column) \
+                    and owner(condition.this) != owner(condition.expression):
+                edges.append((join, condition))
+            else:
+                filters.append(condition)
+    reached, used = {fact}, set()
+    grew = True
+    while grew:
+        grew = False
+        for i, (_, condition) in enumerate(edges):
+            if i in used:
+                continue
+            sides = [(owner(c), c.name.lower()) for c in (condition.this, condition.expression)]
+            for (near, near_col), (far, far_col) in (sides, sides[::-1]):
+                if near in reached and far not in reached and far_col == PRIMARY_KEYS.get(aliases[far]) and (
+                    near != fact or near_col in rollup["dims"]
+                ):
+                    reached.add(far)
+                    used.add(i)
+                    grew = True
+                    break
+    if reached != set(aliases) or len(used) != len(edges) or \
+            any(not any(j is join for j, _ in edges) for join in joins):
+        raise _NoMatch
+
+    # the rollup holds live fact rows only, so the query must ask for those;
+    # filters from ON clauses mean the same in WHERE for inner joins
+    where = tree.args.get("where")
+    conditions = _conjuncts(where.this if where else None) + filters
+    kept = [c for c in conditions if not _is_not_deleted(c, fact, owner)]
+    if len(kept) == len(conditions):
+        raise _NoMatch
+    for join in joins:
+        join.set("on", exp.and_(*[c for j, c in edges if j is join], copy=False))
+    tree.set("where", exp.Where(this=exp.and_(*kept, copy=False)) if kept else None)
+
+    # fact columns outside aggregates must be dimensions of the rollup
+    for column in tree.find_all(exp.Column):
+        if column.is_star:
+            raise _NoMatch
+        if owner(column) == fact and column.find_ancestor(exp.AggFunc) is None \
+                and column.name.lower() not in rollup["dims"]:
+            raise _NoMatch
+    if any(not isinstance(star.parent, exp.Count) for star in tree.find_all(exp.Star)):
+        raise _NoMatch
+
+    found = False
+    for agg in list(tree.find_all(exp.AggFunc)):
+        if not isinstance(agg, (exp.Sum, exp.Count, exp.Avg, exp.Min, exp.Max)):
+            raise _NoMatch
+        arg = agg.this
+        if isinstance(agg, exp.Count) and isinstance(arg, exp.Star):
+            _replace_aggregate(agg, _count(exp.func("SUM", exp.column("row_count", table=fact))))
+            found = True
+            continue
+        if not isinstance(arg, exp.Column) or owner(arg) != fact:
+            raise _NoMatch
+        name = arg.name.lower()
+        if name in rollup["dims"] and isinstance(agg, (exp.Min, exp.Max)):
+            found = True
+            continue
+        if name not in rollup["measures"]:
+            raise _NoMatch
+        total = exp.func("SUM", exp.column(f"sum_{name}", table=fact))
+        counted = exp.func("SUM", exp.column(f"count_{name}", table=fact))
+        if isinstance(agg, exp.Sum):
+            _replace_aggregate(agg, total)
+        elif isinstance(agg, exp.Count):
+            _replace_aggregate(agg, _count(counted))
+        elif isinstance(agg, exp.Avg):
+            _replace_aggregate(agg, exp.Div(
+                this=total, expression=exp.func("NULLIF", counted, exp.Literal.number(0)), typed=True
+            ))
+        else:
+            func = agg.sql_name()
+            _replace_aggregate(agg, exp.func(func, exp.column(f"{func.lower()}_{name}", table=fact)))
+        found = True
+    if not found:
+        raise _NoMatch
+
+    # the rollup takes the fact table's alias, so the dimension columns and
+    # join conditions read the same
+    facts[0].replace(exp.table_(rollup["name"], alias=fact))
+    return tree
+
+
+class Rollups:
+    """
+    The rollups of `ROLLUPS`: creation, refresh and query rewriting.
+
+    Args:
+        engine: SQLAlchemy engine the views are read through.
+        watermarks: Callable giving the current watermark of each table in a
+            list, normally `ResultCache.watermarks`.
+        refresh_interval: Seconds between checks of the background refresher;
+            ROLLUP_REFRESH_INTERVAL (60), 0 disables it.
+        primary: Engine with CREATE/REFRESH rights on the views; `engine`
+            when omitted.
+    """
+
+    def __init__(self, engine, watermarks, rollups=ROLLUPS, refresh_interval: float = None, primary=None):
+        self.engine = engine
+        self.primary = primary or engine
+        self.watermarks = watermarks
+        self.rollups = rollups
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(
+            os.environ.get("ROLLUP_REFRESH_INTERVAL", 60)
+        )
+        self._lock = threading.Lock()
+        # rollup name -> watermark of its fact table at the last refresh;
+        # views that do not exist are absent
+        self._marks = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.enabled = os.environ.get("ROLLUP_REWRITE", "on") != "off"
+        self.rewrites = 0
+
+    def _mark(self, table: str) -> str:
+        return json.dumps(self.watermarks([table]).get(table), default=str)
+
+    def state(self) -> dict:
+        """Watermark each existing rollup was refreshed at, read once from the view comments."""
+        with self._lock:
+            if self._marks is None:
+                with self.engine.connect() as conn:
+                    rows = conn.execute(
+                        text(_STATE_QUERY), {"names": tuple(r["name"] for r in self.rollups)}
+                    ).fetchall()
+                self._marks = {name: comment for name, comment in rows}
+            return dict(self._marks)
+
+    def fresh(self, rollup: dict) -> bool:
+        marks = self.state()
+        if rollup["name"] not in marks:
+            return False
+        if marks[rollup["name"]] == self._mark(rollup["fact"]):
+            return True
+        self._wake.set()
+        return False
+
+    def _record(self, conn, rollup: dict, mark: str):
+        # COMMENT takes no bind parameters
+        conn.execute(text(
+            f"COMMENT ON MATERIALIZED VIEW {rollup['name']} IS '{mark.replace(chr(39), chr(39) * 2)}'"
+        ))
+        with self._lock:
+            if self._marks is not None:
+                self._marks[rollup["name"]] = mark
+
+    def create(self):
+        """Create every rollup that does not exist yet."""
+        existing = self.state()
+        for rollup in self.rollups:
+            if rollup["name"] in existing:
+                continue
+            # read before building: a write racing the build leaves it stale
+            mark = self._mark(rollup["fact"])
+            with self.primary.begin() as conn:
+                for statement in ddl(rollup):
+                    conn.execute(text(statement))
+                self._record(conn, rollup, mark)
+
+    def drop(self):
+        with self.primary.begin() as conn:
+            for rollup in self.rollups:
+                conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {rollup['name']}"))
+        with self._lock:
+            self._marks = None
+
+    def refresh(self, force: bool = False) -> list:
+        """
+        Refresh the rollups whose fact table moved since their last refresh.
+
+        Returns:
+            Names of the rollups refreshed.
+        """
+        refreshed = []
+        for rollup in self.rollups:
+            if rollup["name"] not in self.state():
+                continue
+            mark = self._mark(rollup["fact"])
+            if not force and self.state()[rollup["name"]] == mark:
+                continue
+            with self.primary.begin() as conn:
+                # another process refreshing the same view has it covered
+                if not conn.execute(
+                    text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": rollup["name"]}
+                ).scalar():
+                    continue
+                # readers keep using the old contents while it is rebuilt
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {rollup['name']}"))
+                self._record(conn, rollup, mark)
+            refreshed.append(rollup["name"])
+        return refreshed
+
+    def start(self):
+        """Refresh stale rollups every `refresh_interval` seconds on a daemon
+        thread, sooner when a rewrite finds one stale. The thread ends when
+        this object is closed or garbage collected."""
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return self._thread
+        ref = weakref.ref(self)
+        interval, wake, stop = self.refresh_interval, self._wake, self._stop
+
+        def loop():
+            while True:
+                wake.wait(interval)
+                wake.clear()
+                rollups = ref()
+                if rollups is None or stop.is_set():
+                    return
+                try:
+                    rollups.refresh()
+                except Exception as e:
+                    warnings.warn(f"Rollup refresh failed: {e}")
+                del rollups
+
+        self._thread = threading.Thread(target=loop, name="rollup-refresh", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def close(self):
+        """Stop the refresh thread; a refresh already running finishes first."""
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def match(self, sql: str):
+        """
+        The rollup that can answer `sql` and the query to run on it.
+
+        Returns:
+            (rollup name, rewritten SQL), or None when no fresh rollup
+            answers the query exactly.
+        """
+        if not self.enabled:
+            return None
+        try:
+            original = sqlglot.parse_one(sql, read="postgres")
+        except sqlglot.errors.ParseError:
+            return None
+        if not isinstance(original, exp.Select):
+            return None
+        for rollup in self.rollups:
+            try:
+                tree = _navigate(original.copy(), rollup)
+            except _NoMatch:
+                continue
+            if not self.fresh(rollup):
+                continue
+            # keep the column names Postgres gives unaliased aggregates
+            for before, after in zip(original.expressions, list(tree.expressions)):
+                if isinstance(before, exp.Filter):
+                    before = before.this
+                if isinstance(before, exp.AggFunc) and not isinstance(after, exp.Alias):
+                    after.replace(exp.alias_(after.copy(), before.sql_name().lower()))
+            with self._lock:
+                self.rewrites += 1
+            return rollup["name"], render(tree)
+        return None
+
+    def rewrite(self, sql: str) -> str:
+        """`sql` answered from a rollup when one matches, otherwise `sql` itself."""
+        matched = self.match(sql)
+        return matched[1] if matched else sql
+
+    def status(self) -> list:
+        marks = self.state()
+        return [
+            {
+                "name": rollup["name"],
+                "fact": rollup["fact"],
+                "exists": rollup["name"] in marks,
+                "fresh": self.fresh(rollup),
+            }
+            for rollup in self.rollups
+        ]
+
+
+def main():
+    from resources import get_resources
+
+    parser = argparse.ArgumentParser(description="Manage the materialized rollups")
+    parser.add_argument("command", choices=("create", "refresh", "status", "drop", "ddl"))
+    parser.add_argument("--force", action="store_true", help="refresh even if up to date")
+    args = parser.parse_args()
+
+    if args.command == "ddl":
+        for rollup in ROLLUPS:
+            print(";\n".join(ddl(rollup)) + ";\n")
+        return
+    rollups = get_resources().rollups
+    if args.command == "create":
+        rollups.create()
+    elif args.command == "refresh":
+        print("refreshed:", ", ".join(rollups.refresh(force=args.force)) or "nothing")
+    elif args.command == "drop":
+        rollups.drop()
+    for entry in rollups.status():
+        state = "fresh" if entry["fresh"] else "stale" if entry["exists"] else "missing"
+        print(f"{entry['name']:28} {entry['fact']:10} {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import List
+
+from sqlalchemy import text
+
+# tables, columns, CHECK/PK/FK constraints of one schema in a single round trip
+CATALOG_QUERY = """
+SELECT c.relname AS table_name,
+       c.relkind AS kind,
+       (SELECT json_agg(json_build_object(
+                   'name', a.attname,
+                   'type', format_type(a.atttypid, a.atttypmod),
+                   'nullable', NOT a.attnotnull) ORDER BY a.attnum)
+          FROM pg_attribute a
+         WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+       (SELECT json_agg(json_build_object(
+                   'type', con.contype,
+                   'definition', pg_get_constraintdef(con.oid),
+                   'columns', (SELECT array_agg(att.attname ORDER BY k.ord)
+                                 FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+                                 JOIN pg_attribute att
+                                   ON att.attrelid = con.conrelid AND att.attnum = k.attnum),
+                   'ref_table', ref.relname,
+                   'ref_columns', (SELECT array_agg(att.attname ORDER BY k.ord)
+                                     FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+                                     JOIN pg_attribute att
+                                       ON att.attrelid = con.confrelid AND att.attnum = k.attnum)))
+          FROM pg_constraint con
+          LEFT JOIN pg_class ref ON ref.oid = con.confrelid
+         WHERE con.conrelid = c.oid AND con.contype IN ('c', 'f', 'p')) AS constraints
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'p', 'v', 'm')
+ORDER BY c.relname
+"""
+
+# changes whenever a table, column or constraint of the schema is created,
+# dropped or altered; cheap enough to run before serving the catalog
+FINGERPRINT_QUERY = """
+SELECT md5(
+    coalesce((SELECT string_agg(a.attrelid || '.' || a.attname || '.' || a.atttypid
+                                || '.' || a.atttypmod || '.' || a.attnotnull,
+                                ',' ORDER BY a.attrelid, a.attnum)
+                FROM pg_attribute a
+                JOIN pg_class c ON c.oid = a.attrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+               WHERE n.nspname = :schema AND c.relkind IN ('r', 'p', 'v', 'm')
+                 AND a.attnum > 0 AND NOT a.attisdropped), '')
+    || coalesce((SELECT string_agg(con.oid::text, ',' ORDER BY con.oid)
+                   FROM pg_constraint con
+                   JOIN pg_namespace n ON n.oid = con.connamespace
+                  WHERE n.nspname = :schema), '')
+)
+"""
+
+_CHECK_VALUE_RE = re.compile(r"'((?:[^']|'')*)'::")
+
+
+def _parse(rows) -> dict:
+    tables = {}
+    for row in rows:
+        columns = [
+            {"name": c["name"], "type": c["type"], "nullable": c["nullable"], "allowed_values": None}
+            for c in row.columns or []
+        ]
+        by_name = {c["name"]: c for c in columns}
+        table = {
+            "kind": "view" if row.kind in ("v", "m") else "table",
+            "columns": columns,
+            "primary_key": [],
+            "foreign_keys": [],
+        }
+        for con in row.constraints or []:
+            if con["type"] == "p":
+                table["primary_key"] = con["columns"] or []
+            elif con["type"] == "f":
+                table["foreign_keys"].append({
+                    "columns": con["columns"] or [],
+                    "ref_table": con["ref_table"],
+                    "ref_columns": con["ref_columns"] or [],
+                })
+            elif con["type"] == "c" and len(con["columns"] or []) == 1:
+                # enum-style CHECK (col IN (...)) is stored as col = ANY (ARRAY[...])
+                values = _CHECK_VALUE_RE.findall(con["definition"])
+                column = by_name.get(con["columns"][0])
+                if values and column is not None:
+                    column["allowed_values"] = [v.replace("''", "'") for v in values]
+        tables[row.table_name] = table
+    return tables
+
+
+class SchemaCatalog:
+    """
+    In-memory copy of the database catalog with its foreign-key join graph.
+
+    The whole schema is introspected with one pg_catalog query and kept until
+    the DDL fingerprint changes; the fingerprint itself is re-checked at most
+    every `refresh_interval` seconds, so repeated tool calls within a question
+    never reach the database.
+    """
+
+    def __init__(self, engine, schema: str = "public", refresh_interval: float = None):
+        self.engine = engine
+        self.schema = schema
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(
+            os.environ.get("CATALOG_REFRESH_INTERVAL", 30)
+        )
+        self._lock = threading.Lock()
+        self._tables = None
+        self._joins = {}
+        self._fingerprint = None
+        self._checked_at = float("-inf")
+
+    def _load(self, conn):
+        rows = conn.execute(text(CATALOG_QUERY), {"schema": self.schema}).fetchall()
+        self._tables = _parse(rows)
+        self._joins = self._build_join_graph()
+
+    def _build_join_graph(self) -> dict:
+        graph = {name: [] for name in self._tables}
+        for name, table in self._tables.items():
+            for fk in table["foreign_keys"]:
+                if fk["ref_table"] not in graph:
+                    continue
+                condition = " AND ".join(
+                    f"{name}.{col} = {fk['ref_table']}.{ref}"
+                    for col, ref in zip(fk["columns"], fk["ref_columns"])
+                )
+                graph[name].append((fk["ref_table"], condition))
+                graph[fk["ref_table"]].append((name, condition))
+        return graph
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload the catalog if the DDL fingerprint changed; returns True on reload."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._tables is not None and now - self._checked_at < self.refresh_interval:
+                return False
+            self._checked_at = now
+            with self.engine.connect() as conn:
+                fingerprint = conn.execute(text(FINGERPRINT_QUERY), {"schema": self.schema}).scalar()
+                if not force and fingerprint == self._fingerprint and self._tables is not None:
+                    return False
+                self._load(conn)
+            self._fingerprint = fingerprint
+            return True
+
+    @property
+    def tables(self) -> dict:
+        self.refresh()
+        return self._tables
+
+    @property
+    def fingerprint(self) -> str:
+        self.refresh()
+        return self._fingerprint
+
+    def table_names(self) -> List[str]:
+        return [name for name, table in self.tables.items() if table["kind"] == "table"]
+
+    def join_path(self, source: str, target: str) -> List[str]:
+        """Join conditions along the shortest FK path from `source` to `target`."""
+        self.refresh()
+        if source not in self._joins or target not in self._joins:
+            return []
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            if current == target:
+                break
+            for neighbour, condition in self._joins[current]:
+                if neighbour not in previous:
+                    previous[neighbour] = (current, condition)
+                    queue.append(neighbour)
+        if target not in previous:
+            return []
+        path = []
+        node = target
+        while previous[node] is not None:
+            node, condition = previous[node]
+            path.append(condition)
+        return list(reversed(path))
+
+    def join_plan(self, tables: List[str]) -> List[str]:
+        """Join conditions connecting all of `tables`, via intermediate tables if needed."""
+        conditions = []
+        for table in tables[1:]:
+            for condition in self.join_path(tables[0], table):
+                if condition not in conditions:
+                    conditions.append(condition)
+        return conditions
+
+    def describe(self, table_name: str) -> str:
+        """Human and LLM readable description of one table."""
+        table = self.tables.get(table_name)
+        if table is None:
+            return f"Unknown table '{table_name}'. Known tables: {', '.join(self.table_names())}"
+        lines = [f"{table['kind'].upper()} {table_name}"]
+        for column in table["columns"]:
+            line = f"  {column['name']} {column['type']}"
+            if not column["nullable"]:
+                line += " NOT NULL"
+            if column["name"] in table["primary_key"]:
+                line += " PRIMARY KEY"
+            if column["allowed_values"]:
+                line += f" (allowed: {', '.join(column['allowed_values'])})"
+            lines.append(line)
+        for fk in table["foreign_keys"]:
+            lines.append(
+                f"  FK ({', '.join(fk['columns'])}) -> {fk['ref_table']}({', '.join(fk['ref_columns'])})"
+            )
+        for other in self.table_names():
+            if other != table_name:
+                path = self.join_path(table_name, other)
+                if len(path) > 1:
+                    lines.append(f"  JOIN PATH to {other}: {' AND '.join(path)}")
+        return "\n".join(lines)
+
+
+def catalog_tools(catalog: SchemaCatalog):
+    """Agent tools served from `catalog` instead of information_schema."""
+    from langchain_core.tools import tool
+
+    @tool
+    def list_table() -> str:
+        """Return names of tables present in the database."""
+        return ", ".join(catalog.table_names())
+
+    @tool
+    def get_table_schema(table_name: str) -> str:
+        """Return columns, types, nullability, allowed values and foreign keys of a table.
+        Argument: table_name, example - customers
+        """
+        return catalog.describe(table_name)
+
+    @tool
+    def get_join_path(tables: List[str]) -> str:
+        """Return the JOIN conditions that connect the given tables through foreign keys.
+        Argument: tables, example - ["repayments", "customers"]
+        """
+        conditions = catalog.join_plan(tables)
+        if not conditions:
+            return f"No foreign-key path connects {', '.join(tables)}"
+        return "\n".join(conditions)
+
+    return [list_table, get_table_schema, get_join_path]
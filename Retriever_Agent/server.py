@@ -0,0 +1,372 @@
+"""
+Headless HTTP server for SQLAgent, backed by a pool of worker processes.
+
+Before forking any worker, the parent process:
+- loads the embedding model
+- brings the on-disk schema index up to date
+
+Workers are forked after that. They share the model's memory copy-on-write
+instead of each loading a copy. Each worker opens the persisted Chroma
+collection, which is already embedded and is read through the shared page
+cache. Each worker also builds its own database pools and LLM client, and
+answers up to SERVER_WORKER_CONCURRENCY questions at once on an event loop.
+A worker that dies is forked again from the loaded parent.
+
+Admission is bounded. At most `workers * concurrency` questions run and
+SERVER_QUEUE_SIZE more wait; past that the server answers 503 immediately.
+Every question has a deadline, the request's `timeout` capped at
+SERVER_REQUEST_TIMEOUT. A question still queued at its deadline is dropped
+without running. One still running is cancelled. Either way the caller gets
+504.
+
+    python server.py --workers 4 --port 8765
+
+    POST /ask     {"question": ..., "session_id": ..., "timeout": seconds}
+                  200 {"answer", "sql", "params", "result": {"columns", "rows", "total_rows"}}
+                  400 bad request, 503 full (Retry-After), 504 deadline passed, 500 failed
+    GET  /health  workers alive, questions running and queued, capacity
+
+Front ends talk to it through client.py when AGENT_SERVER_URL is set.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from concurrency import Busy
+from resources import Resources
+
+# how long past a deadline the server waits for the worker's own 504
+DEADLINE_GRACE = 0.5
+
+
+def _release_index():
+    # Chroma keeps one client per path for the whole process; close it so no
+    # worker inherits an open SQLite connection
+    try:
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return
+    SharedSystemClient.clear_system_cache()
+
+
+def load_shared(resources: Resources):
+    """Load what the workers share: the embedding model and a synced schema index."""
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    resources.embeddings
+    if "torch" in sys.modules:
+        # anything the sync encodes runs single-threaded, so no OpenMP thread
+        # pool exists when the workers are forked
+        import torch
+        torch.set_num_threads(1)
+    resources.schema_index
+    resources.invalidate("schema_index")
+    _release_index()
+
+
+def _jsonable(answer: dict) -> dict:
+    result = answer.get("result")
+    return {
+        "answer": answer["answer"],
+        "sql": answer["sql"],
+        "params": answer.get("params"),
+        # cursors live in the worker's pool; only the first page travels
+        "result": result and {k: result[k] for k in ("columns", "rows", "total_rows")},
+    }
+
+
+async def _handle(agent, job, conn):
+    job_id, question, session_id, deadline = job
+    try:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            status, body = 504, {"error": "deadline passed before a worker was free"}
+        else:
+            answer = await asyncio.wait_for(agent.aask(question, session_id), remaining)
+            status, body = 200, _jsonable(answer)
+    except asyncio.TimeoutError:
+        status, body = 504, {"error": "deadline passed while answering"}
+    except Busy:
+        status, body = 503, {"error": "busy"}
+    except Exception as e:
+        status, body = 500, {"error": str(e)}
+    conn.send((job_id, status, json.dumps(body, default=str)))
+
+
+async def _serve(agent, conn):
+    loop = asyncio.get_running_loop()
+    running = set()
+    while True:
+        # the parent never sends a worker more than its concurrency at once
+        job = await loop.run_in_executor(None, conn.recv)
+        if job is None:
+            break
+        task = asyncio.create_task(_handle(agent, job, conn))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if running:
+        await asyncio.wait(running)
+
+
+def _worker(resources: Resources, conn, threads: int):
+    # Ctrl-C goes to the parent, which stops the workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+    from agent_core import SQLAgent
+
+    agent = SQLAgent(resources=resources)
+    try:
+        agent.warm_up(background=False)
+    except Exception as e:
+        # whatever failed is built again by the first question that needs it
+        print(f"worker {os.getpid()}: warm-up failed: {e}", file=sys.stderr, flush=True)
+    asyncio.run(_serve(agent, conn))
+
+
+class _Worker:
+    """A worker process, the parent's end of its pipe and the questions it runs."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.running = set()
+
+
+class WorkerPool:
+    """
+    Worker processes forked from this one, and the bounded queue in front of them.
+
+    Each worker has a pipe of its own, so a worker that is killed takes only
+    its own questions with it. The parent hands a question to the least busy
+    worker with room, and keeps it queued while every worker is full.
+
+    Args:
+        resources: Shared resources, loaded (`load_shared`) before `start`.
+        workers: Processes; SERVER_WORKERS (CPU count, at most 4).
+        concurrency: Questions each worker runs at once; SERVER_WORKER_CONCURRENCY (4).
+        queue_size: Questions waiting for a worker beyond those running;
+            SERVER_QUEUE_SIZE (32).
+    """
+
+    def __init__(self, resources: Resources, workers: int = None, concurrency: int = None,
+                 queue_size: int = None):
+        self.resources = resources
+        self.workers = workers or int(os.environ.get("SERVER_WORKERS", min(4, os.cpu_count() or 1)))
+        self.concurrency = concurrency or int(os.environ.get("SERVER_WORKER_CONCURRENCY", 4))
+        self.queue_size = queue_size if queue_size is not None else int(os.environ.get("SERVER_QUEUE_SIZE", 32))
+        self.capacity = self.workers * self.concurrency + self.queue_size
+        self.in_flight = 0
+        self._context = multiprocessing.get_context("fork")
+        self._queued = collections.deque()
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._workers = []
+
+    def start(self):
+        with self._lock:
+            self._workers = [self._spawn() for _ in range(self.workers)]
+        threading.Thread(target=self._collect, name="pool-results", daemon=True).start()
+        threading.Thread(target=self._watch, name="pool-watch", daemon=True).start()
+
+    def _spawn(self) -> _Worker:
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        ours, theirs = self._context.Pipe()
+        process = self._context.Process(target=_worker, args=(self.resources, theirs, threads), daemon=True)
+        process.start()
+        # only the worker holds its end, so its exit closes the pipe
+        theirs.close()
+        return _Worker(process, ours)
+
+    def _resolve(self, job_id: str, reply: tuple) -> bool:
+        # called with the lock held; whoever resolves a question frees its place
+        waiting = self._waiting.pop(job_id, None)
+        if waiting is None:
+            return False
+        self.in_flight -= 1
+        waiting[1] = reply
+        waiting[0].set()
+        return True
+
+    def _dispatch(self):
+        # called with the lock held
+        while self._queued:
+            ready = [w for w in self._workers if len(w.running) < self.concurrency and w.process.is_alive()]
+            if not ready:
+                return
+            job = self._queued.popleft()
+            if job[0] not in self._waiting:
+                # its caller gave up already
+                continue
+            worker = min(ready, key=lambda w: len(w.running))
+            try:
+                worker.conn.send(job)
+            except OSError:
+                self._queued.appendleft(job)
+                return
+            worker.running.add(job[0])
+
+    def _replace(self, worker: _Worker):
+        with self._lock:
+            if self._stopping or worker not in self._workers:
+                return
+            worker.process.join(1.0)
+            print(f"worker {worker.process.pid} exited ({worker.process.exitcode}); forking a new one",
+                  file=sys.stderr, flush=True)
+            for job_id in worker.running:
+                self._resolve(job_id, (500, json.dumps({"error": "the worker answering it exited"})))
+            worker.conn.close()
+            self._workers[self._workers.index(worker)] = self._spawn()
+            self._dispatch()
+
+    def _watch(self):
+        while not self._stopping:
+            time.sleep(1.0)
+            for worker in list(self._workers):
+                if not worker.process.is_alive():
+                    self._replace(worker)
+
+    def _collect(self):
+        while not self._stopping:
+            with self._lock:
+                workers = {w.conn: w for w in self._workers}
+            try:
+                ready = multiprocessing.connection.wait(list(workers), timeout=0.5)
+            except (OSError, ValueError):
+                # a pipe was closed under us; look again
+                continue
+            for conn in ready:
+                try:
+                    job_id, status, body = conn.recv()
+                except (EOFError, OSError):
+                    self._replace(workers[conn])
+                    continue
+                with self._lock:
+                    workers[conn].running.discard(job_id)
+                    self._resolve(job_id, (status, body))
+                    self._dispatch()
+
+    def ask(self, question: str, session_id: str, deadline: float):
+        """
+        Run `question` on a worker and wait for it until `deadline` (Unix time).
+
+        Returns:
+            (HTTP status, JSON body).
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                return 503, json.dumps({"error": "busy"})
+            self.in_flight += 1
+            waiting = self._waiting[job_id] = [threading.Event(), None]
+            self._queued.append((job_id, question, session_id, deadline))
+            self._dispatch()
+        if not waiting[0].wait(max(0.0, deadline - time.time()) + DEADLINE_GRACE):
+            with self._lock:
+                self._resolve(job_id, (504, json.dumps({"error": "deadline passed"})))
+        return waiting[1]
+
+    def health(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "alive": sum(w.process.is_alive() for w in self._workers),
+                "running": sum(len(w.running) for w in self._workers),
+                "queued": len(self._waiting) - sum(len(w.running) for w in self._workers),
+                "capacity": self.capacity,
+            }
+
+    def stop(self, timeout: float = 10.0):
+        with self._lock:
+            self._stopping = True
+            for worker in self._workers:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        stop_by = time.time() + timeout
+        for worker in self._workers:
+            worker.process.join(max(0.0, stop_by - time.time()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status: int, body: str):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._reply(404, json.dumps({"error": "not found"}))
+        self._reply(200, json.dumps(self.server.pool.health()))
+
+    def do_POST(self):
+        if self.path != "/ask":
+            return self._reply(404, json.dumps({"error": "not found"}))
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            question = payload["question"]
+            if not isinstance(question, str) or not question.strip():
+                raise ValueError("question must be a non-empty string")
+            timeout = min(float(payload.get("timeout") or self.server.max_timeout), self.server.max_timeout)
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, json.dumps({"error": f"bad request: {e}"}))
+        session_id = payload.get("session_id")
+        self._reply(*self.server.pool.ask(question, session_id and str(session_id), time.time() + timeout))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLAgent HTTP server")
+    parser.add_argument("--host", default=os.environ.get("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVER_PORT", 8765)))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--concurrency", type=int, help="questions each worker runs at once")
+    parser.add_argument("--queue-size", type=int, help="questions waiting beyond those running")
+    parser.add_argument("--timeout", type=float, default=float(os.environ.get("SERVER_REQUEST_TIMEOUT", 60)),
+                        help="default and longest deadline of a question, in seconds")
+    args = parser.parse_args()
+
+    resources = Resources()
+    started = time.perf_counter()
+    load_shared(resources)
+    print(f"loaded the embedding model and schema index in {time.perf_counter() - started:.1f} s", flush=True)
+
+    pool = WorkerPool(resources, args.workers, args.concurrency, args.queue_size)
+    pool.start()
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.daemon_threads = True
+    server.pool = pool
+    server.max_timeout = args.timeout
+    print(f"serving on http://{args.host}:{args.port} with {pool.workers} workers, "
+          f"{pool.concurrency} questions each, {pool.queue_size} queued", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
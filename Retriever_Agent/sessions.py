@@ -0,0 +1,359 @@
+"""
+Per-session conversation state, persisted in SQLite.
+
+A session remembers its recent turns, the schema context retrieved for it,
+the last query that ran (SQL, bind parameters, columns, first rows) and a
+question waiting on a clarification. SQLAgent uses it to answer follow-ups
+without starting over:
+
+    "show it in a table format"   the last result, re-rendered
+    "show me the sql"             the last query
+    "only branch_1"               the last query narrowed to one branch
+    anything else short and       the agent, given the previous question, its
+    plainly referring back        SQL and result, with the schema retrieved
+    ("what about loans?",         afresh for the new question
+    "sort those by balance")
+
+A question that names a table ("show me the accounts table") or merely
+contains "that" or "this" ("loans that are overdue", "this year") is a
+question of its own.
+
+State is bounded (turns, stored rows, bytes per session, number of sessions)
+and sessions idle for SESSION_IDLE_TIMEOUT seconds are deleted. Two requests
+of one session may finish in either order: a save that finds the session
+changed since its load re-applies its turn to the newer state.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import sqlglot
+from sqlglot import exp
+
+from intent_router import BRANCH_RE
+from sql_guard import render
+
+_BRANCH_ANY_CASE_RE = re.compile(BRANCH_RE.pattern, re.IGNORECASE)
+_TABLE_FOLLOW_UP_RE = re.compile(r"\b(?:table|tabular|grid|rows)\b")
+_BARE_TABLE_RE = re.compile(r"^\s*(?:as|in|into)\s+(?:a\s+)?(?:table|tabular|grid)\b")
+_SQL_FOLLOW_UP_RE = re.compile(r"\b(?:sql|query)\b")
+_NARROW_RE = re.compile(
+    r"^\s*(?:only|just|but only|now only|filter (?:it |that |those )?(?:to|for|by)|(?:and )?for|in"
+    r"|(?:and )?(?:what|how) about)\b"
+)
+# words a branch follow-up may carry besides the branch itself
+_NARROW_FILLER = {"only", "just", "now", "then", "and", "but", "the", "for", "in", "to", "by",
+                  "filter", "it", "that", "those", "them", "same", "please", "too", "instead",
+                  "what", "how", "about"}
+# unambiguous references to the previous answer; "that" and "this" also
+# start relative clauses and date ranges, so they count only as objects
+_REFERS_BACK_RE = re.compile(
+    r"^\s*(?:and )?(?:what|how) about\b|^\s*same\b"
+    r"|\b(?:those|these|them|same|previous|above|earlier|instead)\b"
+    r"|\b(?:it|that|this)\s*(?:$|\b(?:by|per|to|in|into|as|down|up|out|again|instead|result|results|list|query|answer|data|one|ones)\b)"
+)
+# a schema table named outright makes the question a new one
+_SCHEMA_TABLE_RE = re.compile(r"\b(?:branch(?:es)?|customers?|accounts?|loans?|repayments?)\s+table\b")
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _decode(obj: dict):
+    if "$decimal" in obj:
+        return Decimal(obj["$decimal"])
+    if "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    if "$date" in obj:
+        return date.fromisoformat(obj["$date"])
+    return obj
+
+
+def follow_up_kind(question: str) -> str:
+    """'table', 'sql', 'branch' or 'refine' for a follow-up, None for a fresh question."""
+    q = " ".join(question.lower().split()).rstrip("?.! ")
+    words = q.split()
+    if _SCHEMA_TABLE_RE.search(q):
+        return None
+    refers_back = bool(_REFERS_BACK_RE.search(q))
+    if len(words) <= 10 and _TABLE_FOLLOW_UP_RE.search(q) and (refers_back or _BARE_TABLE_RE.search(q)):
+        return "table"
+    if len(words) <= 6 and _SQL_FOLLOW_UP_RE.search(q) and re.search(r"\b(?:show|see|what|give|print)\b", q):
+        return "sql"
+    match = BRANCH_RE.search(q)
+    if len(words) <= 6 and match and _NARROW_RE.search(q):
+        rest = re.findall(r"[a-z]+", q[:match.start()] + " " + q[match.end():])
+        if set(rest) <= _NARROW_FILLER:
+            return "branch"
+    if len(words) <= 10 and refers_back:
+        return "refine"
+    return None
+
+
+_BRANCH_COLUMNS = {"branch_name", "branch_id"}
+
+
+def _filters_branch(tree) -> bool:
+    """Whether a WHERE of `tree` compares a branch column with a value (a
+    predicate over two columns is a join condition, not a filter)."""
+    for where in tree.find_all(exp.Where):
+        for predicate in where.find_all(exp.Predicate):
+            columns = list(predicate.find_all(exp.Column))
+            if len(columns) == 1 and columns[0].name.lower() in _BRANCH_COLUMNS:
+                return True
+    return False
+
+
+def _cuts_rows(tree, total_rows: int) -> bool:
+    """Whether the outer LIMIT, FETCH or OFFSET of `tree` may have left rows
+    out. The SQL guard clamps every query to a LIMIT above its row cap, which
+    cuts nothing when fewer rows came back."""
+    if tree.args.get("offset") is not None:
+        return True
+    limit = tree.args.get("limit")
+    if limit is None:
+        return False
+    value = limit.expression if isinstance(limit, exp.Limit) else None
+    return not (isinstance(value, exp.Literal) and value.is_int and int(value.this) > total_rows)
+
+
+def narrow_to_branch(last: dict, branch: str):
+    """
+    The session's last query restated for `branch`, e.g. "Branch_1", as a
+    (question, sql, params) triple, or None when that cannot be done safely.
+
+    A query binding :branch (the intent router's templates) is run again
+    with the new branch. Otherwise a query that neither filters on a branch
+    already (a second predicate would contradict it) nor cuts its rows with
+    a LIMIT (the top N of all branches are not the top N of one) is
+    narrowed: a result with a branch_name column is filtered on it, else a
+    branches table in the outer query gets the predicate, bound as
+    :followup_branch.
+    """
+    sql, params = last["sql"], last["params"]
+    restated = _BRANCH_ANY_CASE_RE.sub(branch, last["question"])
+    if restated == last["question"]:
+        restated = f"{last['question'].rstrip('?. ')} in {branch}"
+    if "branch" in params and ":branch" in sql:
+        return restated, sql, dict(params, branch=branch)
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except sqlglot.errors.ParseError:
+        return None
+    if not isinstance(tree, exp.Select) or _filters_branch(tree) or _cuts_rows(tree, last["total_rows"]):
+        return None
+    params = dict(params, followup_branch=branch)
+    predicate = "lower(branch_name) = lower(:followup_branch)"
+    if "branch_name" in last["columns"]:
+        return restated, f"SELECT * FROM ({sql}) AS previous WHERE {predicate}", params
+    from_ = tree.args.get("from_") or tree.args.get("from")
+    sources = ([from_.this] if from_ else []) + [join.this for join in tree.args.get("joins") or []]
+    branches = [s for s in sources if isinstance(s, exp.Table) and s.name.lower() == "branches"]
+    if len(branches) != 1:
+        return None
+    condition = sqlglot.parse_one(
+        f"lower({branches[0].alias_or_name}.branch_name) = lower(:followup_branch)", read="postgres"
+    )
+    tree.where(condition, copy=False)
+    return restated, render(tree), params
+
+
+class Session:
+    """State of one conversation; see the module docstring."""
+
+    def __init__(self, session_id: str, state: dict = None, version: int = 0):
+        state = state or {}
+        self.session_id = session_id
+        self.turns = state.get("turns", [])
+        self.schema_context = state.get("schema_context")
+        self.last = state.get("last")
+        self.pending = state.get("pending")
+        # save() only replaces the stored state this was loaded from
+        self.version = version
+        # the follow-up kind while answering one; the agent reuses the schema
+        # context except for a "refine", which may need other tables
+        self.follow_up = None
+        # schema context retrieved during this request
+        self.retrieved = None
+        # the follow-up restated as a full question, when it was answered that way
+        self.restated = None
+
+    def to_state(self) -> dict:
+        return {
+            "turns": self.turns,
+            "schema_context": self.schema_context,
+            "last": self.last,
+            "pending": self.pending,
+        }
+
+    def remember_turn(self, question: str, answer: dict, max_turns: int, max_rows: int):
+        """Record a turn; a successful query becomes `last`, a clarification request `pending`."""
+        self.turns.append({"question": question, "answer": answer["answer"], "sql": answer.get("sql")})
+        del self.turns[:-max_turns]
+        text = str(answer["answer"])
+        if text.startswith("CLARIFICATION_NEEDED"):
+            self.pending = self.pending or question
+            return
+        self.pending = None
+        result = answer.get("result")
+        if answer.get("sql") and result:
+            self.last = {
+                "question": self.restated or question,
+                "sql": answer["sql"],
+                "params": answer.get("params") or {},
+                "columns": result["columns"],
+                "rows": result["rows"][:max_rows],
+                "total_rows": result["total_rows"],
+                "total_is_exact": result.get("total_is_exact", True),
+            }
+
+    def remember_schema(self, context: str):
+        self.schema_context = context
+        self.retrieved = context
+
+
+class SessionStore:
+    """
+    SQLite-backed `Session` store.
+
+    Args:
+        path: Database file; SESSION_DB (sessions.sqlite3) when omitted.
+        max_turns: Turns kept per session; SESSION_MAX_TURNS (20).
+        max_rows: Rows of the last result kept; SESSION_RESULT_ROWS (100).
+        max_bytes: Serialized size cap per session; SESSION_MAX_BYTES (256 KiB).
+            Stored rows, then the schema context, then the oldest turns are
+            dropped to fit.
+        max_sessions: Sessions kept; SESSION_MAX_SESSIONS (1000), least
+            recently used deleted first.
+        idle_timeout: Seconds after which an unused session is deleted;
+            SESSION_IDLE_TIMEOUT (3600).
+    """
+
+    def __init__(self, path: str = None, max_turns: int = None, max_rows: int = None,
+                 max_bytes: int = None, max_sessions: int = None, idle_timeout: float = None):
+        self.path = path or os.environ.get("SESSION_DB", "sessions.sqlite3")
+        self.max_turns = max_turns or int(os.environ.get("SESSION_MAX_TURNS", 20))
+        self.max_rows = max_rows or int(os.environ.get("SESSION_RESULT_ROWS", 100))
+        self.max_bytes = max_bytes or int(os.environ.get("SESSION_MAX_BYTES", 256 * 1024))
+        self.max_sessions = max_sessions or int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+        self.idle_timeout = idle_timeout or float(os.environ.get("SESSION_IDLE_TIMEOUT", 3600))
+        self._lock = threading.Lock()
+        self._swept = 0.0
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, state TEXT NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "version" not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def load(self, session_id: str) -> Session:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, updated_at, version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return Session(session_id)
+        if time.time() - row[1] > self.idle_timeout:
+            return Session(session_id, version=row[2])
+        return Session(session_id, json.loads(row[0], object_hook=_decode), version=row[2])
+
+    def record(self, session: Session, question: str, answer: dict, attempts: int = 5):
+        """
+        Add the turn `question` -> `answer` to `session` and save it.
+
+        When another request of the session saved first, the turn (and any
+        schema context retrieved for it) is applied to the newer state
+        instead, so neither request's turn is lost.
+        """
+        for _ in range(attempts):
+            session.remember_turn(question, answer, self.max_turns, self.max_rows)
+            if self.save(session):
+                return
+            newer = self.load(session.session_id)
+            newer.restated = session.restated
+            if session.retrieved is not None:
+                newer.remember_schema(session.retrieved)
+            session = newer
+        raise RuntimeError(f"session {session.session_id} kept changing; turn not saved")
+
+    def _serialize(self, session: Session) -> str:
+        state = session.to_state()
+        data = json.dumps(state, default=_encode)
+        # shed the bulkiest, least needed state first
+        while len(data) > self.max_bytes:
+            if state["last"] and state["last"]["rows"]:
+                state["last"]["rows"] = state["last"]["rows"][: len(state["last"]["rows"]) // 2]
+            elif state["schema_context"]:
+                state["schema_context"] = None
+            elif len(state["turns"]) > 1:
+                state["turns"] = state["turns"][1:]
+            else:
+                break
+            data = json.dumps(state, default=_encode)
+        return data
+
+    def save(self, session: Session) -> bool:
+        """
+        Store `session` if the stored copy is still the one it was loaded from.
+
+        Returns:
+            False when another request saved the session in between (or it
+            was deleted); nothing is written then.
+        """
+        data = self._serialize(session)
+        now = time.time()
+        with self._lock:
+            if session.version:
+                saved = self._conn.execute(
+                    "UPDATE sessions SET updated_at = ?, state = ?, version = version + 1 "
+                    "WHERE session_id = ? AND version = ?",
+                    (now, data, session.session_id, session.version),
+                ).rowcount
+            else:
+                saved = self._conn.execute(
+                    "INSERT INTO sessions (session_id, updated_at, state, version) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (session_id) DO NOTHING",
+                    (session.session_id, now, data),
+                ).rowcount
+        if not saved:
+            return False
+        session.version += 1
+        if now - self._swept > 60:
+            self.evict(now)
+        return True
+
+    def evict(self, now: float = None) -> int:
+        """Delete idle sessions and the least recently used beyond `max_sessions`."""
+        now = now or time.time()
+        with self._lock:
+            self._swept = now
+            deleted = self._conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (now - self.idle_timeout,)
+            ).rowcount
+            deleted += self._conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                " SELECT session_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            ).rowcount
+        return deleted
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
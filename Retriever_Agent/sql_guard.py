@@ -0,0 +1,238 @@
+import json
+import os
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+
+from result_cache import TABLES
+
+# statements that write or change state, wherever they appear (data-modifying
+# CTEs included)
+_WRITES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop,
+    exp.Alter, exp.TruncateTable, exp.Command,
+)
+
+# functions that sleep, signal backends, touch the server's files or reach
+# other databases; a read-only transaction does not stop any of them
+FORBIDDEN_FUNCTIONS = frozenset({
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_terminate_backend",
+    "pg_cancel_backend", "pg_reload_conf", "pg_rotate_logfile", "set_config",
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file",
+    "lo_import", "lo_export", "dblink", "dblink_exec", "pg_advisory_lock",
+    "pg_advisory_xact_lock", "pg_notify",
+})
+
+
+def render(tree) -> str:
+    """Postgres SQL for `tree`, keeping SQLAlchemy-style :name binds instead of
+    psycopg's %(name)s."""
+    tree = tree.transform(
+        lambda node: exp.var(f":{node.name}") if isinstance(node, exp.Placeholder) and node.name else node
+    )
+    return tree.sql(dialect="postgres")
+
+
+class GuardError(ValueError):
+    """Raised when a query is not a single read-only SELECT or is over budget."""
+
+
+def _function_name(node) -> str:
+    if isinstance(node, exp.Anonymous):
+        return node.name.lower()
+    return node.sql_name().lower()
+
+
+class SQLGuard:
+    """
+    Checks and rewrites LLM-written SQL before it reaches PostgreSQL.
+
+    `rewrite` parses the query and accepts exactly one read-only SELECT
+    (UNION and WITH included). It adds `<alias>.deleted_at IS NULL` for every
+    soft-deleted table in FROM or JOIN whose alias no WHERE or ON condition of
+    the same SELECT mentions with deleted_at, putting the predicate in the ON
+    clause of a LEFT join (or filtering the table in a derived table for USING
+    and FULL joins) so outer joins stay outer, and clamps LIMIT or FETCH FIRST
+    to `max_rows + 1` (one past the pager's row cap, so a capped result is
+    still reported as "more than").
+
+    `enter` prepares the connection a query is about to run on: the
+    transaction is made read-only with a local `statement_timeout`, and the
+    planner's estimated cost and row count for the query are checked against
+    `max_cost` and `max_plan_rows` before anything executes.
+    """
+
+    def __init__(self, max_rows: int = None, max_cost: float = None, max_plan_rows: float = None,
+                 statement_timeout_ms: int = None, soft_delete_tables=TABLES):
+        self.max_rows = max_rows or int(os.environ.get("RESULT_MAX_ROWS", 100000))
+        self.max_cost = max_cost or float(os.environ.get("SQL_GUARD_MAX_COST", 1e6))
+        self.max_plan_rows = max_plan_rows or float(os.environ.get("SQL_GUARD_MAX_PLAN_ROWS", 1e7))
+        self.statement_timeout_ms = statement_timeout_ms or int(
+            os.environ.get("SQL_STATEMENT_TIMEOUT_MS", 15000)
+        )
+        self.soft_delete_tables = frozenset(soft_delete_tables)
+
+    def parse(self, sql: str):
+        try:
+            statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+        except sqlglot.errors.ParseError as e:
+            raise GuardError(f"Could not parse the query: {e}") from e
+        if len(statements) != 1:
+            raise GuardError("Exactly one SQL statement is allowed")
+        tree = statements[0]
+        if not isinstance(tree, exp.Query):
+            raise GuardError("Only SELECT queries are allowed")
+        write = tree.find(*_WRITES)
+        if write is not None:
+            raise GuardError(f"Forbidden statement in query: {write.key.upper()}")
+        for select in tree.find_all(exp.Select):
+            if select.args.get("into"):
+                raise GuardError("SELECT INTO is not allowed")
+            if select.args.get("locks"):
+                raise GuardError("Row locks (FOR UPDATE/SHARE) are not allowed")
+        for func in tree.find_all(exp.Func):
+            if _function_name(func) in FORBIDDEN_FUNCTIONS:
+                raise GuardError(f"Forbidden function in query: {_function_name(func)}")
+        return tree
+
+    @staticmethod
+    def _predicates(select):
+        """WHERE and ON conditions of `select` itself, not of its subqueries."""
+        where = select.args.get("where")
+        conditions = [where.this] if where else []
+        conditions += [join.args["on"] for join in select.args.get("joins") or [] if join.args.get("on")]
+        for condition in conditions:
+            yield from condition.walk(
+                prune=lambda node: node is not condition and isinstance(node, (exp.Query, exp.Subquery))
+            )
+
+    def _filters_deleted_at(self, select, alias: str, single_source: bool) -> bool:
+        for column in self._predicates(select):
+            if not isinstance(column, exp.Column) or column.name.lower() != "deleted_at":
+                continue
+            if column.table == alias or (not column.table and single_source):
+                return True
+        return False
+
+    @staticmethod
+    def _live_rows(table):
+        """Replace `table` by a derived table of its rows that are not deleted,
+        under the same alias, for sides of outer joins that a WHERE predicate
+        would make inner and an ON clause cannot reach (USING, FULL)."""
+        base = exp.Table(this=table.this.copy(), db=table.args.get("db"))
+        live = exp.select("*").from_(base).where(exp.column("deleted_at").is_(exp.null()))
+        alias = table.args.get("alias")
+        alias = alias.copy() if alias else exp.TableAlias(this=exp.to_identifier(table.name))
+        table.replace(exp.Subquery(this=live, alias=alias))
+
+    def _soft_delete(self, select):
+        from_ = select.args.get("from_") or select.args.get("from")
+        joins = select.args.get("joins") or []
+        sources = ([from_.this] if from_ else []) + [join.this for join in joins]
+        single_source = len(sources) == 1
+
+        def predicate(table):
+            alias = table.alias_or_name
+            if table.name.lower() not in self.soft_delete_tables:
+                return None
+            if self._filters_deleted_at(select, alias, single_source):
+                return None
+            return exp.column("deleted_at", table=alias).is_(exp.null())
+
+        # a source is nullable when it is the inner side of a LEFT or FULL
+        # join, or any later join is RIGHT or FULL; a WHERE predicate on it
+        # would turn the join back into an inner one
+        for position, source in enumerate(sources):
+            if not isinstance(source, exp.Table):
+                continue
+            condition = predicate(source)
+            if condition is None:
+                continue
+            join = joins[position - 1] if position else None
+            side = join.side if join is not None else None
+            later_outer = any(later.side in ("RIGHT", "FULL") for later in joins[position:])
+            if side == "LEFT" and not join.args.get("using") and not later_outer:
+                on = join.args.get("on")
+                join.set("on", exp.and_(on, condition) if on else condition)
+            elif side in ("LEFT", "FULL") or later_outer:
+                self._live_rows(source)
+            else:
+                select.where(condition, copy=False)
+
+    def _clamp_limit(self, tree):
+        cap = self.max_rows + 1
+        limit = tree.args.get("limit")
+        if isinstance(limit, exp.Fetch):
+            # FETCH FIRST n ROWS ONLY; no count means one row
+            value = limit.args.get("count")
+            options = limit.args.get("limit_options")
+            exact = options is None or not (options.args.get("percent") or options.args.get("with_ties"))
+            if value is None and exact:
+                return
+            if isinstance(value, exp.Literal) and value.is_int and exact:
+                if int(value.this) > cap:
+                    limit.set("count", exp.Literal.number(cap))
+                return
+            # PERCENT or WITH TIES can return any number of rows
+            tree = exp.select("*").from_(tree.subquery("capped"))
+            tree.limit(cap, copy=False)
+            return tree
+        if limit is not None:
+            value = limit.expression
+            if isinstance(value, exp.Literal) and value.is_int and int(value.this) <= cap:
+                return
+        tree.limit(cap, copy=False)
+
+    def rewrite(self, sql: str) -> str:
+        """
+        Validate `sql` and return the query that should run instead.
+
+        Raises:
+            GuardError: The query is not a single read-only SELECT.
+        """
+        tree = self.parse(sql)
+        for select in list(tree.find_all(exp.Select)):
+            self._soft_delete(select)
+        tree = self._clamp_limit(tree) or tree
+        return render(tree)
+
+    def _transaction_statements(self):
+        return [
+            "SET TRANSACTION READ ONLY",
+            f"SET LOCAL statement_timeout = {int(self.statement_timeout_ms)}",
+        ]
+
+    def _check_plan(self, plan):
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        top = plan[0]["Plan"]
+        cost, rows = top["Total Cost"], top["Plan Rows"]
+        if cost > self.max_cost:
+            raise GuardError(
+                f"Query too expensive: estimated cost {cost:.0f} exceeds {self.max_cost:.0f}; "
+                "add filters or aggregate"
+            )
+        if rows > self.max_plan_rows:
+            raise GuardError(
+                f"Query too large: about {rows:.0f} rows estimated, the budget is {self.max_plan_rows:.0f}"
+            )
+
+    def enter(self, conn, sql: str, params: dict = None):
+        """Make the open transaction of `conn` read-only and time-limited, then
+        check the plan of `sql`. Must run before anything else in the transaction."""
+        for statement in self._transaction_statements():
+            conn.execute(text(statement))
+        plan = conn.execute(
+            text(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"), params or {}
+        ).scalar()
+        self._check_plan(plan)
+
+    async def aenter(self, conn, sql: str, params: dict = None):
+        """`enter` on an async connection."""
+        for statement in self._transaction_statements():
+            await conn.execute(text(statement))
+        plan = (await conn.execute(
+            text(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"), params or {}
+        )).scalar()
+        self._check_plan(plan)
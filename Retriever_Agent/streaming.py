@@ -0,0 +1,58 @@
+"""
+Incremental output of an agent run.
+
+`agent_events` streams a LangGraph agent with stream_mode ["updates",
+"messages"] and turns both streams into one sequence of events, each
+delivered the moment it happens:
+
+    ("token", str)              a piece of model text, as the LLM generates it
+    ("message", AIMessage)      a finished model turn (with its tool calls, if any)
+    ("tool_call", dict)         a tool the model asked for: name, args, id
+    ("tool_result", ToolMessage)  a tool's output; the artifact carries a
+                                  run_sql_query result
+
+Model text streamed before a turn that asks for tools is the model thinking
+aloud; the answer is the text of the last turn without tool calls.
+"""
+
+
+def _model_text(message, metadata: dict) -> str:
+    from langchain_core.messages import AIMessageChunk
+
+    if metadata.get("langgraph_node") != "model" or not isinstance(message, AIMessageChunk):
+        return ""
+    return message.text
+
+
+def _events(mode: str, chunk):
+    if mode == "messages":
+        text = _model_text(*chunk)
+        if text:
+            yield "token", text
+        return
+    for update in chunk.values():
+        if not isinstance(update, dict):
+            continue
+        for message in update.get("messages", []):
+            if message.type == "ai":
+                yield "message", message
+                for call in message.tool_calls:
+                    yield "tool_call", call
+            elif message.type == "tool":
+                yield "tool_result", message
+
+
+def agent_events(agent, messages: list, config: dict = None):
+    """
+    Run `agent` on `messages` and yield its events as they happen.
+
+    Args:
+        agent: A graph from `langchain.agents.create_agent`.
+        messages: The input messages.
+        config: Run config (callbacks, ...).
+    """
+    for mode, chunk in agent.stream(
+        {"messages": messages}, config=config, stream_mode=["updates", "messages"]
+    ):
+        yield from _events(mode, chunk)
+
@@ -1,138 +1,12 @@
-import os
+import time
+import uuid
+
 import streamlit as st
-from dotenv import load_dotenv
-from langchain_text_splitters import CharacterTextSplitter
-from glob import glob
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.tools import tool
-from sqlalchemy import create_engine, text
-from langchain_groq import ChatGroq
-from langchain.agents import create_agent
-import torch
-from typing import List, Tuple
-
-
-from sentence_transformers import SentenceTransformer
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-import torch
-
-# Manually load the SentenceTransformer model and specify the device
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model_name = "sentence-transformers/all-MiniLM-L6-v2"
-
-# Load the model manually to ensure it is on the right device
-model = SentenceTransformer(model_name, device=device)
-
-# Now initialize the HuggingFaceEmbeddings with just the model name
-embeddings = HuggingFaceEmbeddings(
-    model_name=model_name  # Pass the model name as a string
-)
-
-# If you want to handle device setting manually, you will need to use the 'model' you created
-# for additional tasks like embedding creation, but HuggingFaceEmbeddings works as expected
-# with the model name.
-
-
-
-# Explicitly set the device to cpu or cuda
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# Load environment variables
-load_dotenv()
-
-GROQ_API = os.environ.get("GROQ_API_KEY")
-DB_UNAME = os.environ.get("DB_UNAME")
-DB_PASS = os.environ.get("DB_PASS")
-
-# Setup the text splitter
-text_splitter = CharacterTextSplitter(
-    separator="###",
-    chunk_size=1000,
-    chunk_overlap=200,
-    length_function=len,
-    is_separator_regex=False,
-)
-
-# Load and split documents
-texts = []
-for file_path in glob("docs/*.txt"):
-    with open(file_path, "r") as f:
-        doc = f.read()
-
-    file_chunks = text_splitter.create_documents(
-        [doc],
-        metadatas=[{"source": file_path}]
-    )
-    texts.extend(file_chunks)
-
-# # Initialize embeddings and vector store
-# embeddings = HuggingFaceEmbeddings(
-#     model_name="sentence-transformers/all-MiniLM-L6-v2",
-#     device=device
-# )
-
-schema_store = Chroma.from_documents(
-    texts,
-    embedding=embeddings,
-    collection_name="schema_rag"
-)
-
-schema_retriever = schema_store.as_retriever(k=4)
-
-# Setup the database connection
-username = DB_UNAME
-password = DB_PASS
-db_ip = "localhost"
-db_port = "5432"
-database = "postgres"
-engine = create_engine(f"postgresql+psycopg2://{username}:{password}@{db_ip}:{db_port}/{database}")
-
-# Define tools
-@tool
-def query_vecdb(question: str) -> str:
-    """Retrieve relevant database schema based on the user question."""
-    docs = schema_retriever.invoke(question)
-    return "\n\n".join(d.page_content for d in docs)
-
-@tool
-def run_sql_query(query: str) -> str:
-    """Execute a validated read-only SQL query."""
-    with engine.connect() as conn:
-        result = conn.execute(text(query))
-        rows = result.fetchmany(5)
-        return str(rows)
-
-@tool
-def get_table_schema(table_name: str) -> List[Tuple]:
-    """Return column schema information for a table."""
-    query = """
-        SELECT column_name, data_type, is_nullable
-        FROM information_schema.columns
-        WHERE table_name = :table_name
-        ORDER BY ordinal_position
-    """
-    with engine.connect() as conn:
-        result = conn.execute(text(query), {"table_name": table_name})
-        return result.fetchall()
-
-@tool
-def list_table():
-    """Return names of tables present in the database."""
-    query = """
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema='public';
-    """
-    with engine.connect() as conn:
-        result = conn.execute(text(query))
-        return str(result.fetchall())
 
-# Initialize the LLM (language model)
-llm = ChatGroq(
-    model="meta-llama/llama-4-scout-17b-16e-instruct",
-    temperature=0
-)
+from client import agent_client
+from concurrency import Busy
+from resources import Resources, get_resources
+from tracing import get_tracer
 
 # System prompt configuration
 SYSTEM_PROMPT = """
@@ -163,40 +37,219 @@ After writing the SQL:
 - If there's an error rework on it
 """
 
-# Create the agent
-agent = create_agent(
-    llm,
-    tools=[
-        query_vecdb,
-        get_table_schema,
-        list_table,
-        run_sql_query,
-    ],
-    system_prompt=SYSTEM_PROMPT,
-)
+
+def build_agent(resources: Resources):
+    """Create the agent and its tools on top of the shared resources."""
+    from langchain_core.tools import tool
+    from langchain.agents import create_agent
+    from agent_core import SQLAgent
+    from context_budget import middleware, summarize_result
+    from schema_catalog import catalog_tools
+
+    schema_retriever = resources.retriever
+    # queries take the same path as SQLAgent's: guard, rollups, result cache, pager
+    sql_agent = SQLAgent(resources=resources)
+
+    # Define tools
+    @tool
+    def query_vecdb(question: str) -> str:
+        """Retrieve relevant database schema based on the user question."""
+        with get_tracer().span("retrieval") as span:
+            docs = schema_retriever.invoke(question)
+            context = "\n\n".join(d.page_content for d in docs)
+            span.set(**{"retrieval.documents": len(docs), "retrieval.chars": len(context)})
+        return context
+
+    @tool(response_format="content_and_artifact")
+    def run_sql_query(query: str):
+        """Execute a validated read-only SQL query and return the total row count, columns and first rows."""
+        try:
+            # the page selector below fetches later pages from the open cursor
+            result = sql_agent.execute(query, keep_open=True)
+        except Exception as e:
+            return f"Error executing query: {e}", None
+        return summarize_result(result), result
+
+    return create_agent(
+        resources.llm("meta-llama/llama-4-scout-17b-16e-instruct"),
+        tools=[
+            query_vecdb,
+            run_sql_query,
+            *catalog_tools(resources.catalog),
+        ],
+        system_prompt=SYSTEM_PROMPT,
+        middleware=[middleware()],
+    )
+
+
+def show_rows(element, rows: list, chunk: int = 500):
+    """Show `rows` in a dataframe, the first `chunk` right away and the rest appended."""
+    table = element.dataframe(rows[:chunk])
+    for start in range(chunk, len(rows), chunk):
+        table.add_rows(rows[start:start + chunk])
+    return table
+
+
+def stream_answer(agent, question: str, config: dict) -> dict:
+    """
+    Run the agent and render it as it goes: each tool call and tool result
+    in a status panel the moment it happens, query results as tables, and the
+    answer token by token.
+
+    Returns:
+        A dict with `answer`, `sql` and `result` of the last query run, like
+        `SQLAgent.ask`.
+    """
+    from streaming import agent_events
+
+    started = time.perf_counter()
+    status = st.status("Reading the question...", expanded=True)
+    answer_box = st.empty()
+    text, answer, result = "", "", None
+    for kind, payload in agent_events(agent, [{"role": "user", "content": question}], config):
+        elapsed = time.perf_counter() - started
+        if kind == "token":
+            text += payload
+            answer_box.markdown(text + "▌")
+        elif kind == "message":
+            if payload.tool_calls:
+                # text before a tool call is the model thinking aloud
+                if text:
+                    status.markdown(text)
+                text = ""
+                answer_box.empty()
+            else:
+                answer = payload.text
+        elif kind == "tool_call":
+            status.update(label=f"Running {payload['name']}...")
+            status.markdown(f"**+{elapsed:.2f} s** `{payload['name']}` {payload['args']}")
+        elif kind == "tool_result":
+            artifact = getattr(payload, "artifact", None)
+            if artifact:
+                result = st.session_state["result"] = artifact
+                status.markdown(f"**+{elapsed:.2f} s** `{payload.name}`: {artifact['total_rows']} rows")
+                show_rows(status, artifact["rows"])
+            else:
+                status.markdown(f"**+{elapsed:.2f} s** `{payload.name}` returned")
+                status.text(str(payload.content)[:1000])
+            status.update(label="Writing the answer...")
+    answer = answer or text
+    answer_box.markdown(answer)
+    status.update(
+        label=f"Done in {time.perf_counter() - started:.2f} s", state="complete", expanded=False
+    )
+    return {"answer": answer, "sql": result["sql"] if result else None, "result": result}
+
+
+def show_waterfall(root):
+    """Chart every span of a question's trace on a shared time axis."""
+    depth = {root.span_id: 0}
+    rows = []
+    for span in root.children:
+        depth[span.span_id] = depth.get(span.parent_id, 0) + 1
+        rows.append({
+            "step": f"{len(rows) + 1:02d} " + "  " * (depth[span.span_id] - 1) + span.name,
+            "start_ms": (span.start_ns - root.start_ns) / 1e6,
+            "end_ms": (span.end_ns - root.start_ns) / 1e6,
+            "duration_ms": round(span.duration_ms, 1),
+            "tokens": sum(
+                span.attributes.get(k) or 0 for k in ("llm.input_tokens", "llm.output_tokens")
+            ) or None,
+            "rows": span.attributes.get("db.rows"),
+            "error": span.error,
+        })
+    if not rows:
+        return
+    import altair as alt
+
+    st.markdown(f"### Timing ({root.duration_ms / 1000:.2f} s)")
+    chart = alt.Chart(alt.Data(values=rows)).mark_bar().encode(
+        x=alt.X("start_ms:Q", title="ms since question"),
+        x2="end_ms:Q",
+        y=alt.Y("step:N", sort=None, title=None),
+        color=alt.condition("datum.error", alt.value("#d62728"), alt.value("#1f77b4")),
+        tooltip=["step:N", "duration_ms:Q", "tokens:Q", "rows:Q", "error:N"],
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+
+def ask_server(client, question: str):
+    """Ask server.py and show the answer and the first rows of its result."""
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    try:
+        with st.spinner("Asking the agent server..."):
+            answer = client.ask(question, session_id)
+    except Busy:
+        st.warning("The assistant is busy right now, please try again in a moment.")
+        return
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return
+    st.markdown(answer["answer"])
+    if answer["result"]:
+        st.session_state["result"] = answer["result"]
+        show_rows(st, answer["result"]["rows"])
+
+
+# With AGENT_SERVER_URL set this page is a thin client of server.py and loads
+# nothing heavy. Otherwise everything heavy lives in the process-wide resource
+# cache, so a rerun only pays for a fingerprint check of docs/ and .env. The
+# page renders right away while the embedder, vector store and catalog load
+# on a background thread.
+client = agent_client()
+if client is None:
+    resources = get_resources()
+    resources.refresh_if_changed()
+    resources.get("warm_up", resources.warm_up)
 
 # Streamlit UI
 st.title("PostgreSQL Database Assistant")
 
+with st.sidebar:
+    if client is None and st.button("Reload docs and config"):
+        resources.invalidate()
+        st.rerun()
+
 question = st.text_area("Ask your SQL-related question:")
 
 if st.button("Submit"):
-    if question:
-        with st.spinner("Processing your query..."):
-            intermediate_output = []
-            for step in agent.stream(
-                {"messages": [{"role": "user", "content": question}]},
-                stream_mode="values",
-            ):
-                intermediate_output.append(step["messages"][-1].content)
-            
-            # Display intermediate outputs
-            for idx, output in enumerate(intermediate_output):
-                st.markdown(f"### Step {idx + 1}")
-                st.write(output)
-
-            # Final result (last step output)
-            st.markdown("### Final Result:")
-            st.write(intermediate_output[-1])
+    if question and client is not None:
+        ask_server(client, question)
+    elif question:
+        # one in-flight slot per question, shared by every session of the process
+        tracer = get_tracer()
+        agent = resources.get("streamlit_agent", lambda: build_agent(resources), depends=(
+            "retriever", "catalog", "llm:meta-llama/llama-4-scout-17b-16e-instruct"))
+        session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+        root = answer = None
+        try:
+            with resources.limiter.slot():
+                try:
+                    # steps and the answer render while the agent runs, not after it
+                    with tracer.trace("streamlit.ask", question=question, **{"session.id": session_id}) as root:
+                        answer = stream_answer(agent, question, {"callbacks": [tracer.callback_handler()]})
+                        root.set(**{"db.statement": answer["sql"]})
+                finally:
+                    resources.query_log.record(root, answer)
+        except Busy:
+            st.warning("The assistant is busy right now, please try again in a moment.")
+        else:
+            show_waterfall(root)
     else:
         st.warning("Please enter a question.")
+
+# Page through the last query result on its open server-side cursor
+result = st.session_state.get("result")
+if result and result["cursor_id"]:
+    pager = resources.pager
+    st.markdown(f"### Full result ({result['total_rows']} rows)")
+    page = st.number_input(
+        "Page", min_value=1, max_value=-(-result["total_rows"] // pager.page_size), value=1
+    )
+    if page == 1:
+        show_rows(st, result["rows"])
+    else:
+        try:
+            show_rows(st, pager.fetch(result["cursor_id"], page - 1)["rows"])
+        except KeyError:
+            st.info("This result expired; ask the question again to page through it.")
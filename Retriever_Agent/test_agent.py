@@ -1,9 +1,12 @@
 import asyncio
-from agent_core import SQLAgent
+from client import agent_client
 
 async def main():
-    # Initialize the agent
-    sql_agent = SQLAgent()
+    # Ask the server when AGENT_SERVER_URL is set, otherwise a local agent
+    sql_agent = agent_client()
+    if sql_agent is None:
+        from agent_core import SQLAgent
+        sql_agent = SQLAgent()
 
     # Test cases
     test_questions = [
@@ -17,13 +20,17 @@ async def main():
         "List all branches and their locations."
     ]
 
-    for question in test_questions:
+    # Ask every question concurrently through the async path
+    responses = await asyncio.gather(
+        *(sql_agent.ainvoke(question) for question in test_questions)
+    )
+
+    for question, response in zip(test_questions, responses):
         print(f"\n--- Testing question: {question} ---")
-        
-        # Get the agent's response
-        response = sql_agent.invoke(question)
-        
         print(f"Agent response:\n{response}")
 
+    if hasattr(sql_agent, "cache_stats"):
+        print(f"\n--- Cache stats: {sql_agent.cache_stats()} ---")
+
 if __name__ == "__main__":
     asyncio.run(main())
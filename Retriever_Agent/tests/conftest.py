@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules under test are flat files next to this directory, imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
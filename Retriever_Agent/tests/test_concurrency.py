@@ -0,0 +1,61 @@
+import asyncio
+import gc
+import threading
+
+import pytest
+
+from concurrency import Busy, RequestLimiter
+
+
+def test_sync_and_async_share_the_limit():
+    limiter = RequestLimiter(limit=1, timeout=0.2)
+
+    async def ask():
+        async with limiter.aslot():
+            pass
+
+    with limiter.slot():
+        with pytest.raises(Busy):
+            asyncio.run(ask())
+    asyncio.run(ask())
+    assert limiter.in_flight == 0
+
+
+def test_async_waiter_wakes_when_a_thread_releases():
+    limiter = RequestLimiter(limit=1, timeout=5)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with limiter.slot():
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+
+    async def ask():
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        async with limiter.aslot():
+            return limiter.in_flight
+
+    assert asyncio.run(ask()) == 1
+    thread.join()
+
+
+def test_loops_are_forgotten_after_waiting():
+    limiter = RequestLimiter(limit=1, timeout=5)
+
+    async def ask():
+        async with limiter.aslot():
+            await asyncio.sleep(0.01)
+
+    async def crowd():
+        await asyncio.gather(*(ask() for _ in range(3)))
+
+    for _ in range(3):
+        asyncio.run(crowd())
+    gc.collect()
+    assert len(limiter._loops) == 0
+    assert limiter.in_flight == 0
@@ -0,0 +1,125 @@
+import pytest
+
+from index_advisor import access_patterns, candidates, ddl, measured_saving, seq_scans
+
+COLUMNS_OF = {
+    "branches": ["branch_id", "branch_name", "deleted_at"],
+    "customers": ["customer_id", "full_name", "branch_id", "kyc_status", "deleted_at"],
+    "loans": ["loan_id", "customer_id", "branch_id", "principal", "status", "disbursed_at", "deleted_at"],
+    "repayments": ["repayment_id", "loan_id", "due_date", "paid_date", "amount_due", "deleted_at"],
+}
+
+OVERDUE = """
+    SELECT l.loan_id, r.due_date, r.amount_due
+    FROM repayments r
+    JOIN loans l ON l.loan_id = r.loan_id
+    WHERE r.paid_date IS NULL AND r.due_date < CURRENT_DATE
+      AND r.deleted_at IS NULL AND l.deleted_at IS NULL
+"""
+
+
+def patterns_by_table(sql):
+    return {pattern["table"]: pattern for pattern in access_patterns(sql, COLUMNS_OF)}
+
+
+@pytest.mark.parametrize("sql, table, role, columns", [
+    # join keys on both sides of the ON
+    (OVERDUE, "repayments", "join", ["loan_id"]),
+    (OVERDUE, "loans", "join", ["loan_id"]),
+    # IS NULL on an ordinary column is an equality, a comparison with a value a range
+    (OVERDUE, "repayments", "eq", ["paid_date"]),
+    (OVERDUE, "repayments", "range", ["due_date"]),
+    # unqualified columns are placed by the table that has them
+    ("SELECT COUNT(*) FROM loans l JOIN branches b ON b.branch_id = l.branch_id "
+     "WHERE status = 'ACTIVE' AND principal BETWEEN 1 AND 2", "loans", "eq", ["status"]),
+    ("SELECT COUNT(*) FROM loans l JOIN branches b ON b.branch_id = l.branch_id "
+     "WHERE status = 'ACTIVE' AND principal BETWEEN 1 AND 2", "loans", "range", ["principal"]),
+    ("SELECT * FROM customers WHERE kyc_status IN ('PENDING', 'REJECTED')", "customers", "eq", ["kyc_status"]),
+])
+def test_access_patterns(sql, table, role, columns):
+    assert patterns_by_table(sql)[table][role] == columns
+
+
+def test_deleted_at_is_null_marks_the_pattern_live():
+    patterns = patterns_by_table(OVERDUE)
+    assert patterns["repayments"]["live"] and patterns["loans"]["live"]
+    assert "deleted_at" not in patterns["repayments"]["eq"]
+    assert not patterns_by_table("SELECT * FROM loans l WHERE l.status = 'ACTIVE'")["loans"]["live"]
+
+
+def test_unparsable_sql_has_no_patterns():
+    assert access_patterns("SELECT FROM WHERE", COLUMNS_OF) == []
+
+
+def pattern(**overrides):
+    found = {"table": "repayments", "eq": [], "range": [], "join": [], "live": False, "used": set()}
+    found.update(overrides)
+    return found
+
+
+@pytest.mark.parametrize("found, expected", [
+    # equalities first, then one range column, then one index per join key
+    (pattern(eq=["paid_date"], range=["due_date", "amount_due"], join=["loan_id"], live=True,
+             used={"paid_date", "due_date", "amount_due", "loan_id", "deleted_at"}),
+     ["CREATE INDEX ON repayments (paid_date, due_date) INCLUDE (amount_due, loan_id) WHERE deleted_at IS NULL",
+      "CREATE INDEX ON repayments (loan_id) INCLUDE (amount_due, due_date, paid_date) WHERE deleted_at IS NULL"]),
+    # deleted_at read but not filtered on: an index-only scan would need it, so no INCLUDE
+    (pattern(eq=["paid_date"], used={"paid_date", "amount_due", "deleted_at"}),
+     ["CREATE INDEX ON repayments (paid_date)"]),
+    # too many other columns to cover
+    (pattern(join=["loan_id"], used={"loan_id", "a", "b", "c", "d", "e"}),
+     ["CREATE INDEX ON repayments (loan_id)"]),
+    (pattern(join=["loan_id"], used={"loan_id", "a", "b", "c", "d"}),
+     ["CREATE INDEX ON repayments (loan_id) INCLUDE (a, b, c, d)"]),
+])
+def test_candidates(found, expected):
+    assert [ddl(candidate, hypothetical=True) for candidate in candidates(found)] == expected
+
+
+PLAN = {
+    "Node Type": "Hash Join",
+    "Actual Rows": 50,
+    "Actual Loops": 1,
+    "Hash Cond": "(r.loan_id = l.loan_id)",
+    "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "repayments", "Actual Rows": 100, "Actual Loops": 1,
+         "Actual Total Time": 40.0, "Rows Removed by Filter": 9900,
+         "Filter": "((paid_date IS NULL) AND (due_date < CURRENT_DATE))",
+         "Shared Hit Blocks": 30, "Shared Read Blocks": 12},
+        {"Node Type": "Hash", "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "loans", "Actual Rows": 1000, "Actual Loops": 1,
+             "Actual Total Time": 5.0, "Filter": "(deleted_at IS NULL)"},
+        ]},
+    ],
+}
+
+
+def test_seq_scans_reads_rows_time_and_join():
+    scan, = seq_scans(PLAN, "repayments")
+    assert scan["scanned"] == 10000 and scan["kept"] == 100 and scan["joined"] == 50
+    assert scan["ms"] == 40.0 and scan["blocks"] == 42
+    assert scan["condition"].strip() == "(r.loan_id = l.loan_id)"
+    assert seq_scans(PLAN, "customers") == []
+
+
+def candidate(kind, keys, covering=False):
+    return {"table": "repayments", "kind": kind, "keys": keys, "include": [], "covering": covering,
+            "partial": False}
+
+
+@pytest.mark.parametrize("priced, table, expected", [
+    # 100 of 10000 rows kept, each at INDEX_ROW_COST: 40 ms * (1 - 4 * 0.01)
+    (candidate("filter", ["paid_date"]), "repayments", 38.4),
+    (candidate("filter", ["paid_date"], covering=True), "repayments", 39.6),
+    # the filter does not mention the key
+    (candidate("filter", ["amount_due"]), "repayments", 0.0),
+    # a join index fetches the 50 joined rows
+    (candidate("join", ["loan_id"]), "repayments", 39.2),
+    # 50 of 1000 loans joined: 5 ms * (1 - 4 * 0.05)
+    (candidate("join", ["loan_id"]), "loans", 4.0),
+    # the filter keeps every row: fetching them by index costs more than the scan
+    (candidate("filter", ["deleted_at"]), "loans", 0.0),
+])
+def test_measured_saving(priced, table, expected):
+    scans = seq_scans(PLAN, table)
+    assert measured_saving(priced, scans) == pytest.approx(expected)
@@ -0,0 +1,79 @@
+import pytest
+
+from intent_router import IntentRouter
+
+
+class SameEmbeddings:
+    """Every text gets the same vector, so routing rests on the rule checks."""
+
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(SameEmbeddings())
+
+
+@pytest.mark.parametrize("question", [
+    # the templates have no branch filter / no date filter for these
+    "how many customers in branch_1",
+    "which customers have pending kyc in branch_2",
+    "total deposits in the last 3 months",
+    "how many inactive customers in branch_4",
+    "top 5 overdue loans",
+    # the templates filter on one branch
+    "total deposits in branch 1 and branch 2",
+    # a single row, not the top branch by SUM
+    "What is the highest balance?",
+    "what is the max loan amount",
+    "highest deposit account",
+    # counts the SUM templates and the repayment rows cannot answer
+    "total number of loans",
+    "count of loans per branch",
+    "how many customers have overdue repayments",
+    "how many active customers",
+])
+def test_rejects_questions_the_template_cannot_answer(router, question):
+    assert router.route(question) is None
+
+
+def test_branch_ranking(router):
+    routed = router.route("which branch has the highest deposits")
+    assert routed["intent"] == "branch_deposits"
+    assert routed["params"] == {"limit": 1}
+
+
+def test_customer_count(router):
+    routed = router.route("How many customers are there?")
+    assert routed["intent"] == "customer_count"
+    assert routed["params"] == {}
+
+
+def test_branch_deposits_filters_branch(router):
+    routed = router.route("total deposits in branch_1")
+    assert routed["intent"] == "branch_deposits"
+    assert routed["params"] == {"branch": "Branch_1"}
+    assert ":branch" in routed["sql"]
+
+
+def test_branch_loans_filters_dates(router):
+    routed = router.route("total loan amount in branch_3 in the last 3 months")
+    assert routed["intent"] == "branch_loans"
+    assert set(routed["params"]) == {"branch", "start", "end"}
+    assert ":start" in routed["sql"] and ":branch" in routed["sql"]
+
+
+def test_loan_delinquency_filters_branch(router):
+    routed = router.route("how many repayments are overdue in branch_2")
+    assert routed["intent"] == "loan_delinquency"
+    assert routed["params"] == {"branch": "Branch_2"}
+
+
+def test_branch_customers_limit(router):
+    routed = router.route("top 3 branches by customers")
+    assert routed["intent"] == "branch_customers"
+    assert routed["params"] == {"limit": 3}
@@ -0,0 +1,50 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from output_formatter import format_inr, markdown_table, scalar_sentence
+
+
+def test_format_inr_lakh_grouping():
+    assert format_inr(Decimal("1234567.891")) == "Rs. 12,34,567.89 (12.35 lakh)"
+
+
+@pytest.mark.parametrize("question, value, expected", [
+    ("How many customers are there?", 120, "There are 120 customers."),
+    ("How many customers are there?", 1, "There is 1 customer."),
+    ("How many loans are overdue?", 4, "4 loans are overdue."),
+    ("How many loans does branch_3 have?", 4, "Branch_3 has 4 loans."),
+    ("How many loans does branch_3 have?", 1, "Branch_3 has 1 loan."),
+    ("how many accounts do customers in branch_1 have", 12, "Customers in branch_1 have 12 accounts."),
+    ("How many loans did branch_2 have in 2024?", 7, "Branch_2 had 7 loans in 2024."),
+])
+def test_count_sentences(question, value, expected):
+    assert scalar_sentence(question, "count", value, "SELECT COUNT(*) FROM loans") == expected
+
+
+def test_count_with_other_auxiliary_verb_is_left_to_the_llm():
+    assert scalar_sentence("How many loans does branch_3 hold?", "count", 4, "SELECT COUNT(*) FROM loans") is None
+
+
+@pytest.mark.parametrize("value", [date(2024, 1, 2), datetime(2024, 1, 2, 10, 30)])
+def test_date_extremes_are_left_to_the_llm(value):
+    for aggregate in ("MIN", "MAX"):
+        sql = f"SELECT {aggregate}(disbursed_at) FROM loans"
+        assert scalar_sentence("When was the latest loan disbursed?", aggregate.lower(), value, sql) is None
+
+
+def test_money_sum():
+    sentence = scalar_sentence(
+        "What is the total deposits in branch_1?", "total_deposits", Decimal("250000"),
+        "SELECT SUM(a.balance) AS total_deposits FROM accounts a",
+    )
+    assert sentence == "The total deposits in branch_1 is Rs. 2,50,000.00 (2.50 lakh)."
+
+
+def test_markdown_table_caps_rows():
+    rows = [{"loan_id": i, "principal": Decimal("100000")} for i in range(3)]
+    table = markdown_table(rows, total_rows=10, max_rows=2)
+    assert table.splitlines()[1] == "| ---: | ---: |"
+    assert "1,00,000.00" in table
+    assert table.endswith("Showing 2 of 10 rows.")
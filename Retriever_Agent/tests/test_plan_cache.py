@@ -0,0 +1,22 @@
+import os
+
+import plan_cache
+from plan_cache import schema_version
+
+
+def test_schema_version_reads_files_only_when_they_change(tmp_path, monkeypatch):
+    doc = tmp_path / "schema.txt"
+    doc.write_text("loans(loan_id, principal)")
+    pattern = (str(tmp_path / "*.txt"),)
+    first = schema_version(pattern)
+
+    reads = []
+    real_open = open
+    monkeypatch.setattr(plan_cache, "open", lambda *a, **k: reads.append(a[0]) or real_open(*a, **k), raising=False)
+    assert schema_version(pattern) == first
+    assert reads == []
+
+    doc.write_text("loans(loan_id, principal, status)")
+    os.utime(doc, ns=(1, 1))
+    assert schema_version(pattern) != first
+    assert reads == [str(doc)]
@@ -0,0 +1,93 @@
+from resources import Resources
+
+
+class Closeable:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+    def close_all(self):
+        self.closed += 1
+
+    def dispose(self):
+        self.closed += 1
+
+
+def make_resources(tmp_path):
+    return Resources(docs_glob=str(tmp_path / "docs" / "*.txt"), env_file=str(tmp_path / ".env"))
+
+
+def test_invalidate_shuts_down_what_it_drops(tmp_path):
+    resources = make_resources(tmp_path)
+    owned = {name: resources.get(name, Closeable) for name in ("rollups", "query_log", "pager", "db")}
+    plain = resources.get("guard", Closeable)
+
+    resources.invalidate()
+
+    assert all(value.closed == 1 for value in owned.values())
+    # objects without threads or connections are left to garbage collection
+    assert plain.closed == 0
+    assert resources.get("rollups", Closeable) is not owned["rollups"]
+
+
+def test_invalidate_by_name_only_shuts_down_those(tmp_path):
+    resources = make_resources(tmp_path)
+    rollups = resources.get("rollups", Closeable)
+    pager = resources.get("pager", Closeable)
+
+    resources.invalidate("pager", "never_built")
+
+    assert pager.closed == 1
+    assert rollups.closed == 0
+    assert resources.get("rollups", Closeable) is rollups
+
+
+def test_refresh_shuts_down_on_config_change(tmp_path, monkeypatch):
+    resources = make_resources(tmp_path)
+    query_log = resources.get("query_log", Closeable)
+    assert resources.refresh_if_changed() is False
+
+    monkeypatch.setenv("DB_NAME", "elsewhere")
+
+    assert resources.refresh_if_changed() is True
+    assert query_log.closed == 1
+
+
+def test_invalidate_drops_dependents(tmp_path):
+    resources = make_resources(tmp_path)
+    db = resources.get("db", Closeable)
+    engine = resources.get("engine", object, depends=("db",))
+    pager = resources.get("pager", Closeable, depends=("engine", "guard"))
+    guard = resources.get("guard", object)
+
+    resources.invalidate("db")
+
+    assert db.closed == 1 and pager.closed == 1
+    assert resources.get("engine", object, depends=("db",)) is not engine
+    assert resources.get("guard", object) is guard
+
+
+def test_lazy_property_follows_invalidation(tmp_path):
+    from resources import lazy_property
+
+    class Agent:
+        def __init__(self, resources):
+            self.resources = resources
+
+        @lazy_property(depends=("retriever",))
+        def retriever(self):
+            return self.resources.get("retriever", object, depends=("schema_index",))
+
+    resources = make_resources(tmp_path)
+    agent = Agent(resources)
+    first = agent.retriever
+    assert agent.retriever is first
+    resources.invalidate("schema_index")
+    assert agent.retriever is not first
+
+    pinned = object()
+    agent.retriever = pinned
+    resources.invalidate("retriever")
+    assert agent.retriever is pinned
@@ -0,0 +1,103 @@
+import warnings
+
+from result_cache import ResultCache, normalize_sql, tables_in
+
+
+def test_tables_in_comma_join():
+    sql = "SELECT * FROM loans l, repayments r WHERE l.loan_id = r.loan_id"
+    assert tables_in(sql) == {"loans", "repayments"}
+
+
+def test_tables_in_subquery_and_schema_prefix():
+    sql = """
+        SELECT c.full_name FROM customers c
+        WHERE c.branch_id IN (SELECT branch_id FROM public.branches WHERE name = :branch)
+    """
+    assert tables_in(sql) == {"customers", "branches"}
+
+
+def test_tables_in_cte_keeps_base_tables_only():
+    sql = """
+        WITH recent AS (SELECT * FROM accounts WHERE opened_at > :start)
+        SELECT count(*) FROM recent JOIN audit_log a ON a.id = recent.account_id
+    """
+    assert tables_in(sql) == {"accounts"}
+
+
+def test_tables_in_unparseable_is_empty():
+    assert tables_in("SELECT FROM WHERE (") == frozenset()
+
+
+def test_normalize_sql_keeps_literals():
+    normalized = normalize_sql("  SELECT  *\nFROM Loans WHERE status = 'Active' ; ")
+    assert normalized == normalize_sql("select * from loans where status = 'Active'")
+    assert "'Active'" in normalized and not normalized.endswith(";")
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        self.engine.statements.append(str(statement))
+        return FakeResult(self.engine.rows)
+
+
+class FakeEngine:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+def test_updated_at_probe_skips_unindexed_tables():
+    engine = FakeEngine(rows=[("loans",)])
+    cache = ResultCache(engine, probe="updated_at")
+    calls = []
+
+    def execute():
+        calls.append(1)
+        return [(1,)]
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        assert cache.fetch("SELECT count(*) FROM customers", execute, {}) == [(1,)]
+        assert cache.fetch("SELECT count(*) FROM customers", execute, {}) == [(1,)]
+
+    # executed both times, without a cache lookup; the index check ran once
+    assert len(calls) == 2
+    assert cache.hits == cache.misses == 0
+    assert len(engine.statements) == 1
+    assert sum("No index on updated_at" in str(w.message) for w in caught) == 1
+
+
+def test_updated_at_probe_has_no_table_scan():
+    engine = FakeEngine(rows=[("loans", None)])
+    cache = ResultCache(engine, probe="updated_at")
+    cache._probe({"loans"})
+    assert "count(" not in engine.statements[-1].lower()
+
+
+def test_clear_empties_entries_and_counters():
+    cache = ResultCache(FakeEngine(), probe="stats")
+    cache.put("SELECT 1 FROM loans", {}, [(1,)], {"loans": 1})
+    cache.hits = cache.misses = 3
+    cache.clear()
+    assert cache.stats()["size"] == 0
+    assert cache.hits == cache.misses == 0
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool, QueuePool
+
+from result_stream import ResultPager, pool_capacity
+
+
+def queue_engine(tmp_path, pool_size=5, max_overflow=10):
+    return create_engine(f"sqlite:///{tmp_path / 'pager.db'}", poolclass=QueuePool,
+                         pool_size=pool_size, max_overflow=max_overflow)
+
+
+def test_cursor_cap_stays_below_pool_capacity(tmp_path, monkeypatch):
+    monkeypatch.delenv("RESULT_MAX_OPEN_CURSORS", raising=False)
+    engine = queue_engine(tmp_path)
+    assert pool_capacity(engine) == 15
+    assert ResultPager(engine).max_open == 13
+    # a configured cap above what the pool can hold is lowered
+    assert ResultPager(engine, max_open=16).max_open == 13
+    assert ResultPager(engine, max_open=4).max_open == 4
+
+
+def test_unbounded_pool_keeps_the_configured_cap(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pager.db'}", poolclass=NullPool)
+    assert pool_capacity(engine) is None
+    assert ResultPager(engine, max_open=16).max_open == 16
+
+
+def test_full_pool_closes_the_oldest_idle_cursor(tmp_path):
+    engine = queue_engine(tmp_path, pool_size=2, max_overflow=0)
+    pager = ResultPager(engine)
+    busy = {"conn": engine.connect(), "name": "busy", "lock": threading.Lock(), "used": time.monotonic(),
+            "total_rows": 10}
+    idle = {"conn": engine.connect(), "name": "idle", "lock": threading.Lock(), "used": time.monotonic(),
+            "total_rows": 10}
+    busy["lock"].acquire()
+    pager._cursors.update(busy=busy, idle=idle)
+
+    pager._make_room()
+
+    assert list(pager._cursors) == ["busy"]
+    assert engine.pool.checkedout() == 1
+    busy["lock"].release()
+    pager.close_all()
+
+
+class FakeResult:
+    def __init__(self, rowcount=0, rows=()):
+        self.rowcount, self._rows = rowcount, list(rows)
+
+    def keys(self):
+        return ["n"]
+
+    def mappings(self):
+        return iter(self._rows)
+
+
+class FakeConnection:
+    """Answers the pager's cursor statements for a result of `total` rows."""
+
+    def __init__(self, total):
+        self.total, self.closed = total, False
+
+    def begin(self):
+        pass
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        if sql.startswith("MOVE FORWARD"):
+            return FakeResult(rowcount=self.total)
+        if sql.startswith("FETCH"):
+            return FakeResult(rows=[{"n": i} for i in range(min(self.total, int(sql.split()[2])))])
+        return FakeResult()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEngine:
+    def __init__(self, total):
+        self.total, self.connections = total, []
+
+    def connect(self):
+        self.connections.append(FakeConnection(self.total))
+        return self.connections[-1]
+
+
+def test_cursor_is_kept_only_for_paging_callers():
+    engine = FakeEngine(total=250)
+    pager = ResultPager(engine, page_size=100, max_open=4)
+
+    result = pager.open("SELECT n FROM t")
+    assert result["cursor_id"] is None and result["total_rows"] == 250
+    assert engine.connections[-1].closed and not pager._cursors
+
+    result = pager.open("SELECT n FROM t", keep_open=True)
+    assert list(pager._cursors) == [result["cursor_id"]]
+    assert not engine.connections[-1].closed
+    pager.close_all()
+
+
+def test_eviction_on_open_skips_cursors_serving_a_page():
+    engine = FakeEngine(total=250)
+    pager = ResultPager(engine, page_size=100, max_open=1)
+    busy = pager.open("SELECT n FROM t", keep_open=True)["cursor_id"]
+    pager._cursors[busy]["lock"].acquire()
+
+    # the only other cursor is the new one, so it is closed instead
+    result = pager.open("SELECT n FROM t", keep_open=True)
+    assert result["cursor_id"] is None and len(result["rows"]) == 100
+    assert list(pager._cursors) == [busy]
+    assert engine.connections[-1].closed and not engine.connections[0].closed
+
+    pager._cursors[busy]["lock"].release()
+    idle = pager.open("SELECT n FROM t", keep_open=True)["cursor_id"]
+    assert list(pager._cursors) == [idle] and engine.connections[0].closed
+    pager.close_all()
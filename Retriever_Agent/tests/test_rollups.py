@@ -0,0 +1,50 @@
+import json
+
+import sqlglot
+from sqlglot import exp
+
+from rollups import ROLLUPS, Rollups
+
+BRANCHWISE_LOANS = """
+    SELECT b.branch_name,
+           COUNT(*) FILTER (WHERE l.status = 'ACTIVE') AS active_loans,
+           COUNT(*) FILTER (WHERE l.status = 'CLOSED') AS closed_loans
+    FROM branches b
+    JOIN loans l ON l.branch_id = b.branch_id
+    WHERE l.deleted_at IS NULL AND b.deleted_at IS NULL
+    GROUP BY b.branch_name
+    ORDER BY b.branch_name
+"""
+
+
+def fresh_rollups():
+    """Rollups whose views all exist and are as fresh as their tables."""
+    rollups = Rollups(engine=None, watermarks=lambda tables: {table: 1 for table in tables}, refresh_interval=0)
+    rollups._marks = {rollup["name"]: json.dumps(1) for rollup in ROLLUPS}
+    return rollups
+
+
+def test_filtered_count_moves_filter_inside_sum():
+    name, sql = fresh_rollups().match(BRANCHWISE_LOANS)
+    assert name == "rollup_loans_by_branch"
+    tree = sqlglot.parse_one(sql, read="postgres")
+    filters = list(tree.find_all(exp.Filter))
+    assert len(filters) == 2
+    # FILTER may only follow an aggregate call
+    assert all(isinstance(f.this, exp.Sum) for f in filters)
+    assert "COALESCE(SUM(l.row_count) FILTER(WHERE l.status = 'ACTIVE'), 0)" in sql
+    assert "rollup_loans_by_branch AS l" in sql
+
+
+def test_filtered_average_filters_both_sums():
+    sql = fresh_rollups().rewrite(
+        "SELECT AVG(l.principal) FILTER (WHERE l.status = 'ACTIVE') FROM loans l WHERE l.deleted_at IS NULL"
+    )
+    assert sql.count("FILTER(WHERE l.status = 'ACTIVE')") == 2
+    assert sql.endswith("AS avg FROM rollup_loans_by_branch AS l")
+
+
+def test_unfiltered_rows_are_not_rewritten():
+    # without deleted_at IS NULL the query counts rows the rollup left out
+    sql = "SELECT COUNT(*) FROM loans l"
+    assert fresh_rollups().rewrite(sql) == sql
@@ -0,0 +1,92 @@
+import pytest
+
+from sessions import SessionStore, follow_up_kind, narrow_to_branch
+
+
+@pytest.mark.parametrize("question, kind", [
+    ("show it in a table format", "table"),
+    ("as a table", "table"),
+    ("put those rows in a grid", "table"),
+    ("show me the sql", "sql"),
+    ("what query did you run?", "sql"),
+    ("only branch_1", "branch"),
+    ("just for branch_2 please", "branch"),
+    ("what about branch_4?", "branch"),
+    ("what about loans?", "refine"),
+    ("sort those by balance", "refine"),
+    ("break that down by branch", "refine"),
+    ("same for last year", "refine"),
+    # questions of their own
+    ("show me the accounts table", None),
+    ("list rows in the loans table", None),
+    ("How many customers have loans that are overdue?", None),
+    ("Show customers who opened accounts this year", None),
+    ("in branch_3 how many loans", None),
+    ("How many customers are there?", None),
+])
+def test_follow_up_kind(question, kind):
+    assert follow_up_kind(question) == kind
+
+
+def answer(text, sql=None):
+    result = {"columns": ["n"], "rows": [{"n": 1}], "total_rows": 1} if sql else None
+    return {"answer": text, "sql": sql, "result": result}
+
+
+def test_concurrent_turns_are_both_kept(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.sqlite3"))
+    store.record(store.load("s"), "first", answer("one"))
+
+    # two requests load the same state and finish one after the other
+    slow, fast = store.load("s"), store.load("s")
+    store.record(fast, "fast", answer("two", "SELECT 2"))
+    slow.remember_schema("schema of the slow request")
+    store.record(slow, "slow", answer("three", "SELECT 3"))
+
+    session = store.load("s")
+    assert [turn["question"] for turn in session.turns] == ["first", "fast", "slow"]
+    assert session.last["sql"] == "SELECT 3"
+    assert session.schema_context == "schema of the slow request"
+
+
+def test_save_refuses_a_stale_copy(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.sqlite3"))
+    first, second = store.load("s"), store.load("s")
+    assert store.save(first) is True
+    assert store.save(second) is False
+    assert store.save(store.load("s")) is True
+
+
+def last_query(question, sql, columns, total_rows=3, params=None):
+    return {"question": question, "sql": sql, "params": params or {}, "columns": columns,
+            "rows": [], "total_rows": total_rows}
+
+
+def test_narrowing_a_router_query_rebinds_its_branch():
+    sql = ("SELECT SUM(a.balance) AS total_deposits FROM branches b JOIN accounts a ON a.branch_id = b.branch_id "
+           "WHERE a.deleted_at IS NULL AND lower(b.branch_name) = lower(:branch)")
+    last = last_query("total deposits in branch_1", sql, ["total_deposits"], 1, {"branch": "Branch_1"})
+    assert narrow_to_branch(last, "Branch_2") == ("total deposits in Branch_2", sql, {"branch": "Branch_2"})
+
+
+def test_narrowing_adds_the_branch_predicate():
+    sql = ("SELECT COUNT(*) AS n FROM branches b JOIN loans l ON l.branch_id = b.branch_id "
+           "WHERE l.deleted_at IS NULL LIMIT 100001")
+    asked, narrowed, params = narrow_to_branch(last_query("How many loans?", sql, ["n"], 1), "Branch_4")
+    assert asked == "How many loans in Branch_4"
+    assert "AND LOWER(b.branch_name) = LOWER(:followup_branch) LIMIT" in narrowed
+    assert params == {"followup_branch": "Branch_4"}
+
+
+@pytest.mark.parametrize("sql, columns", [
+    # already filtered on a branch: a second predicate would contradict it
+    ("SELECT COUNT(*) FROM branches b JOIN loans l ON l.branch_id = b.branch_id "
+     "WHERE lower(b.branch_name) = 'branch_1'", ["count"]),
+    ("SELECT COUNT(*) FROM loans l WHERE l.branch_id = 1", ["count"]),
+    # the top 3 branches are not the rows of one branch
+    ("SELECT b.branch_name, SUM(a.balance) AS total FROM branches b JOIN accounts a ON a.branch_id = b.branch_id "
+     "GROUP BY b.branch_name ORDER BY total DESC LIMIT 3", ["branch_name", "total"]),
+    ("SELECT b.branch_name FROM branches b ORDER BY b.branch_name OFFSET 2", ["branch_name"]),
+])
+def test_narrowing_falls_through_to_the_agent(sql, columns):
+    assert narrow_to_branch(last_query("q", sql, columns), "Branch_2") is None
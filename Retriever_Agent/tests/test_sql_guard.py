@@ -0,0 +1,69 @@
+import pytest
+
+from sql_guard import GuardError, SQLGuard
+
+
+@pytest.fixture
+def guard():
+    return SQLGuard(max_rows=100)
+
+
+def test_rejects_writes_and_multiple_statements(guard):
+    for sql in ("DELETE FROM loans", "SELECT 1; SELECT 2",
+                "WITH gone AS (DELETE FROM loans RETURNING *) SELECT * FROM gone",
+                "SELECT pg_sleep(10)"):
+        with pytest.raises(GuardError):
+            guard.rewrite(sql)
+
+
+def test_limit_is_clamped(guard):
+    assert guard.rewrite("SELECT * FROM loans LIMIT 5").endswith("LIMIT 5")
+    assert guard.rewrite("SELECT * FROM loans LIMIT 5000").endswith("LIMIT 101")
+    assert guard.rewrite("SELECT * FROM loans").endswith("LIMIT 101")
+
+
+def test_fetch_first_is_kept_or_clamped(guard):
+    assert guard.rewrite("SELECT * FROM loans FETCH FIRST 5 ROWS ONLY").endswith("FETCH FIRST 5 ROWS ONLY")
+    assert guard.rewrite("SELECT * FROM loans FETCH FIRST 500 ROWS ONLY").endswith("FETCH FIRST 101 ROWS ONLY")
+    assert guard.rewrite("SELECT * FROM loans FETCH FIRST 5 ROWS WITH TIES").endswith("LIMIT 101")
+
+
+def test_soft_delete_where_for_inner_and_comma_joins(guard):
+    sql = guard.rewrite("SELECT * FROM loans l, accounts a WHERE a.customer_id = l.customer_id")
+    assert "l.deleted_at IS NULL" in sql and "a.deleted_at IS NULL" in sql
+
+
+def test_soft_delete_left_join_on_clause(guard):
+    sql = guard.rewrite("SELECT * FROM loans l LEFT JOIN accounts a ON a.customer_id = l.customer_id")
+    assert "ON a.customer_id = l.customer_id AND a.deleted_at IS NULL" in sql
+    assert "WHERE l.deleted_at IS NULL" in sql
+
+
+def test_soft_delete_left_join_using(guard):
+    sql = guard.rewrite("SELECT l.loan_id FROM loans l LEFT JOIN accounts a USING (customer_id)")
+    assert "LEFT JOIN (SELECT * FROM accounts WHERE deleted_at IS NULL) AS a USING (customer_id)" in sql
+    assert "WHERE l.deleted_at IS NULL" in sql
+
+
+def test_soft_delete_full_join_keeps_both_sides_outer(guard):
+    sql = guard.rewrite("SELECT * FROM loans l FULL JOIN accounts a ON a.customer_id = l.customer_id")
+    assert "FROM (SELECT * FROM loans WHERE deleted_at IS NULL) AS l" in sql
+    assert "FULL JOIN (SELECT * FROM accounts WHERE deleted_at IS NULL) AS a" in sql
+    assert "WHERE" not in sql.split("ON", 1)[1]
+
+
+def test_deleted_at_in_select_list_does_not_count(guard):
+    sql = guard.rewrite("SELECT l.loan_id, l.deleted_at FROM loans l")
+    assert "WHERE l.deleted_at IS NULL" in sql
+
+
+def test_shadowed_alias_in_subquery_does_not_count(guard):
+    sql = guard.rewrite(
+        "SELECT l.loan_id FROM loans l WHERE EXISTS (SELECT 1 FROM repayments l WHERE l.deleted_at IS NULL)"
+    )
+    assert sql.count("l.deleted_at IS NULL") == 2
+
+
+def test_explicit_deleted_at_filter_is_respected(guard):
+    sql = guard.rewrite("SELECT * FROM loans WHERE deleted_at IS NOT NULL")
+    assert "IS NULL" not in sql.replace("IS NOT NULL", "")
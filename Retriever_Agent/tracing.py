@@ -0,0 +1,246 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_TRACE_FILE = "traces/spans.jsonl"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    """One timed operation; `attributes` follow OpenTelemetry naming where one exists."""
+
+    def __init__(self, name: str, trace_id: str, parent=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.children = []
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def fail(self, error):
+        self.error = str(error)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        """The span in OTLP/JSON span layout, one per line of the trace file."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    """
+    Collects spans per question and appends every finished trace to a JSONL file.
+
+    `trace()` opens the root span of a question; `span()` nests under
+    whatever span is current in the calling context. When a root span ends,
+    all spans of its trace are exported and handed to the registered
+    listeners, and the root keeps them in `root.children` for display.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get("TRACE_FILE", DEFAULT_TRACE_FILE)
+        self._lock = threading.Lock()
+        self._traces = {}
+        self.listeners = []
+
+    def start_span(self, name: str, parent=None, **attributes) -> Span:
+        parent = parent if parent is not None else _current_span.get()
+        trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        span = Span(name, trace_id, parent, **attributes)
+        with self._lock:
+            self._traces.setdefault(trace_id, [])
+        return span
+
+    def end_span(self, span: Span):
+        span.end_ns = time.time_ns()
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                return
+            spans.append(span)
+            if span.parent_id is not None:
+                return
+            finished = self._traces.pop(span.trace_id)
+        span.children = sorted((s for s in finished if s is not span), key=lambda s: s.start_ns)
+        self._export(finished)
+        for listener in self.listeners:
+            listener(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.fail(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Root span of one question, independent of any span already current."""
+        token = _current_span.set(None)
+        try:
+            with self.span(name, **attributes) as root:
+                yield root
+        finally:
+            _current_span.reset(token)
+
+    def _export(self, spans):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps(s.to_otlp()) + "\n" for s in spans)
+        with self._lock, open(self.path, "a") as f:
+            f.write(lines)
+
+    def callback_handler(self):
+        """A LangChain callback handler recording LLM and tool calls as spans."""
+        return _handler_class()(self)
+
+
+class SpanCallbacks:
+    """LangChain callbacks that turn every LLM call and tool call into a span."""
+
+    # run in the caller's context, not on an executor thread, so the current
+    # span is visible to the tool body
+    run_inline = True
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, name, **attributes):
+        span = self.tracer.start_span(name, **attributes)
+        with self._lock:
+            self._spans[run_id] = (span, _current_span.get())
+        return span
+
+    def _end(self, run_id):
+        with self._lock:
+            span, parent = self._spans.pop(run_id, (None, None))
+        if span is not None:
+            self.tracer.end_span(span)
+        return span, parent
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model") or (serialized or {}).get("name")
+        self._start(run_id, "llm.call", **{"llm.model": model, "llm.messages": sum(len(m) for m in messages)})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            span = self._spans.get(run_id, (None, None))[0]
+        if span is not None:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            if not usage and response.generations and response.generations[0]:
+                message = getattr(response.generations[0][0], "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+            span.set(**{
+                "llm.input_tokens": usage.get("prompt_tokens", usage.get("input_tokens")),
+                "llm.output_tokens": usage.get("completion_tokens", usage.get("output_tokens")),
+            })
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            span = self._spans.get(run_id, (None, None))[0]
+        if span is not None:
+            span.fail(error)
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name", "tool")
+        span = self._start(run_id, f"tool.{name}", **{"tool.input": input_str[:500]})
+        # spans opened inside the tool body (e.g. sql.execute) nest under it
+        _current_span.set(span)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        with self._lock:
+            span = self._spans.get(run_id, (None, None))[0]
+        if span is not None:
+            content = getattr(output, "content", output)
+            artifact = getattr(output, "artifact", None)
+            if isinstance(artifact, dict):
+                span.set(**{"db.rows": artifact.get("total_rows")})
+            if isinstance(content, str) and content.startswith("Error"):
+                span.fail(content)
+        _, parent = self._end(run_id)
+        _current_span.set(parent)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            span = self._spans.get(run_id, (None, None))[0]
+        if span is not None:
+            span.fail(error)
+        _, parent = self._end(run_id)
+        _current_span.set(parent)
+
+
+_handler = None
+
+
+def _handler_class():
+    # langchain_core is only imported once a handler is actually needed
+    global _handler
+    if _handler is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class TracingCallbackHandler(SpanCallbacks, BaseCallbackHandler):
+            pass
+
+        _handler = TracingCallbackHandler
+    return _handler
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide `Tracer`."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
@@ -137,6 +137,15 @@ FOR EACH ROW
 EXECUTE FUNCTION set_updated_at();
 
 
+-- Change probe of the agent's result cache on replicas (result_cache.py):
+-- max(updated_at) per table reads one entry of these indexes
+CREATE INDEX idx_branches_updated_at ON branches (updated_at);
+CREATE INDEX idx_customers_updated_at ON customers (updated_at);
+CREATE INDEX idx_accounts_updated_at ON accounts (updated_at);
+CREATE INDEX idx_loans_updated_at ON loans (updated_at);
+CREATE INDEX idx_repayments_updated_at ON repayments (updated_at);
+
+
 -- To exclude deleted rows, queries should always include:
 -- WHERE deleted_at IS NULL
 
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import re
+from glob import glob
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+DEFAULT_INDEX_DIR = ".chroma"
+
+# tables of trad_db/Table_Creation.sql
+SCHEMA_TABLES = ("branches", "customers", "accounts", "loans", "repayments")
+
+_SECTION_RE = re.compile(r"^###\s*(.*)$")
+_BLOCK_RE = re.compile(r"^\*\*(.+?)\*\*\s*$")
+_BULLET_RE = re.compile(r"^\*\s+\*\*(.+?)\*\*")
+_TABLE_HEADER_RE = re.compile(r"\(`(\w+)`\)")
+_TABLE_REF_RE = re.compile(r"\b(" + "|".join(SCHEMA_TABLES) + r")\b")
+
+
+def _blocks(lines):
+    """Split a section's lines at bold headers, or at bold bullets when it has none."""
+    starts = [i for i, line in enumerate(lines) if _BLOCK_RE.match(line.strip())]
+    if not starts:
+        starts = [i for i, line in enumerate(lines) if _BULLET_RE.match(line.strip())]
+    if not starts:
+        return [(None, lines)]
+    blocks = [(None, lines[:starts[0]])] if any(l.strip() for l in lines[:starts[0]]) else []
+    for n, start in enumerate(starts):
+        end = starts[n + 1] if n + 1 < len(starts) else len(lines)
+        header = (_BLOCK_RE.match(lines[start].strip()) or _BULLET_RE.match(lines[start].strip())).group(1)
+        blocks.append((header.rstrip(":"), lines[start:end]))
+    return blocks
+
+
+def _chunk_metadata(source: str, section: str, header: str, body: str) -> dict:
+    tables = sorted(set(_TABLE_REF_RE.findall(body)))
+    table = _TABLE_HEADER_RE.search(header or "")
+    if table and table.group(1) in SCHEMA_TABLES:
+        kind = "table"
+    elif header and "join" in header.lower():
+        kind = "joins"
+    elif "intent" in section.lower():
+        kind = "intent"
+    elif "rule" in section.lower():
+        kind = "rule"
+    else:
+        kind = "guide"
+    metadata = {
+        "source": source,
+        "section": section,
+        "kind": kind,
+        # Chroma metadata values are scalars
+        "tables": ",".join(tables),
+    }
+    if kind == "table":
+        metadata["table"] = table.group(1)
+    if header:
+        metadata["title"] = header
+    return metadata
+
+
+def load_schema_chunks(docs_glob: str = "docs/*.txt"):
+    """
+    Split every file matched by `docs_glob` along its own structure.
+
+    Each `### section` is cut at its bold headers: one chunk per table
+    description, one for the JOIN relationships and one per numbered rule.
+    Sections without headers are cut at their bold bullets (one chunk per
+    intent mapping). Every chunk starts with its section title and carries
+    `section`, `kind` (table, joins, rule, intent or guide), `title`, the
+    `table` it describes and the comma-separated `tables` it mentions.
+    """
+    texts = []
+    for file_path in sorted(glob(docs_glob)):
+        with open(file_path, "r") as f:
+            lines = f.read().splitlines()
+        sections, title, current = [], None, []
+        for line in lines:
+            match = _SECTION_RE.match(line)
+            if match:
+                if title:
+                    sections.append((title, current))
+                title, current = match.group(1).strip().rstrip(":"), []
+            else:
+                current.append(line)
+        if title:
+            sections.append((title, current))
+
+        for section, section_lines in sections:
+            for header, block in _blocks(section_lines):
+                body = "\n".join(block).strip()
+                if not body:
+                    continue
+                texts.append(Document(
+                    page_content=f"### {section}\n{body}",
+                    metadata=_chunk_metadata(file_path, section, header, body),
+                ))
+    return texts
+
+
+def chunk_id(doc) -> str:
+    """Stable id of a chunk: hash of its source path and content."""
+    digest = hashlib.sha256()
+    digest.update(doc.metadata.get("source", "").encode())
+    digest.update(b"\0")
+    digest.update(doc.page_content.encode())
+    return digest.hexdigest()
+
+
+class SchemaIndex:
+    """
+    On-disk Chroma collection of the docs/ chunks.
+
+    Each chunk is stored under the hash of its content, so `sync` only embeds
+    chunks that were added or changed and deletes chunks whose source text is
+    gone. Opening an up-to-date index costs no embedding calls. Vectors from
+    different embedding backends are not comparable, so each non-default
+    backend (see embeddings.py) gets its own collection.
+    """
+
+    def __init__(self, embeddings, docs_glob: str = "docs/*.txt",
+                 persist_directory: str = None, collection_name: str = None):
+        self.docs_glob = docs_glob
+        self.persist_directory = persist_directory or os.environ.get(
+            "SCHEMA_INDEX_DIR", DEFAULT_INDEX_DIR
+        )
+        if collection_name is None:
+            backend = getattr(embeddings, "backend", "torch")
+            collection_name = "schema_rag" if backend == "torch" else f"schema_rag-{backend}"
+        self.documents = []
+        self.store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory=self.persist_directory,
+        )
+
+    def sync(self) -> dict:
+        """
+        Bring the collection in line with the files on disk.
+
+        Returns:
+            Counts of chunks added, deleted and left untouched.
+        """
+        wanted = {}
+        for doc in load_schema_chunks(self.docs_glob):
+            key = chunk_id(doc)
+            doc.metadata["content_hash"] = key
+            wanted[key] = doc
+
+        existing = set(self.store.get(include=[])["ids"])
+        stale = [key for key in existing if key not in wanted]
+        new = [key for key in wanted if key not in existing]
+
+        if stale:
+            self.store.delete(ids=stale)
+        if new:
+            self.store.add_documents([wanted[key] for key in new], ids=new)
+        self.documents = list(wanted.values())
+
+        return {
+            "added": len(new),
+            "deleted": len(stale),
+            "unchanged": len(existing) - len(stale),
+        }
+
+    def as_retriever(self, **kwargs):
+        return self.store.as_retriever(**kwargs)